@@ -1,21 +1,53 @@
+import io
 import logging
-from fastapi import FastAPI, HTTPException, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from . import models, database
-from pydantic import BaseModel, Field
-from typing import List, Optional
-from datetime import date, timedelta, datetime
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import cache, illness, models, database, readings, reporting, watermarks
+from .instrumentation import RequestTimingMiddleware, request_metrics
+from .logging_config import configure_logging
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import Any, Dict, List, Literal, Optional
+from datetime import date, datetime, time
 from uuid import UUID
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("app.log"), logging.StreamHandler()],
-)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging("app.log")
+    with database.SessionLocal() as db:
+        illness.detector.rebuild(db)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestTimingMiddleware)
+
+# Seconds a client is asked to wait when the database is busy.
+DATABASE_BUSY_RETRY_AFTER = 1
+
+
+@app.exception_handler(OperationalError)
+async def database_busy(request: Request, exc: OperationalError):
+    if "database is locked" not in str(exc.orig):
+        raise exc
+    logger.warning("Database busy on %s %s: %s", request.method, request.url.path, exc.orig)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database busy"},
+        headers={"Retry-After": str(DATABASE_BUSY_RETRY_AFTER)},
+    )
+
+
+async def get_write_db(db: AsyncSession = Depends(database.get_async_db)):
+    """The session of a handler that writes, see ``database.serialized_writes``."""
+    async with database.serialized_writes(db):
+        yield db
 
 
 class CowCreate(BaseModel):
@@ -28,10 +60,71 @@ class SensorData(BaseModel):
     value: float = Field(..., gt=0)
 
 
+class BulkReading(SensorData):
+    cow_id: UUID
+    type: Literal["milk", "weight"]
+    # Readings that name their sensor and exact time are deduplicated on
+    # (cow_id, sensor_id, timestamp), so uploads can be safely replayed.
+    sensor_id: Optional[UUID] = None
+    timestamp: Optional[datetime] = None
+
+
+class BulkReadings(BaseModel):
+    # Rows are validated one by one in the handler so that a single bad row
+    # is rejected on its own instead of failing the whole request.
+    readings: List[Dict[str, Any]]
+
+
+class BulkRejection(BaseModel):
+    index: int
+    detail: str
+
+
+class BulkReadingsResult(BaseModel):
+    accepted: int
+    duplicates: int = 0
+    rejected: int
+    rejections: List[BulkRejection] = []
+
+
+class SensorMeasurement(SensorData):
+    cow_id: UUID
+    timestamp: Optional[datetime] = None
+
+
 class SensorCreate(BaseModel):
     unit: str
 
 
+class CowRegistration(CowCreate):
+    id: UUID
+
+
+class SensorRegistration(SensorCreate):
+    id: UUID
+
+
+class CowRegistrations(BaseModel):
+    cows: List[CowRegistration]
+
+
+class SensorRegistrations(BaseModel):
+    sensors: List[SensorRegistration]
+
+
+class RegistrationResult(BaseModel):
+    created: int
+    existing: int
+
+
+class IdLookup(BaseModel):
+    ids: List[UUID]
+
+
+class KnownIds(BaseModel):
+    known: List[UUID]
+
+
 class CowDetails(BaseModel):
     id: UUID
     latest_milk_production: Optional[float] = None
@@ -51,182 +144,484 @@ class CowReport(BaseModel):
     potentially_ill: bool = False
 
 
+class CowAlert(BaseModel):
+    cow_id: UUID
+    day: date
+    total_milk: Optional[float] = None
+    latest_weight: Optional[float] = None
+    avg_weight_last_30_days: Optional[float] = None
+
+
+@app.post("/cows", response_model=RegistrationResult)
+async def register_cows(
+    payload: CowRegistrations, db: AsyncSession = Depends(get_write_db)
+):
+    logger.debug("Registering %d cows in bulk", len(payload.cows))
+    created = await db.run_sync(
+        readings.insert_missing,
+        models.Cow,
+        [
+            {"id": str(cow.id), "name": cow.name, "birthdate": cow.birthdate}
+            for cow in payload.cows
+        ],
+    )
+    await db.commit()
+    return RegistrationResult(created=created, existing=len(payload.cows) - created)
+
+
+# Declared before /cows/{id} so that "lookup" is not parsed as a cow id.
+@app.post("/cows/lookup", response_model=KnownIds)
+async def lookup_cows(
+    payload: IdLookup, db: AsyncSession = Depends(database.get_async_db)
+):
+    known = await db.run_sync(
+        readings.known_ids, models.Cow, [str(id) for id in payload.ids]
+    )
+    return KnownIds(known=sorted(known))
+
+
 @app.post("/cows/{id}", status_code=201)
-def create_cow(id: UUID, cow: CowCreate, db: Session = Depends(database.get_db)):
-    logger.info(
-        f"Creating cow with ID: {id}, Name: {cow.name}, Birthdate: {cow.birthdate}"
+async def create_cow(
+    id: UUID, cow: CowCreate, db: AsyncSession = Depends(get_write_db)
+):
+    logger.debug(
+        "Creating cow with ID: %s, Name: %s, Birthdate: %s", id, cow.name, cow.birthdate
     )
-    db_cow = db.query(models.Cow).filter(models.Cow.id == str(id)).first()
+    db_cow = await db.scalar(select(models.Cow.id).where(models.Cow.id == str(id)))
     if db_cow:
-        logger.warning(f"Cow with ID {id} already registered.")
+        logger.warning("Cow with ID %s already registered.", id)
         raise HTTPException(status_code=409, detail="Cow already registered")
 
     new_cow = models.Cow(id=str(id), name=cow.name, birthdate=cow.birthdate)
     db.add(new_cow)
-    db.commit()
-    db.refresh(new_cow)
-    logger.info(f"Cow created successfully: {new_cow}")
+    await db.commit()
+    logger.debug("Cow created successfully: %s", id)
     return {"message": "Cow created successfully"}
 
 
-@app.post("/cows/{id}/milk")
-def add_milk_production(
-    id: UUID, data: SensorData, db: Session = Depends(database.get_db)
+@app.post("/cows/{id}/milk", status_code=201)
+async def add_milk_production(
+    id: UUID,
+    data: SensorData,
+    db: AsyncSession = Depends(get_write_db),
+    cow_cache: cache.CacheBackend = Depends(cache.get_cow_cache),
 ):
-    logger.info(
-        f"Adding milk production for cow ID: {id}, Date: {data.date}, Amount: {data.value}"
+    logger.debug(
+        "Adding milk production for cow ID: %s, Date: %s, Amount: %s",
+        id,
+        data.date,
+        data.value,
     )
-    db_cow = db.query(models.Cow).filter(models.Cow.id == str(id)).first()
+    db_cow = await db.scalar(select(models.Cow.id).where(models.Cow.id == str(id)))
     if not db_cow:
-        logger.error(f"Cow with ID {id} not found.")
+        logger.error("Cow with ID %s not found.", id)
         raise HTTPException(status_code=404, detail="Cow not found")
 
-    new_production = models.MilkProduction(
-        cow_id=str(id), timestamp=data.date, value=data.value
+    await db.run_sync(
+        readings.insert_readings,
+        "milk",
+        [{"cow_id": str(id), "timestamp": data.date, "value": data.value}],
     )
-    db.add(new_production)
-    db.commit()
-    logger.info(f"Milk production data added successfully for cow ID: {id}")
-    return {"message": "Milk production data added successfully"}, 201
-
-
-@app.post("/cows/{id}/weight")
-def add_weight(id: UUID, data: SensorData, db: Session = Depends(database.get_db)):
-    logger.info(
-        f"Adding weight for cow ID: {id}, Date: {data.date}, Weight: {data.value}"
+    await db.commit()
+    await cow_cache.delete_many([str(id)])
+    logger.debug("Milk production data added successfully for cow ID: %s", id)
+    return {"message": "Milk production data added successfully"}
+
+
+@app.post("/cows/{id}/weight", status_code=201)
+async def add_weight(
+    id: UUID,
+    data: SensorData,
+    db: AsyncSession = Depends(get_write_db),
+    cow_cache: cache.CacheBackend = Depends(cache.get_cow_cache),
+):
+    logger.debug(
+        "Adding weight for cow ID: %s, Date: %s, Weight: %s", id, data.date, data.value
     )
-    db_cow = db.query(models.Cow).filter(models.Cow.id == str(id)).first()
+    db_cow = await db.scalar(select(models.Cow.id).where(models.Cow.id == str(id)))
     if not db_cow:
-        logger.error(f"Cow with ID {id} not found.")
+        logger.error("Cow with ID %s not found.", id)
         raise HTTPException(status_code=404, detail="Cow not found")
 
-    new_weight = models.Weight(cow_id=str(id), timestamp=data.date, value=data.value)
-    db.add(new_weight)
-    db.commit()
-    logger.info(f"Weight data added successfully for cow ID: {id}")
-    return {"message": "Weight data added successfully"}, 201
+    await db.run_sync(
+        readings.insert_readings,
+        "weight",
+        [{"cow_id": str(id), "timestamp": data.date, "value": data.value}],
+    )
+    await db.commit()
+    await cow_cache.delete_many([str(id)])
+    logger.debug("Weight data added successfully for cow ID: %s", id)
+    return {"message": "Weight data added successfully"}
 
 
-@app.get("/cows/{id}", response_model=CowDetails)
-def get_cow_details(id: UUID, db: Session = Depends(database.get_db)):
-    logger.info(f"Fetching details for cow ID: {id}")
-    db_cow = db.query(models.Cow).filter(models.Cow.id == str(id)).first()
-    if not db_cow:
-        logger.error(f"Cow with ID {id} not found.")
-        raise HTTPException(status_code=404, detail="Cow not found")
+@app.post("/measurements/bulk", response_model=BulkReadingsResult)
+async def add_readings_bulk(
+    payload: BulkReadings,
+    db: AsyncSession = Depends(get_write_db),
+    cow_cache: cache.CacheBackend = Depends(cache.get_cow_cache),
+):
+    logger.debug("Adding %d readings in bulk", len(payload.readings))
+    rejections = []
+    valid = []
+    for index, raw in enumerate(payload.readings):
+        try:
+            valid.append((index, BulkReading.model_validate(raw)))
+        except ValidationError as e:
+            errors = "; ".join(
+                f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}"
+                for err in e.errors()
+            )
+            rejections.append(BulkRejection(index=index, detail=errors))
 
-    latest_milk = (
-        db.query(models.MilkProduction)
-        .filter(models.MilkProduction.cow_id == str(id))
-        .order_by(models.MilkProduction.timestamp.desc())
-        .first()
+    known_cows = await db.run_sync(
+        readings.known_cow_ids, [str(r.cow_id) for _, r in valid]
     )
-    latest_weight = (
-        db.query(models.Weight)
-        .filter(models.Weight.cow_id == str(id))
-        .order_by(models.Weight.timestamp.desc())
-        .first()
+    known_sensors = await db.run_sync(
+        readings.known_ids,
+        models.Sensor,
+        [str(r.sensor_id) for _, r in valid if r.sensor_id],
     )
 
-    return CowDetails(
-        id=id,
-        latest_milk_production=latest_milk.value if latest_milk else None,
-        latest_weight=latest_weight.value if latest_weight else None,
+    rows = {kind: [] for kind in readings.READING_MODELS}
+    measured = {kind: [] for kind in readings.READING_MODELS}
+    for index, reading in valid:
+        if str(reading.cow_id) not in known_cows:
+            rejections.append(BulkRejection(index=index, detail="Cow not found"))
+            continue
+        if reading.sensor_id is None:
+            rows[reading.type].append(
+                {
+                    "cow_id": str(reading.cow_id),
+                    "timestamp": reading.timestamp or reading.date,
+                    "value": reading.value,
+                }
+            )
+        elif str(reading.sensor_id) in known_sensors:
+            measured[reading.type].append(
+                {
+                    "cow_id": str(reading.cow_id),
+                    "sensor_id": str(reading.sensor_id),
+                    "timestamp": reading.timestamp
+                    or datetime.combine(reading.date, time.min),
+                    "value": reading.value,
+                }
+            )
+        else:
+            rejections.append(BulkRejection(index=index, detail="Sensor not found"))
+
+    accepted = 0
+    duplicates = 0
+    for kind in readings.READING_MODELS:
+        accepted += await db.run_sync(readings.insert_readings, kind, rows[kind])
+        new = await db.run_sync(
+            readings.insert_measured_readings, kind, measured[kind]
+        )
+        accepted += new
+        duplicates += len(measured[kind]) - new
+    await db.commit()
+    await cow_cache.delete_many(
+        {
+            row["cow_id"]
+            for kind_rows in (*rows.values(), *measured.values())
+            for row in kind_rows
+        }
+    )
+
+    rejections.sort(key=lambda r: r.index)
+    logger.debug(
+        "Bulk readings stored: %d accepted, %d duplicates, %d rejected",
+        accepted,
+        duplicates,
+        len(rejections),
+    )
+    return BulkReadingsResult(
+        accepted=accepted,
+        duplicates=duplicates,
+        rejected=len(rejections),
+        rejections=rejections,
     )
 
 
+COW_REPORTS = TypeAdapter(List[CowReport])
+
+# Rows per chunk written to a streamed NDJSON report.
+REPORT_STREAM_BATCH_SIZE = 500
+
+
+# Declared before /cows/{id} so that "report" is not parsed as a cow id.
 @app.get("/cows/report", response_model=List[CowReport])
-def generate_report(
-    report_date: Optional[date] = None, db: Session = Depends(database.get_db)
+async def generate_report(
+    request: Request,
+    report_date: Optional[date] = None,
+    after: Optional[UUID] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    format: Literal["json", "ndjson", "csv", "text"] = "json",
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(database.get_async_db),
+    report_cache: cache.VersionedCache = Depends(cache.get_report_cache),
 ):
-    logger.info("Generating farm report.")
+    """Report every cow, or with ``limit`` one page of cows ordered by id.
+
+    A full page carries the cursor of the next one in the ``X-Next-After``
+    header and a ``Link: rel="next"`` URL. ``format=ndjson`` streams one
+    JSON object per line as the rows come off the database cursor;
+    ``format=csv`` and ``format=text`` stream the same rows as CSV or as the
+    text report of ``python -m app.reporting``.
+
+    JSON reports are cached per date and page until a reading in the
+    report's window is stored, see ``app.watermarks``; streamed formats
+    always read the database.
+
+    With ``from`` and ``to`` every day of the range is reported at once and
+    the result is one JSON object of equally long columns, ``day`` and
+    ``cow_id`` first, ordered by day and cow id. ``format=csv`` and
+    ``format=text`` answer with the range report of ``python -m
+    app.reporting --from ... --to ...`` instead. The range is computed as a
+    whole, so there is no ``ndjson`` stream of it and that format is
+    rejected with 422.
+    """
+    logger.debug("Generating farm report.")
+
+    if from_date is not None or to_date is not None:
+        if from_date is None or to_date is None:
+            raise HTTPException(status_code=422, detail="from and to go together")
+        if from_date > to_date:
+            raise HTTPException(status_code=422, detail="from is after to")
+        if (to_date - from_date).days >= reporting.MAX_RANGE_DAYS:
+            raise HTTPException(
+                status_code=422,
+                detail=f"A range covers at most {reporting.MAX_RANGE_DAYS} days",
+            )
+        if format == "ndjson":
+            raise HTTPException(
+                status_code=422, detail="A range is reported as json, csv or text"
+            )
+        if format in ("csv", "text"):
+            out = io.StringIO()
+            await db.run_sync(
+                reporting.write_range_report, from_date, to_date, out, format
+            )
+            media_type = "text/csv" if format == "csv" else "text/plain"
+            return Response(out.getvalue(), media_type=media_type)
+        frame = await db.run_sync(reporting.range_report_frame, from_date, to_date)
+        report = reporting.columnar(frame)
+        report["day"] = [day.isoformat() for day in report["day"]]
+        return JSONResponse(report)
 
     report_date = report_date or date.today()
-    thirty_days_ago = report_date - timedelta(days=30)
+    query = reporting.farm_report_query(
+        report_date, str(after) if after else None, limit
+    )
 
-    cows = db.query(models.Cow).all()
+    if format == "ndjson":
+
+        async def lines():
+            result = await db.stream(query)
+            async for rows in result.partitions(REPORT_STREAM_BATCH_SIZE):
+                yield "".join(
+                    CowReport(**reporting.report_row(row)).model_dump_json() + "\n"
+                    for row in rows
+                )
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    if format == "csv":
+
+        async def csv_chunks():
+            result = await db.stream(query)
+            header = True
+            async for rows in result.partitions(REPORT_STREAM_BATCH_SIZE):
+                yield "".join(
+                    reporting.iter_csv_report(
+                        (reporting.report_row(row) for row in rows), header=header
+                    )
+                )
+                header = False
+            if header:
+                yield "".join(reporting.iter_csv_report([]))
+
+        return StreamingResponse(csv_chunks(), media_type="text/csv")
+
+    if format == "text":
+
+        async def text_sections():
+            report = reporting.TextReport(report_date)
+            yield report.header()
+            result = await db.stream(query)
+            async for rows in result.partitions(REPORT_STREAM_BATCH_SIZE):
+                yield report.sections(reporting.report_row(row) for row in rows)
+            yield report.footer()
+
+        return StreamingResponse(text_sections(), media_type="text/plain")
+
+    # The watermark is read before the report, so a write in between can
+    # only make the stored entry look older than it is, never newer.
+    # The encoded body is cached, so a hit skips validation and encoding.
+    key = (report_date, after, limit)
+    version = tuple((await db.execute(watermarks.watermark_query(report_date))).one())
+    entry = await report_cache.get(key, version)
+    if entry is None:
+        result = await db.execute(query)
+        report = [CowReport(**reporting.report_row(row)) for row in result]
+        next_after = None
+        if limit is not None and len(report) == limit:
+            next_after = str(report[-1].cow_id)
+        entry = (COW_REPORTS.dump_json(report), next_after)
+        await report_cache.set(key, version, entry)
+    body, next_after = entry
+    headers = {}
+    if next_after is not None:
+        headers["X-Next-After"] = next_after
+        next_url = request.url.include_query_params(after=next_after)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# Declared before /cows/{id} so that "alerts" is not parsed as a cow id.
+@app.get("/cows/alerts", response_model=List[CowAlert])
+async def get_alerts():
+    """Cows that look ill on their newest day of readings, see ``app.illness``."""
+    return illness.detector.alerts()
 
-    report_data = []
 
-    for cow in cows:
-        total_milk = (
-            db.query(func.sum(models.MilkProduction.value))
-            .filter(
-                models.MilkProduction.cow_id == cow.id,
-                func.date(models.MilkProduction.timestamp) == report_date,
+@app.get("/cows/{id}", response_model=CowDetails)
+async def get_cow_details(
+    id: UUID,
+    db: AsyncSession = Depends(database.get_async_db),
+    cow_cache: cache.CacheBackend = Depends(cache.get_cow_cache),
+):
+    logger.debug("Fetching details for cow ID: %s", id)
+    cached = await cow_cache.get(str(id))
+    if cached is not None:
+        return cached
+    # Taken before the read, so a write invalidating the cow meanwhile
+    # keeps the row read here out of the cache.
+    generation = cow_cache.generation(str(id))
+    # A primary key read: the latest readings are kept on the cow row.
+    db_cow = (
+        await db.execute(
+            select(models.Cow.latest_milk, models.Cow.latest_weight).where(
+                models.Cow.id == str(id)
             )
-            .scalar()
         )
+    ).first()
+    if not db_cow:
+        logger.error("Cow with ID %s not found.", id)
+        raise HTTPException(status_code=404, detail="Cow not found")
+    latest_milk, latest_weight = db_cow
 
-        latest_weight = (
-            db.query(models.Weight.value)
-            .filter(models.Weight.cow_id == cow.id)
-            .order_by(models.Weight.timestamp.desc())
-            .first()
-        )
+    details = CowDetails(
+        id=id,
+        latest_milk_production=latest_milk,
+        latest_weight=latest_weight,
+    )
+    await cow_cache.set(str(id), details, generation)
+    return details
 
-        avg_weight = (
-            db.query(func.avg(models.Weight.value))
-            .filter(
-                models.Weight.cow_id == cow.id,
-                models.Weight.timestamp >= thirty_days_ago,
-            )
-            .scalar()
-        )
 
-        potentially_ill = False
-        if latest_weight and avg_weight and latest_weight[0] < (0.9 * avg_weight):
-            potentially_ill = True
-
-        report_data.append(
-            CowReport(
-                cow_id=cow.id,
-                total_milk=total_milk,
-                latest_weight=latest_weight[0] if latest_weight else None,
-                avg_weight_last_30_days=avg_weight,
-                potentially_ill=potentially_ill,
-            )
-        )
+@app.get("/cache/stats")
+async def get_cache_stats(
+    cow_cache: cache.CacheBackend = Depends(cache.get_cow_cache),
+    report_cache: cache.VersionedCache = Depends(cache.get_report_cache),
+):
+    return {"cow_details": cow_cache.stats(), "report": report_cache.stats()}
 
-    return report_data
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return request_metrics.prometheus_text()
+
+
+@app.post("/sensors", response_model=RegistrationResult)
+async def register_sensors(
+    payload: SensorRegistrations, db: AsyncSession = Depends(get_write_db)
+):
+    logger.debug("Registering %d sensors in bulk", len(payload.sensors))
+    created = await db.run_sync(
+        readings.insert_missing,
+        models.Sensor,
+        [{"id": str(sensor.id), "unit": sensor.unit} for sensor in payload.sensors],
+    )
+    await db.commit()
+    return RegistrationResult(
+        created=created, existing=len(payload.sensors) - created
+    )
+
+
+# Declared before /sensors/{id} so that "lookup" is not parsed as a sensor id.
+@app.post("/sensors/lookup", response_model=KnownIds)
+async def lookup_sensors(
+    payload: IdLookup, db: AsyncSession = Depends(database.get_async_db)
+):
+    known = await db.run_sync(
+        readings.known_ids, models.Sensor, [str(id) for id in payload.ids]
+    )
+    return KnownIds(known=sorted(known))
 
 
 @app.post("/sensors/{id}", status_code=201)
-def create_sensor(
-    id: UUID, sensor: SensorCreate, db: Session = Depends(database.get_db)
+async def create_sensor(
+    id: UUID, sensor: SensorCreate, db: AsyncSession = Depends(get_write_db)
 ):
-    logger.info(f"Creating sensor with ID: {id}, Unit: {sensor.unit}")
-    db_sensor = db.query(models.Sensor).filter(models.Sensor.id == str(id)).first()
+    logger.debug("Creating sensor with ID: %s, Unit: %s", id, sensor.unit)
+    db_sensor = await db.scalar(
+        select(models.Sensor.id).where(models.Sensor.id == str(id))
+    )
     if db_sensor:
-        logger.warning(f"Sensor with ID {id} already registered.")
+        logger.warning("Sensor with ID %s already registered.", id)
         raise HTTPException(status_code=409, detail="Sensor already registered")
 
     new_sensor = models.Sensor(id=str(id), unit=sensor.unit)
     db.add(new_sensor)
-    db.commit()
-    db.refresh(new_sensor)
-    logger.info(f"Sensor created successfully: {new_sensor}")
+    await db.commit()
+    logger.debug("Sensor created successfully: %s", id)
     return {"message": "Sensor created successfully"}
 
 
 @app.post("/sensors/{sensor_id}/measurements", status_code=201)
-def add_measurement(
-    sensor_id: UUID, data: SensorData, db: Session = Depends(database.get_db)
+async def add_measurement(
+    sensor_id: UUID,
+    data: SensorMeasurement,
+    db: AsyncSession = Depends(get_write_db),
+    cow_cache: cache.CacheBackend = Depends(cache.get_cow_cache),
 ):
-    logger.info(
-        f"Adding measurement for sensor ID: {sensor_id}, Date: {data.date}, Value: {data.value}"
+    logger.debug(
+        "Adding measurement for sensor ID: %s, Cow ID: %s, Date: %s, Value: %s",
+        sensor_id,
+        data.cow_id,
+        data.date,
+        data.value,
     )
-    db_sensor = (
-        db.query(models.Sensor).filter(models.Sensor.id == str(sensor_id)).first()
+    unit = await db.scalar(
+        select(models.Sensor.unit).where(models.Sensor.id == str(sensor_id))
     )
-    if not db_sensor:
-        logger.error(f"Sensor with ID {sensor_id} not found.")
+    if unit is None:
+        logger.error("Sensor with ID %s not found.", sensor_id)
         raise HTTPException(status_code=404, detail="Sensor not found")
-
-    new_measurement = models.Measurement(
-        sensor_id=str(sensor_id), timestamp=data.date, value=data.value
+    db_cow = await db.scalar(
+        select(models.Cow.id).where(models.Cow.id == str(data.cow_id))
     )
-    db.add(new_measurement)
-    db.commit()
-    logger.info(f"Measurement data added successfully for sensor ID: {sensor_id}")
-    return {"message": "Measurement data added successfully"}, 201
+    if not db_cow:
+        logger.error("Cow with ID %s not found.", data.cow_id)
+        raise HTTPException(status_code=404, detail="Cow not found")
+
+    row = {
+        "cow_id": str(data.cow_id),
+        "sensor_id": str(sensor_id),
+        "timestamp": data.timestamp or datetime.combine(data.date, time.min),
+        "value": data.value,
+    }
+    kind = readings.UNIT_KINDS.get(unit)
+    if kind:
+        new = await db.run_sync(readings.insert_measured_readings, kind, [row])
+    else:
+        new = len(await db.run_sync(readings.record_measurements, [row]))
+    await db.commit()
+    if new and kind:
+        await cow_cache.delete_many([row["cow_id"]])
+    if not new:
+        logger.debug("Measurement for sensor ID %s was already recorded", sensor_id)
+        return {"message": "Measurement already recorded"}
+    logger.debug("Measurement data added successfully for sensor ID: %s", sensor_id)
+    return {"message": "Measurement data added successfully"}
@@ -0,0 +1,415 @@
+"""Caches for hot API lookups.
+
+The API talks to a ``CacheBackend``. The default backend is an in-process
+LRU with a TTL. A shared cache can be plugged in by implementing the same
+async methods and overriding the ``get_cow_cache`` dependency, which is
+also how tests substitute a fresh local cache.
+
+A reader that misses takes the key's ``generation`` before reading the
+database and passes it to ``set``. An invalidation in between changes the
+generation, and the value read before it is not stored.
+
+Settings come from the environment:
+
+``COWSHED_COW_CACHE_SIZE``
+    Maximum number of cows kept in the details cache. Defaults to 10000;
+    0 disables caching.
+``COWSHED_COW_CACHE_TTL``
+    Seconds a cached entry may be served. Defaults to 60. Writes through
+    the API invalidate entries immediately; the TTL bounds staleness from
+    writes that bypass the API, such as ``app.loader``.
+``COWSHED_REPORT_CACHE``
+    Where farm reports are cached: ``memory`` (the default), ``disk`` or
+    ``off``. Entries are checked against the data watermark of their
+    report date, see ``app.watermarks``, so they never need a TTL.
+``COWSHED_REPORT_CACHE_SIZE``
+    Maximum number of cached reports. Defaults to 64.
+``COWSHED_REPORT_CACHE_BYTES``
+    Maximum total size of the reports of the ``memory`` cache, in bytes.
+    Defaults to 64 MiB; a single larger report is not cached.
+``COWSHED_REPORT_CACHE_DIR``
+    Directory of the ``disk`` report cache. Defaults to ``report_cache``.
+    It survives restarts and is shared by the workers of one host.
+"""
+
+import asyncio
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+
+class CacheBackend(ABC):
+    """Interface of the caches used by the API."""
+
+    @abstractmethod
+    async def get(self, key: Hashable) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def generation(self, key: Hashable) -> int:
+        ...
+
+    @abstractmethod
+    async def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        ...
+
+    @abstractmethod
+    async def delete_many(self, keys: Iterable[Hashable]):
+        ...
+
+    @abstractmethod
+    async def clear(self):
+        ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        ...
+
+
+class Generations:
+    """Invalidation counters of the most recently invalidated keys.
+
+    Only ``max_size`` keys are remembered. Keys that were forgotten, or
+    never invalidated, share the newest forgotten counter, so a key's
+    generation never goes back; a forgotten key at worst turns a fill
+    down that would have been safe.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._counter = 0
+        self._floor = 0
+        self._keys: "OrderedDict[Hashable, int]" = OrderedDict()
+
+    def current(self, key: Hashable) -> int:
+        return self._keys.get(key, self._floor)
+
+    def bump(self, keys: Iterable[Hashable]):
+        for key in keys:
+            self._counter += 1
+            self._keys[key] = self._counter
+            self._keys.move_to_end(key)
+        while len(self._keys) > self.max_size:
+            _, counter = self._keys.popitem(last=False)
+            self._floor = max(self._floor, counter)
+
+    def bump_all(self):
+        self._counter += 1
+        self._floor = self._counter
+        self._keys.clear()
+
+
+def value_bytes(value: Any) -> int:
+    """Approximate size of a cached value, dominated by its strings and bytes.
+
+    Numbers and None, such as report versions and cursors, count as nothing.
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(value_bytes(item) for item in value)
+    if value is None or isinstance(value, (int, float)):
+        return 0
+    return sys.getsizeof(value)
+
+
+class LRUCache(CacheBackend):
+    """Size-bounded, least recently used cache whose entries expire after ``ttl``.
+
+    With ``max_bytes``, the total ``value_bytes`` of the entries is bounded
+    too.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+        max_bytes: Optional[int] = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._generations = Generations(max(max_size, 1))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value, _ = entry
+        if expires_at <= self.clock():
+            self._pop(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self, key):
+        return self._generations.current(key)
+
+    async def set(self, key, value, generation=None):
+        if self.max_size <= 0:
+            return
+        if generation is not None and generation != self.generation(key):
+            self.stale_fills += 1
+            return
+        size = 0 if self.max_bytes is None else value_bytes(value)
+        self._pop(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = (self.clock() + self.ttl, value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_size or (
+            self.max_bytes is not None and self._bytes > self.max_bytes
+        ):
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _pop(self, key) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[2]
+        return True
+
+    async def delete_many(self, keys):
+        keys = list(keys)
+        self._generations.bump(keys)
+        for key in keys:
+            if self._pop(key):
+                self.invalidations += 1
+
+    async def clear(self):
+        self._generations.bump_all()
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "stale_fills": self.stale_fills,
+        }
+
+
+class DiskCache(CacheBackend):
+    """Size-bounded cache of pickled entries, one file per key in ``directory``.
+
+    The least recently read or written files are evicted first. Files are
+    written to a unique temporary file then renamed, so a reader never sees
+    a partial entry, and writers of the same key, in this process or
+    another one, do not share a temporary file. Entries removed by another
+    writer in the meantime count as misses.
+    """
+
+    def __init__(self, directory: str, max_size: int = 64):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._generations = Generations(max(max_size, 1))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _path(self, key) -> str:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.pickle")
+
+    def _entries(self):
+        return [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.endswith(".pickle")
+        ]
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted or invalidated since it was read.
+            return None
+        return value
+
+    def _write(self, path, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        entries = []
+        for entry in self._entries():
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        if len(entries) > self.max_size:
+            entries.sort()
+            for _, entry_path in entries[: len(entries) - self.max_size]:
+                if self._remove(entry_path):
+                    self.evictions += 1
+
+    @staticmethod
+    def _remove(path) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def get(self, key):
+        value = await asyncio.to_thread(self._read, self._path(key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def generation(self, key):
+        return self._generations.current(key)
+
+    async def set(self, key, value, generation=None):
+        if self.max_size <= 0:
+            return
+        if generation is not None and generation != self.generation(key):
+            return
+        await asyncio.to_thread(self._write, self._path(key), value)
+
+    async def delete_many(self, keys):
+        keys = list(keys)
+        self._generations.bump(keys)
+        for key in keys:
+            if self._remove(self._path(key)):
+                self.invalidations += 1
+
+    async def clear(self):
+        self._generations.bump_all()
+        for entry in self._entries():
+            self._remove(entry.path)
+
+    def stats(self):
+        return {
+            "size": len(self._entries()),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class VersionedCache:
+    """Entries stored with the version of the data they were computed from.
+
+    An entry is only served for the version it was stored with; a newer
+    version makes it stale and the caller recomputes and stores it again.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    async def get(self, key: Hashable, version: Hashable) -> Optional[Any]:
+        entry = await self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_version, value = entry
+        if stored_version != version:
+            self.stale += 1
+            return None
+        self.hits += 1
+        return value
+
+    async def set(self, key: Hashable, version: Hashable, value: Any):
+        await self.backend.set(key, (version, value))
+
+    async def clear(self):
+        await self.backend.clear()
+
+    def stats(self) -> Dict[str, int]:
+        # The backend counts stale entries as hits, so its own counters are
+        # replaced by the versioned ones.
+        return {
+            **self.backend.stats(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+        }
+
+
+def make_cow_cache() -> CacheBackend:
+    return LRUCache(
+        max_size=int(os.environ.get("COWSHED_COW_CACHE_SIZE", 10_000)),
+        ttl=float(os.environ.get("COWSHED_COW_CACHE_TTL", 60)),
+    )
+
+
+cow_cache = make_cow_cache()
+
+
+def get_cow_cache() -> CacheBackend:
+    return cow_cache
+
+
+def make_report_cache() -> VersionedCache:
+    store = os.environ.get("COWSHED_REPORT_CACHE", "memory")
+    max_size = int(os.environ.get("COWSHED_REPORT_CACHE_SIZE", 64))
+    if store == "disk":
+        backend = DiskCache(
+            os.environ.get("COWSHED_REPORT_CACHE_DIR", "report_cache"), max_size
+        )
+    elif store == "off":
+        backend = LRUCache(max_size=0)
+    elif store == "memory":
+        backend = LRUCache(
+            max_size=max_size,
+            ttl=float("inf"),
+            max_bytes=int(os.environ.get("COWSHED_REPORT_CACHE_BYTES", 64 * 2**20)),
+        )
+    else:
+        raise ValueError(
+            f"COWSHED_REPORT_CACHE is {store!r}, expected memory, disk or off"
+        )
+    return VersionedCache(backend)
+
+
+report_cache = make_report_cache()
+
+
+def get_report_cache() -> VersionedCache:
+    return report_cache
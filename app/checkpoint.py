@@ -0,0 +1,83 @@
+"""Resumable progress of the ingestion client.
+
+A checkpoint records the position in ``measurements.parquet`` up to which
+every batch has been stored. It is written atomically after each stored
+batch, so an interrupted run resumes from the last committed position.
+Batches after it may already be stored too; the server skips those when
+they are sent again.
+"""
+
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Checkpoint:
+    file: str
+    row_group: int = 0
+    row_offset: int = 0
+
+
+def load_checkpoint(path: Optional[str], file: str) -> Checkpoint:
+    """Return the saved checkpoint for ``file``, or the start of the file."""
+    if path and os.path.exists(path):
+        with open(path) as f:
+            saved = Checkpoint(**json.load(f))
+        if saved.file == file:
+            logger.info(
+                "Resuming %s at row group %d, row %d", file, saved.row_group, saved.row_offset
+            )
+            return saved
+        logger.info("Ignoring checkpoint %s for %s", path, saved.file)
+    return Checkpoint(file=file)
+
+
+def save_checkpoint(path: str, checkpoint: Checkpoint):
+    # Write then rename, so a crash mid-write never leaves a truncated file.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(asdict(checkpoint), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CheckpointTracker:
+    """Advances a checkpoint as batches are stored, possibly out of order.
+
+    Batches run concurrently, so the checkpoint only moves past a batch once
+    it and every batch before it have been stored. A batch that is never
+    marked done holds the checkpoint back and is sent again on resume.
+    """
+
+    def __init__(self, path: Optional[str], checkpoint: Checkpoint):
+        self.path = path
+        self.checkpoint = checkpoint
+        self._positions: Dict[int, Tuple[int, int]] = {}
+        self._done: Set[int] = set()
+        self._next = 0
+
+    def track(
+        self, batches: Iterable[Tuple[Tuple[int, int], dict]]
+    ) -> Iterator[Tuple[int, dict]]:
+        """Number ``(position, batch)`` pairs as yielded by ``iter_positioned_batches``."""
+        for sequence, (position, batch) in enumerate(batches):
+            self._positions[sequence] = position
+            yield sequence, batch
+
+    def done(self, sequence: int):
+        self._done.add(sequence)
+        if self._next not in self._done:
+            return
+        while self._next in self._done:
+            self._done.remove(self._next)
+            position = self._positions.pop(self._next)
+            self._next += 1
+        self.checkpoint.row_group, self.checkpoint.row_offset = position
+        if self.path:
+            save_checkpoint(self.path, self.checkpoint)
@@ -1,15 +1,55 @@
-from sqlalchemy import create_engine
+import asyncio
+import os
+import weakref
+from contextlib import asynccontextmanager
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from .models import Base
+from . import db_config, migrations
+from .instrumentation import instrument_engine
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./cowshed35.db"
+# Async driver used for each backend when COWSHED_ASYNC_DATABASE_URL is not set.
+# These are the backends ``rollup.dialect_insert`` can write to.
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+
+def async_database_url(url: str) -> str:
+    """Return ``url`` rewritten to use the asyncio driver of its backend."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(
+            f"Unsupported database backend {backend!r}, expected one of {sorted(ASYNC_DRIVERS)}"
+        )
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(
+        hide_password=False
+    )
+
+
+SQLALCHEMY_DATABASE_URL = os.environ.get(
+    "COWSHED_DATABASE_URL", "sqlite:///./cowshed35.db"
 )
+ASYNC_DATABASE_URL = os.environ.get(
+    "COWSHED_ASYNC_DATABASE_URL"
+) or async_database_url(SQLALCHEMY_DATABASE_URL)
+
+engine = db_config.make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = db_config.make_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
 Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
 
 
 def get_db():
@@ -18,3 +58,32 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# SQLite has a single writer. aiosqlite holds its write lock across awaits
+# and thread hops, so writers queued inside SQLite can outwait the busy
+# timeout; they queue on these locks instead, one per engine and event loop.
+_sqlite_write_locks: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _sqlite_write_lock(db: AsyncSession) -> asyncio.Lock:
+    locks = _sqlite_write_locks.setdefault(asyncio.get_running_loop(), {})
+    engine = db.bind.sync_engine
+    if engine not in locks:
+        locks[engine] = asyncio.Lock()
+    return locks[engine]
+
+
+@asynccontextmanager
+async def serialized_writes(db: AsyncSession):
+    """Run the transactions of ``db`` one writer at a time on SQLite."""
+    if db.bind.dialect.name != "sqlite":
+        yield
+        return
+    async with _sqlite_write_lock(db):
+        yield
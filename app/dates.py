@@ -0,0 +1,28 @@
+"""Conversions between the date and time values readings arrive as.
+
+Readings carry a ``date`` or a ``datetime``; raw SQLite rows return both
+as ISO strings.
+"""
+
+from datetime import date, datetime
+from typing import Union
+
+DateLike = Union[str, date, datetime]
+
+
+def as_date(value: DateLike) -> date:
+    """The day of ``value``."""
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def as_datetime(value: DateLike) -> datetime:
+    """``value`` as a datetime, midnight for a bare date."""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value, datetime.min.time())
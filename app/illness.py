@@ -0,0 +1,292 @@
+"""Incremental detection of potentially ill cows.
+
+``IllnessDetector`` keeps, per cow, the last ``REPORT_WINDOW_DAYS + 1`` days
+of the ``daily_cow_stats`` rollup in a ring buffer, with running sums of
+the window's weights. Each cow is judged by the farm report's rule, see
+``reporting.is_potentially_ill``, on its newest day of readings, and the
+flagged cows are kept up to date as readings arrive, so ``GET /cows/alerts``
+never scans history.
+
+Readings inserted through ``app.readings.insert_readings`` are queued on
+the session and applied when it commits, so rolled back readings never
+reach the detector. The API loads the detector from the rollup on startup.
+Each process has its own detector: readings written by another worker
+process or by ``app.loader`` are seen after a restart.
+"""
+
+import logging
+import threading
+from array import array
+from datetime import date, datetime, timedelta
+from sqlalchemy import LargeBinary, String, event, func, select, type_coerce
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional
+from . import models
+from .dates import as_date, as_datetime
+from .reporting import REPORT_WINDOW_DAYS, is_potentially_ill
+
+logger = logging.getLogger(__name__)
+
+Stats = models.DailyCowStats
+
+# Slots of the ring buffer: the window ending on a cow's newest day.
+WINDOW_SLOTS = REPORT_WINDOW_DAYS + 1
+
+REBUILD_CHUNK_SIZE = 10_000
+
+# Key of the readings waiting for a commit in ``Session.info``.
+PENDING_KEY = "illness_pending"
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(timestamp) -> float:
+    if not isinstance(timestamp, datetime):
+        timestamp = datetime.combine(timestamp, datetime.min.time())
+    return (timestamp.replace(tzinfo=None) - EPOCH).total_seconds()
+
+
+class CowWindow:
+    """One cow's daily stats over the window ending on its newest day.
+
+    Day ``d`` lives in slot ``d % WINDOW_SLOTS``. Moving the window forward
+    clears the slots of the days that enter it, so every slot holds the
+    day of the window that maps to it.
+    """
+
+    __slots__ = (
+        "day",
+        "milk_total",
+        "milk_count",
+        "weight_sum",
+        "weight_count",
+        "last_weight",
+        "last_weight_at",
+        "window_weight_sum",
+        "window_weight_count",
+        "latest_weight_day",
+    )
+
+    def __init__(self):
+        self.day = -1
+        self.milk_total = array("d", [0.0]) * WINDOW_SLOTS
+        self.milk_count = array("l", [0]) * WINDOW_SLOTS
+        self.weight_sum = array("d", [0.0]) * WINDOW_SLOTS
+        self.weight_count = array("l", [0]) * WINDOW_SLOTS
+        self.last_weight = array("d", [0.0]) * WINDOW_SLOTS
+        self.last_weight_at = array("d", [0.0]) * WINDOW_SLOTS
+        self.window_weight_sum = 0.0
+        self.window_weight_count = 0
+        self.latest_weight_day = -1
+
+    def _slot(self, day: int) -> Optional[int]:
+        """Return the slot of ``day``, moving the window forward if needed.
+
+        Returns None for days that have already left the window.
+        """
+        if day > self.day:
+            # At most WINDOW_SLOTS slots are cleared, however long the gap;
+            # a new window starts out clear.
+            if self.day >= 0:
+                for new_day in range(max(self.day + 1, day - REPORT_WINDOW_DAYS), day + 1):
+                    self._clear(new_day % WINDOW_SLOTS)
+            self.day = day
+            if self.latest_weight_day < day - REPORT_WINDOW_DAYS:
+                self.latest_weight_day = -1
+        elif day < self.day - REPORT_WINDOW_DAYS:
+            return None
+        return day % WINDOW_SLOTS
+
+    def _clear(self, slot: int):
+        self.window_weight_sum -= self.weight_sum[slot]
+        self.window_weight_count -= self.weight_count[slot]
+        self.milk_total[slot] = 0.0
+        self.milk_count[slot] = 0
+        self.weight_sum[slot] = 0.0
+        self.weight_count[slot] = 0
+        self.last_weight[slot] = 0.0
+        self.last_weight_at[slot] = 0.0
+
+    def add(
+        self,
+        day: int,
+        milk_total: float = 0.0,
+        milk_count: int = 0,
+        weight_sum: float = 0.0,
+        weight_count: int = 0,
+        last_weight: Optional[float] = None,
+        last_weight_at: float = 0.0,
+    ):
+        """Fold one day's readings, or a partial day, into the window."""
+        slot = self._slot(day)
+        if slot is None:
+            return
+        self.milk_total[slot] += milk_total
+        self.milk_count[slot] += milk_count
+        if weight_count:
+            previous = self.weight_count[slot]
+            self.weight_sum[slot] += weight_sum
+            self.weight_count[slot] += weight_count
+            self.window_weight_sum += weight_sum
+            self.window_weight_count += weight_count
+            if not previous or last_weight_at >= self.last_weight_at[slot]:
+                self.last_weight[slot] = last_weight
+                self.last_weight_at[slot] = last_weight_at
+            self.latest_weight_day = max(self.latest_weight_day, day)
+
+    def total_milk(self) -> Optional[float]:
+        slot = self.day % WINDOW_SLOTS
+        return self.milk_total[slot] if self.milk_count[slot] else None
+
+    def latest_weight(self) -> Optional[float]:
+        if self.latest_weight_day < 0:
+            return None
+        return self.last_weight[self.latest_weight_day % WINDOW_SLOTS]
+
+    def avg_weight(self) -> Optional[float]:
+        if not self.window_weight_count:
+            return None
+        return self.window_weight_sum / self.window_weight_count
+
+    def potentially_ill(self) -> bool:
+        return is_potentially_ill(self.total_milk(), self.latest_weight(), self.avg_weight())
+
+
+class IllnessDetector:
+    """Per cow rolling windows and the set of cows currently flagged."""
+
+    def __init__(self):
+        self.windows: Dict[str, CowWindow] = {}
+        self.flagged: Dict[str, CowWindow] = {}
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def _window(self, cow_id: str) -> CowWindow:
+        window = self.windows.get(cow_id)
+        if window is None:
+            window = self.windows[cow_id] = CowWindow()
+        return window
+
+    def _judge(self, cow_id: str, window: CowWindow):
+        if window.potentially_ill():
+            self.flagged[cow_id] = window
+        else:
+            self.flagged.pop(cow_id, None)
+
+    def apply_readings(self, kind: str, rows: List[Dict]):
+        """Fold milk or weight rows (``cow_id``, ``timestamp``, ``value``) in."""
+        with self._lock:
+            touched = {}
+            for row in rows:
+                cow_id = str(row["cow_id"])
+                window = touched.get(cow_id) or self._window(cow_id)
+                touched[cow_id] = window
+                day = as_date(row["timestamp"]).toordinal()
+                if kind == "milk":
+                    window.add(day, milk_total=row["value"], milk_count=1)
+                else:
+                    window.add(
+                        day,
+                        weight_sum=row["value"],
+                        weight_count=1,
+                        last_weight=row["value"],
+                        last_weight_at=_seconds(row["timestamp"]),
+                    )
+            for cow_id, window in touched.items():
+                self._judge(cow_id, window)
+
+    def rebuild(self, db: Session):
+        """Reload every cow's window from the ``daily_cow_stats`` rollup.
+
+        Rows are folded in as they come: a window ends up the same whatever
+        order its days arrive in.
+        """
+        windows: Dict[bytes, CowWindow] = {}
+        last_days = (
+            select(func.max(Stats.day).label("day")).group_by(Stats.cow_id).subquery()
+        )
+        # The window of the cow with the oldest newest day reaches back furthest.
+        oldest = db.scalar(select(func.min(last_days.c.day)))
+        if oldest is not None:
+            first_day = as_date(oldest) - timedelta(days=REPORT_WINDOW_DAYS)
+            # Raw ids and days through a plain connection, as in
+            # ``reporting.range_report_frame``: per-row type processing
+            # would cost more than the folding.
+            rows = db.connection().execute(
+                select(
+                    type_coerce(Stats.cow_id, LargeBinary),
+                    type_coerce(Stats.day, String),
+                    Stats.milk_total,
+                    Stats.milk_count,
+                    Stats.weight_sum,
+                    Stats.weight_count,
+                    Stats.last_weight,
+                    type_coerce(Stats.last_weight_at, String),
+                )
+                .where(Stats.day >= first_day)
+                .execution_options(yield_per=REBUILD_CHUNK_SIZE)
+            )
+            for cow, day, milk_total, milk_count, weight_sum, weight_count, last, at in rows:
+                window = windows.get(cow)
+                if window is None:
+                    window = windows[cow] = CowWindow()
+                window.add(
+                    as_date(day).toordinal(),
+                    milk_total,
+                    milk_count,
+                    weight_sum,
+                    weight_count,
+                    last,
+                    _seconds(as_datetime(at)) if at else 0.0,
+                )
+        id_type = Stats.__table__.c.cow_id.type
+        windows = {id_type.process_result_value(cow, None): w for cow, w in windows.items()}
+        with self._lock:
+            self.windows = windows
+            self.flagged = {}
+            for cow_id, window in windows.items():
+                self._judge(cow_id, window)
+            self.loaded = True
+        logger.info(
+            "Illness detector loaded %d cows, %d flagged", len(windows), len(self.flagged)
+        )
+
+    def alerts(self) -> List[Dict]:
+        """The flagged cows with the numbers behind the flag, by cow id."""
+        # Read under the lock, so no window changes halfway through.
+        with self._lock:
+            return [
+                {
+                    "cow_id": cow_id,
+                    "day": date.fromordinal(window.day),
+                    "total_milk": window.total_milk(),
+                    "latest_weight": window.latest_weight(),
+                    "avg_weight_last_30_days": window.avg_weight(),
+                }
+                for cow_id, window in sorted(self.flagged.items())
+            ]
+
+
+detector = IllnessDetector()
+
+
+def stage_readings(db: Session, kind: str, rows: List[Dict]):
+    """Queue inserted rows for the detector until ``db`` commits.
+
+    Does nothing until the detector has been loaded, so processes that
+    never serve alerts do not keep the state.
+    """
+    if detector.loaded and rows:
+        db.info.setdefault(PENDING_KEY, []).append((kind, rows))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session: Session):
+    for kind, rows in session.info.pop(PENDING_KEY, ()):
+        detector.apply_readings(kind, rows)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _drop_pending(session: Session, transaction):
+    if transaction.parent is None:
+        session.info.pop(PENDING_KEY, None)
@@ -7,223 +7,760 @@ from uuid import UUID
 import random
 import time
 import json
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("ingestion.log"), logging.StreamHandler()],
-)
+import argparse
+import multiprocessing.util
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from .checkpoint import CheckpointTracker, load_checkpoint
+from .ingestion_stats import IngestionRun
+from .logging_config import LogSampler, configure_logging, stop_logging
+from .parquet_io import MEASUREMENT_COLUMNS, iter_positioned_batches
+from .pipeline import AdaptiveLimiter, THROTTLE_STATUSES, run_pipeline
+from .readings import UNIT_KINDS
 
 logger = logging.getLogger(__name__)
+# Per-row problems are logged once per thousand; the totals go in the summary.
+sampled = LogSampler(logger)
+
+LOG_FILE = "ingestion.log"
 
-info_counter = 0
-error_sensors = {}
-error_cows = {}
-successful_sensors = 0
-failed_sensors = 0
-successful_measurements = 0
-failed_measurements = 0
 MAX_RETRIES = 5
-MAX_FAILURES_PER_SENSOR = 10
-MAX_FAILURES_PER_COW = 10
+BULK_CHUNK_SIZE = 5000
+# Ids per lookup request and entities per bulk registration request.
+REGISTRY_CHUNK_SIZE = 5000
+DEFAULT_CONCURRENCY = 8
+MAX_CONCURRENCY = 64
+KEEPALIVE_TIMEOUT = 30
+MEASUREMENTS_PATH = "cow_data/measurements.parquet"
+DEFAULT_CHECKPOINT_PATH = "ingestion_checkpoint.json"
+REJECT_COLUMNS = MEASUREMENT_COLUMNS + ["reason"]
+
+
+async def post_json(session, endpoint, payload, limiter=None, run=None):
+    """POST ``payload`` inside a limiter slot, waiting out 429/503 responses.
+
+    Returns the final response status and body text.
+    """
+    limiter = limiter or AdaptiveLimiter()
+    run = run or IngestionRun()
+    for attempt in range(MAX_RETRIES):
+        async with limiter.slot():
+            start = time.perf_counter()
+            async with session.post(endpoint, json=payload) as response:
+                status = response.status
+                body = await response.text()
+                retry_after = (
+                    response.headers.get("Retry-After")
+                    if status in THROTTLE_STATUSES
+                    else None
+                )
+            latency = time.perf_counter() - start
+            limiter.record(status, latency, retry_after)
+        run.observe_request(latency)
+        run.stage_seconds["http"] += latency
+        if status not in THROTTLE_STATUSES:
+            break
+        run.throttled += 1
+        run.retries += 1
+        logger.warning(
+            "Throttled with status %s on %s (attempt %d)", status, endpoint, attempt + 1
+        )
+    return status, body
 
 
-async def process_sensor(session, base_url, sensor_id, unit):
-    global info_counter
+async def process_sensor(session, base_url, sensor_id, unit, limiter=None, run=None):
+    run = run or IngestionRun()
     endpoint = f"{base_url}/api/sensors/{sensor_id}"
     data = {"unit": unit}
-    logger.info(f"Processing sensor: {sensor_id} with unit: {unit}")
-    logger.debug(f"API Endpoint: {endpoint}")
-    logger.debug(f"Payload for sensor: {json.dumps(data)}")
+    logger.debug("POST %s %s", endpoint, data)
     try:
-        async with session.post(endpoint, json=data) as response:
-            logger.info(f"Response status for sensor {sensor_id}: {response.status}")
-            if response.status == 400:
-                info_counter += 1
-                logger.info(
-                    f"[{info_counter}] Sensor {sensor_id} already exists in the database"
-                )
-            elif response.status == 201:
-                info_counter += 1
-                logger.info(f"[{info_counter}] Successfully added sensor {sensor_id}")
-            else:
-                response_text = await response.text()
-                logger.error(
-                    f"Failed to add sensor {sensor_id}: Status {response.status}, Body: {response_text}"
-                )
-                response.raise_for_status()
+        status, response_text = await post_json(
+            session, endpoint, data, limiter, run
+        )
+        if status == 409:
+            run.record("sensor", "existing")
+            logger.debug(
+                "[%d] Sensor %s already exists in the database", run.complete(), sensor_id
+            )
+        elif status == 201:
+            run.record("sensor", "created")
+            logger.debug("[%d] Successfully added sensor %s", run.complete(), sensor_id)
+        else:
+            run.record("sensor", "failed")
+            logger.error(
+                "Failed to add sensor %s: Status %s, Body: %s", sensor_id, status, response_text
+            )
     except aiohttp.ClientError as e:
-        logger.error(f"Error processing sensor {sensor_id}: {str(e)}")
-
+        run.record("sensor", "failed")
+        logger.error("Error processing sensor %s: %s", sensor_id, e)
 
-async def process_cow(session, base_url, cow_id, name, birthdate):
-    global info_counter, error_cows, successful_measurements, failed_measurements
 
+async def process_cow(
+    session, base_url, cow_id, name, birthdate, limiter=None, run=None
+):
+    run = run or IngestionRun()
     payload = {"id": str(cow_id), "name": name, "birthdate": birthdate.isoformat()}
 
     endpoint = f"{base_url}/api/cows/{cow_id}"
 
-    logger.info(f"Processing cow: {cow_id}. Poor cow.")
-    logger.debug(f"API Endpoint: {endpoint}")
-    logger.debug(f"Payload for cow: {json.dumps(payload)}")
+    logger.debug("POST %s %s", endpoint, payload)
     try:
-        async with session.post(endpoint, json=payload) as response:
-            logger.info(f"Response status for cow {cow_id}: {response.status}")
-            if response.status == 400:
-                info_counter += 1
-                logger.info(
-                    f"[{info_counter}] Cow {cow_id} already exists in the database."
-                )
-            elif response.status == 201:
-                info_counter += 1
-                logger.info(f"[{info_counter}] Successfully added cow {cow_id}")
-            else:
-                response_text = await response.text()
-                logger.error(
-                    f"Failed to add cow {cow_id}: Status {response.status}, Body: {response_text}"
-                )
-                response.raise_for_status()
+        status, response_text = await post_json(
+            session, endpoint, payload, limiter, run
+        )
+        if status == 409:
+            run.record("cow", "existing")
+            logger.debug(
+                "[%d] Cow %s already exists in the database.", run.complete(), cow_id
+            )
+        elif status == 201:
+            run.record("cow", "created")
+            logger.debug("[%d] Successfully added cow %s", run.complete(), cow_id)
+        else:
+            run.record("cow", "failed")
+            logger.error(
+                "Failed to add cow %s: Status %s, Body: %s", cow_id, status, response_text
+            )
     except aiohttp.ClientError as e:
-        logger.error(f"Error processing cow {cow_id}: {str(e)}")
+        run.record("cow", "failed")
+        logger.error("Error processing cow %s: %s", cow_id, e)
+
+
+def prepare_readings(
+    chunk, units: Dict[str, str], cows: Optional[Set[str]] = None
+) -> Tuple[List[Dict], pd.DataFrame]:
+    """Turn a chunk of measurement rows into bulk readings, column at a time.
+
+    The reading type comes from the unit of the row's sensor. Rows with a
+    missing or non-positive value, an unknown sensor, a unit that is not
+    a reading type or, when ``cows`` is given, a cow not in ``cows`` are
+    returned separately with a ``reason`` column.
+    Readings are grouped by cow and type, in file order within a group.
+    Timestamps are read as UTC epoch seconds, as the loader does.
+    """
+    frame = pd.DataFrame({column: chunk[column] for column in MEASUREMENT_COLUMNS})
+    frame["sensor_id"] = frame["sensor_id"].astype(str)
+    unit = frame["sensor_id"].map(units)
+    frame["type"] = unit.map(UNIT_KINDS)
+
+    reason = pd.Series(None, index=frame.index, dtype=object)
+    reason = reason.mask(frame["type"].isna(), "unsupported unit")
+    reason = reason.mask(unit.isna(), "unknown sensor")
+    if cows is not None:
+        reason = reason.mask(~frame["cow_id"].astype(str).isin(cows), "unknown cow")
+    reason = reason.mask(frame["value"] <= 0, "non-positive value")
+    reason = reason.mask(frame["value"].isna(), "missing value")
+    rejected = frame.loc[reason.notna(), MEASUREMENT_COLUMNS].assign(
+        reason=reason[reason.notna()]
+    )
 
+    valid = frame[reason.isna()].sort_values(["cow_id", "type"], kind="stable")
+    measured_at = pd.to_datetime(valid["timestamp"], unit="s")
+    columns = {
+        "cow_id": valid["cow_id"].astype(str).tolist(),
+        "sensor_id": valid["sensor_id"].tolist(),
+        "type": valid["type"].tolist(),
+        "date": measured_at.dt.strftime("%Y-%m-%d").tolist(),
+        "timestamp": measured_at.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").tolist(),
+        "value": valid["value"].astype(float).tolist(),
+    }
+    readings = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    return readings, rejected
 
-async def process_measurement(session, base_url, row):
-    global info_counter, error_cows, successful_measurements, failed_measurements
-    cow_id = UUID(row["cow_id"])
-    sensor_id = row["sensor_id"]
-    timestamp = row["timestamp"]
 
-    if cow_id in error_cows and error_cows[cow_id] >= MAX_FAILURES_PER_COW:
-        logger.warning(f"Skipping known problematic cow {cow_id}")
-        failed_measurements += 1
-        return
+class RejectLog:
+    """Appends rows that were not sent, or not stored, to a CSV side file."""
 
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, rows: pd.DataFrame):
+        if not len(rows):
+            return
+        rows[REJECT_COLUMNS].to_csv(
+            self.path, mode="a", index=False, header=not os.path.exists(self.path)
+        )
+
+
+async def process_measurement_chunk(
+    session,
+    base_url,
+    chunk,
+    limiter=None,
+    run=None,
+    units=None,
+    rejects=None,
+    cows=None,
+):
+    """Send a whole chunk of measurement rows to the bulk endpoint in one call.
+
+    ``chunk`` maps column names to sequences, a DataFrame or the column
+    lists produced by ``iter_positioned_batches``, ``units`` maps sensor
+    ids to their unit and ``cows`` holds the registered cows, see
+    ``prepare_readings``. Readings carry
+    their sensor and timestamp, so a chunk sent twice is only stored once.
+    Rows rejected here or by the server go to ``rejects`` when given.
+    Returns whether the server stored the chunk.
+    """
+    run = run or IngestionRun()
+
+    with run.timed("transform"):
+        readings, invalid = prepare_readings(chunk, units or {}, cows)
+    if len(invalid):
+        run.record("measurement", "invalid", len(invalid))
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                "Skipped %d invalid rows: %s",
+                len(invalid),
+                invalid["reason"].value_counts().to_dict(),
+            )
+        if rejects:
+            rejects.write(invalid)
+    if not readings:
+        return True
+
+    endpoint = f"{base_url}/api/measurements/bulk"
     for attempt in range(MAX_RETRIES):
         try:
-            sensor_type = "weight" if row["value"] > 100 else "milk"
-
-            if pd.isna(row["value"]) or row["value"] <= 0:
-                logger.warning(
-                    f"Invalid value for cow {cow_id}, sensor {sensor_id}, timestamp {timestamp}: {row['value']}"
+            logger.debug("POST %s with %d rows", endpoint, len(readings))
+            status, response_text = await post_json(
+                session, endpoint, {"readings": readings}, limiter, run
+            )
+            if status >= 400:
+                raise aiohttp.ClientError(f"HTTP {status}: {response_text}")
+            result = json.loads(response_text)
+            run.record("measurement", "stored", result["accepted"])
+            run.record("measurement", "duplicate", result.get("duplicates", 0))
+            run.record("measurement", "rejected", result["rejected"])
+            for rejection in result["rejections"]:
+                sampled.warning(
+                    "Rejected reading for cow %s: %s",
+                    readings[rejection["index"]]["cow_id"],
+                    rejection["detail"],
                 )
-                failed_measurements += 1
-                return
-
-            data = {
-                "date": datetime.fromtimestamp(timestamp).date().isoformat(),
-                "value": float(row["value"]),
-            }
-
-            endpoint = f"{base_url}/api/cows/{cow_id}/{sensor_type}"
-            logger.info(f"Calling endpoint: POST {endpoint}")
-            logger.info(f"Payload: {json.dumps(data)}")
-
-            async with session.post(endpoint, json=data) as response:
-                logger.info(f"Response status for cow {cow_id}: {response.status}")
-                if response.status == 422:
-                    logger.warning(
-                        f"Unprocessable Entity for cow {cow_id}, sensor {sensor_id}, timestamp {timestamp}, data: {data}"
-                    )
-                    failed_measurements += 1
-                    return
-                elif response.status >= 400:
-                    response_text = await response.text()
-                    logger.warning(
-                        f"Error response for cow {cow_id}, sensor {sensor_id}, timestamp {timestamp}: Status {response.status}, Body: {response_text}"
-                    )
-                    raise aiohttp.ClientError(
-                        f"HTTP {response.status}: {response_text}"
-                    )
-                response.raise_for_status()
-                info_counter += 1
-                logger.info(
-                    f"[{info_counter}] Successfully added {sensor_type} data for cow {cow_id}, sensor {sensor_id}, timestamp {timestamp}"
+            if rejects and result["rejections"]:
+                rejected = pd.DataFrame(
+                    [
+                        dict(readings[r["index"]], reason=r["detail"])
+                        for r in result["rejections"]
+                    ]
                 )
-                successful_measurements += 1
-            return
+                rejects.write(rejected)
+            logger.debug(
+                "[%d] Bulk chunk stored: %d accepted, %d duplicates, %d rejected",
+                run.complete(),
+                result["accepted"],
+                result.get("duplicates", 0),
+                result["rejected"],
+            )
+            return True
         except aiohttp.ClientError as e:
             logger.warning(
-                f"Failed to add data for cow {cow_id}, sensor {sensor_id}, timestamp {timestamp} (attempt {attempt + 1}): {str(e)}"
+                "Failed to send bulk chunk of %d rows (attempt %d): %s",
+                len(readings),
+                attempt + 1,
+                e,
             )
             if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(2**attempt + random.random())
+                run.retries += 1
+                with run.timed("retry_wait"):
+                    await asyncio.sleep(2**attempt + random.random())
             else:
                 logger.error(
-                    f"Failed to add data for cow {cow_id}, sensor {sensor_id}, timestamp {timestamp} after {MAX_RETRIES} attempts"
+                    "Failed to send bulk chunk of %d rows after %d attempts",
+                    len(readings),
+                    MAX_RETRIES,
                 )
-                logger.error(f"Problematic data: {row.to_dict()}")
-                error_cows[cow_id] = error_cows.get(cow_id, 0) + 1
-                failed_measurements += 1
-        except Exception as e:
-            logger.error(f"Unexpected error processing measurement: {str(e)}")
-            logger.error(f"Row data: {row.to_dict()}")
-            failed_measurements += 1
-            return
+                run.record("measurement", "failed", len(readings))
+    return False
 
 
-async def process_measurement_batch(session, base_url, batch):
-    tasks = [process_measurement(session, base_url, row) for _, row in batch.iterrows()]
-    await asyncio.gather(*tasks)
+def _client_session(max_concurrency):
+    connector = aiohttp.TCPConnector(
+        limit=max_concurrency, keepalive_timeout=KEEPALIVE_TIMEOUT
+    )
+    return aiohttp.ClientSession(connector=connector)
 
 
-async def ingest_data(base_url: str):
-    global successful_measurements, failed_measurements
-    try:
-        async with aiohttp.ClientSession() as session:
+@dataclass
+class EntityRegistry:
+    """The sensors and cows the server may know, as ids from the input files."""
+
+    units: Dict[str, str]
+    cows: Set[str]
+
+
+def _chunks(items: List, size: int = REGISTRY_CHUNK_SIZE):
+    return (items[i : i + size] for i in range(0, len(items), size))
+
+
+async def fetch_known_ids(
+    session, base_url, kind: str, ids: List[str], limiter, run
+) -> Tuple[Set[str], Set[str]]:
+    """Ask the server which of ``ids`` are registered ``kind`` ("cows" or "sensors").
+
+    Returns the known ids and the ids of lookups that failed, as canonical
+    UUID strings. The ids of failed lookups are registered like missing
+    ones, which is harmless if they exist.
+    """
+    endpoint = f"{base_url}/api/{kind}/lookup"
+    known = set()
+    unanswered = set()
+    for chunk in _chunks(ids):
+        try:
+            status, body = await post_json(session, endpoint, {"ids": chunk}, limiter, run)
+        except aiohttp.ClientError as e:
+            status, body = None, str(e)
+        if status == 200:
+            known.update(json.loads(body)["known"])
+        else:
+            unanswered.update(chunk)
+            logger.warning(
+                "Lookup of %d %s failed: Status %s, Body: %s", len(chunk), kind, status, body
+            )
+    return known, unanswered
+
 
-            sensors_df = pd.read_parquet(
-                "cow_data/sensors.parquet", engine="fastparquet"
+async def register_missing(
+    session, base_url, kind: str, entities: List[Dict], limiter, max_concurrency, run
+) -> Tuple[Set[str], Set[str]]:
+    """Register ``entities`` in bulk.
+
+    Returns the ids the server registered and the ids of requests that got
+    no answer, which may or may not have been registered.
+    """
+    endpoint = f"{base_url}/api/{kind}"
+    outcome_kind = kind[:-1]
+    registered = set()
+    unanswered = set()
+
+    async def send(chunk):
+        try:
+            status, body = await post_json(session, endpoint, {kind: chunk}, limiter, run)
+        except aiohttp.ClientError as e:
+            status, body = None, str(e)
+        if status == 200:
+            result = json.loads(body)
+            run.record(outcome_kind, "created", result["created"])
+            run.record(outcome_kind, "existing", result["existing"])
+            registered.update(entity["id"] for entity in chunk)
+            logger.debug("[%d] Registered %d %s", run.complete(), len(chunk), kind)
+        else:
+            if status is None:
+                unanswered.update(entity["id"] for entity in chunk)
+            run.record(outcome_kind, "failed", len(chunk))
+            logger.error(
+                "Failed to register %d %s: Status %s, Body: %s", len(chunk), kind, status, body
+            )
+
+    await run_pipeline(_chunks(entities), send, workers=max_concurrency)
+    return registered, unanswered
+
+
+async def register_entities(
+    session, base_url, limiter, max_concurrency, run
+) -> EntityRegistry:
+    """Register the sensors and cows the server does not know yet.
+
+    The known ids are looked up in bulk first, so a rerun against a filled
+    database sends no registrations at all. Returns the registry used to
+    classify measurement rows and to reject rows of unknown cows locally.
+    Only entities the server said it does not have and then refused to
+    register are left out: when a lookup or a registration got no answer,
+    the entity's rows are sent and the server decides.
+    """
+    with run.timed("read"):
+        sensors_df = pd.read_parquet("cow_data/sensors.parquet", engine="fastparquet")
+    logger.info("Read %d rows from cow_data/sensors.parquet", len(sensors_df))
+    logger.debug("Sensors columns: %s", list(sensors_df.columns))
+    with run.timed("read"):
+        cows_df = pd.read_parquet("cow_data/cows.parquet", engine="fastparquet")
+    logger.info("Read %d rows from cow_data/cows.parquet", len(cows_df))
+    logger.debug("Cows columns: %s", list(cows_df.columns))
+
+    sensors = [
+        {"id": str(UUID(sensor_id)), "unit": unit}
+        for sensor_id, unit in zip(sensors_df["id"], sensors_df["unit"])
+    ]
+    cows = [
+        {
+            "id": str(UUID(cow_id)),
+            "name": name,
+            "birthdate": datetime.fromtimestamp(birthdate / 1_000_000_000).isoformat(),
+        }
+        for cow_id, name, birthdate in zip(
+            cows_df["id"], cows_df["name"], cows_df["birthdate"]
+        )
+    ]
+
+    known = {}
+    for kind, entities in (("sensors", sensors), ("cows", cows)):
+        existing, unanswered = await fetch_known_ids(
+            session, base_url, kind, [entity["id"] for entity in entities], limiter, run
+        )
+        missing = [entity for entity in entities if entity["id"] not in existing]
+        logger.info(
+            "%d of %d %s already registered, registering %d",
+            len(entities) - len(missing),
+            len(entities),
+            kind,
+            len(missing),
+        )
+        run.record(kind[:-1], "existing", len(entities) - len(missing))
+        registered, unsure = await register_missing(
+            session, base_url, kind, missing, limiter, max_concurrency, run
+        )
+        known[kind] = existing | registered | unanswered | unsure
+
+    return EntityRegistry(
+        units={
+            str(sensor_id): unit
+            for sensor_id, unit, entity in zip(sensors_df["id"], sensors_df["unit"], sensors)
+            if entity["id"] in known["sensors"]
+        },
+        cows={
+            str(cow_id)
+            for cow_id, entity in zip(cows_df["id"], cows)
+            if entity["id"] in known["cows"]
+        },
+    )
+
+
+async def send_measurements(
+    session,
+    base_url,
+    limiter,
+    max_concurrency,
+    run,
+    units: Dict[str, str],
+    checkpoint_path: Optional[str] = None,
+    shard: int = 0,
+    shards: int = 1,
+    rejects: Optional[RejectLog] = None,
+    cows: Optional[Set[str]] = None,
+):
+    """Stream the measurements file, or one shard of it, to the bulk endpoint.
+
+    Rows of cows not in ``cows`` are rejected without being sent.
+    """
+    checkpoint = load_checkpoint(checkpoint_path, MEASUREMENTS_PATH)
+    tracker = CheckpointTracker(checkpoint_path, checkpoint)
+
+    async def send_chunk(item):
+        sequence, chunk = item
+        if await process_measurement_chunk(
+            session, base_url, chunk, limiter, run, units, rejects, cows
+        ):
+            tracker.done(sequence)
+
+    logger.info("Streaming %s (shard %d/%d)", MEASUREMENTS_PATH, shard + 1, shards)
+    batches = iter_positioned_batches(
+        MEASUREMENTS_PATH,
+        MEASUREMENT_COLUMNS,
+        BULK_CHUNK_SIZE,
+        checkpoint.row_group,
+        checkpoint.row_offset,
+        shard_by="cow_id" if shards > 1 else None,
+        shard=shard,
+        shards=shards,
+    )
+    await run_pipeline(
+        tracker.track(run.timed_iter("read", batches)),
+        send_chunk,
+        workers=max_concurrency,
+    )
+
+
+async def report_progress(
+    run: IngestionRun, interval: float, metrics_path: Optional[str] = None
+):
+    """Log a progress line, and refresh the metrics file, every ``interval`` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("Progress: %s", run.progress_line())
+        if metrics_path:
+            run.write_prometheus(metrics_path)
+
+
+def log_summary(run: IngestionRun):
+    summary = run.summary()
+    logger.info("Ingestion summary: %s", json.dumps(summary))
+    for kind, outcomes in summary["outcomes"].items():
+        logger.info("%s outcomes: %s", kind, outcomes)
+    latency = summary["latency_seconds"]
+    logger.info(
+        "%s measurements/s over %s s, latency p50/p95/p99 %s/%s/%s s",
+        summary["rows_per_second"],
+        summary["elapsed_seconds"],
+        latency["p50"],
+        latency["p95"],
+        latency["p99"],
+    )
+    sampled.log_totals(logging.WARNING)
+
+
+async def ingest_data(
+    base_url: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_concurrency: int = MAX_CONCURRENCY,
+    checkpoint_path: Optional[str] = None,
+    run: Optional[IngestionRun] = None,
+    progress_interval: Optional[float] = None,
+    metrics_path: Optional[str] = None,
+    rejects_path: Optional[str] = None,
+) -> IngestionRun:
+    """Upload sensors, cows and measurements and return the run's stats.
+
+    With ``checkpoint_path``, progress through the measurements file is
+    saved there after every stored chunk and a later run resumes from it.
+    Rows that are not stored because they are invalid are appended to
+    ``rejects_path`` with the reason.
+    """
+    run = run or IngestionRun()
+    limiter = AdaptiveLimiter(limit=concurrency, max_limit=max_concurrency)
+    progress = (
+        asyncio.create_task(report_progress(run, progress_interval, metrics_path))
+        if progress_interval
+        else None
+    )
+    try:
+        async with _client_session(max_concurrency) as session:
+            registry = await register_entities(
+                session, base_url, limiter, max_concurrency, run
+            )
+            await send_measurements(
+                session,
+                base_url,
+                limiter,
+                max_concurrency,
+                run,
+                registry.units,
+                checkpoint_path,
+                rejects=RejectLog(rejects_path) if rejects_path else None,
+                cows=registry.cows,
             )
-            logger.info(f"Read {len(sensors_df)} rows from cow_data/sensors.parquet")
-            logger.info(f"Sensors columns: {sensors_df.columns}")
+    except Exception as e:
+        logger.exception("An error occurred: %s", e)
+    finally:
+        if progress:
+            progress.cancel()
+        run.finish()
+        log_summary(run)
+        logger.info("Final concurrency limit: %d", limiter.limit)
+        if metrics_path:
+            run.write_prometheus(metrics_path)
+    return run
+
 
-            for _, row in sensors_df.iterrows():
-                await process_sensor(session, base_url, UUID(row["id"]), row["unit"])
-                await asyncio.sleep(0.1)
+def shard_path(path: Optional[str], shard: int, shards: int):
+    """Per shard variant of a checkpoint or side file path."""
+    if not path:
+        return None
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard + 1}of{shards}{ext}"
 
-            cows_df = pd.read_parquet("cow_data/cows.parquet", engine="fastparquet")
-            logger.info(f"Read {len(cows_df)} rows from cow_data/cows.parquet")
-            logger.info(f"Cows columns: {cows_df.columns}")
 
-            for _, row in cows_df.iterrows():
-                await process_cow(
+def ingest_measurement_shard(
+    base_url: str,
+    shard: int,
+    shards: int,
+    concurrency: int,
+    max_concurrency: int,
+    units: Dict[str, str],
+    checkpoint_path: Optional[str] = None,
+    progress_interval: Optional[float] = None,
+    rejects_path: Optional[str] = None,
+    cows: Optional[Set[str]] = None,
+) -> IngestionRun:
+    """Worker process entry point: send one shard and return its stats."""
+    run = IngestionRun()
+    limiter = AdaptiveLimiter(limit=concurrency, max_limit=max_concurrency)
+
+    async def send():
+        progress = (
+            asyncio.create_task(report_progress(run, progress_interval))
+            if progress_interval
+            else None
+        )
+        try:
+            async with _client_session(max_concurrency) as session:
+                await send_measurements(
                     session,
                     base_url,
-                    UUID(row["id"]),
-                    row["name"],
-                    datetime.fromtimestamp(row["birthdate"] / 1_000_000_000),
+                    limiter,
+                    max_concurrency,
+                    run,
+                    units,
+                    shard_path(checkpoint_path, shard, shards),
+                    shard,
+                    shards,
+                    RejectLog(rejects_path) if rejects_path else None,
+                    cows,
                 )
+        finally:
+            if progress:
+                progress.cancel()
+
+    asyncio.run(send())
+    run.finish()
+    return run
+
+
+def _init_worker_logging():
+    configure_logging(LOG_FILE)
+    # Pool workers exit without running atexit handlers, but multiprocessing
+    # runs its finalizers, so queued records are still written out.
+    multiprocessing.util.Finalize(None, stop_logging, exitpriority=0)
+
 
-            measurements_df = pd.read_parquet(
-                "cow_data/measurements.parquet", engine="fastparquet"
+def ingest_parallel(
+    base_url: str,
+    processes: int,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    max_concurrency: int = MAX_CONCURRENCY,
+    checkpoint_path: Optional[str] = None,
+    progress_interval: Optional[float] = None,
+    metrics_path: Optional[str] = None,
+    rejects_path: Optional[str] = None,
+) -> IngestionRun:
+    """Register sensors and cows, then send measurements from ``processes`` workers.
+
+    Measurements are sharded by a hash of ``cow_id``, so each cow's readings
+    are sent by a single worker. Within a worker, chunks are sent
+    concurrently and may be stored in any order; the server keeps the
+    newest reading as a cow's latest whatever order readings arrive in, and
+    duplicates are skipped. The concurrency limits are
+    split between the workers, so the server sees the same total load as a
+    single process run. Each shard keeps its own checkpoint; resuming needs
+    the same number of processes. The workers' stats are merged into the
+    returned run. Each worker appends its rejected rows to its own
+    ``rejects_path`` shard file.
+    """
+    run = IngestionRun()
+
+    async def register():
+        limiter = AdaptiveLimiter(limit=concurrency, max_limit=max_concurrency)
+        async with _client_session(max_concurrency) as session:
+            return await register_entities(
+                session, base_url, limiter, max_concurrency, run
             )
+
+    registry = asyncio.run(register())
+
+    worker_concurrency = max(1, concurrency // processes)
+    worker_max_concurrency = max(1, max_concurrency // processes)
+    with ProcessPoolExecutor(
+        max_workers=processes, initializer=_init_worker_logging
+    ) as executor:
+        futures = {
+            executor.submit(
+                ingest_measurement_shard,
+                base_url,
+                shard,
+                processes,
+                worker_concurrency,
+                worker_max_concurrency,
+                registry.units,
+                checkpoint_path,
+                progress_interval,
+                shard_path(rejects_path, shard, processes),
+                registry.cows,
+            ): shard
+            for shard in range(processes)
+        }
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                shard_run = future.result()
+            except Exception as e:
+                logger.error("Shard %d/%d failed: %s", shard + 1, processes, e)
+                continue
+            run.merge(shard_run)
             logger.info(
-                f"Read {len(measurements_df)} rows from cow_data/measurements.parquet"
+                "Shard %d/%d finished: %s", shard + 1, processes, shard_run.progress_line()
             )
-            logger.info(f"Measurements columns: {measurements_df.columns}")
 
-            batch_size = 50
-            for i in range(0, len(measurements_df), batch_size):
-                batch = measurements_df.iloc[i : i + batch_size]
-                logger.info(f"Processing measurement batch {i//batch_size + 1}")
-                await process_measurement_batch(session, base_url, batch)
-
-    except Exception as e:
-        logger.error(f"An error occurred: {str(e)}")
-    finally:
-        logger.info(f"Problematic sensors and their failure counts: {error_sensors}")
-        logger.info(f"Total sensors processed: {successful_sensors + failed_sensors}")
-        logger.info(f"Successful sensors: {successful_sensors}")
-        logger.info(f"Failed sensors: {failed_sensors}")
-        logger.info(
-            f"Total measurements processed: {successful_measurements + failed_measurements}"
-        )
-        logger.info(f"Successful measurements: {successful_measurements}")
-        logger.info(f"Failed measurements: {failed_measurements}")
+    run.finish()
+    log_summary(run)
+    if metrics_path:
+        run.write_prometheus(metrics_path)
+    return run
 
 
 if __name__ == "__main__":
-    start_time = time.time()
-    asyncio.run(ingest_data("http://localhost:8000"))
-    end_time = time.time()
-    logger.info(f"Total execution time: {end_time - start_time} seconds")
+    parser = argparse.ArgumentParser(description="Ingest cow_data/*.parquet over HTTP")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="requests in flight at start; adapts to server latency and 429/503",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument(
+        "--checkpoint",
+        default=DEFAULT_CHECKPOINT_PATH,
+        help="file recording progress through the measurements; a rerun resumes from it",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="send measurements from this many worker processes, sharded by cow",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="ignore any saved checkpoint and start from the first measurement",
+    )
+    parser.add_argument(
+        "--rejects-file",
+        default=None,
+        help="append measurements that were not stored to this CSV, with the reason",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=None,
+        help="log a progress line every this many seconds",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="write Prometheus metrics here, e.g. for the node exporter textfile collector",
+    )
+    args = parser.parse_args()
+
+    configure_logging(LOG_FILE)
+    if args.restart:
+        for shard in range(args.processes):
+            path = shard_path(args.checkpoint, shard, args.processes)
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(args.checkpoint):
+            os.remove(args.checkpoint)
+    if args.processes > 1:
+        ingest_parallel(
+            args.base_url,
+            args.processes,
+            args.concurrency,
+            args.max_concurrency,
+            args.checkpoint,
+            args.progress_interval,
+            args.metrics_file,
+            args.rejects_file,
+        )
+    else:
+        asyncio.run(
+            ingest_data(
+                args.base_url,
+                args.concurrency,
+                args.max_concurrency,
+                args.checkpoint,
+                progress_interval=args.progress_interval,
+                metrics_path=args.metrics_file,
+                rejects_path=args.rejects_file,
+            )
+        )
@@ -0,0 +1,199 @@
+"""Counters, timings and latency of one ingestion run."""
+
+import bisect
+import os
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGES = ("read", "transform", "http", "retry_wait")
+
+METRIC_PREFIX = "cowshed_ingestion"
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One slot per bucket plus the +Inf overflow slot.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, other: "LatencyHistogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the ``q`` quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class IngestionRun:
+    """Everything one ingestion run counts and times.
+
+    Each run owns its state, so several runs can share a process, and the
+    runs of worker processes can be pickled back and merged into one.
+    Stage times are summed over concurrent requests, so ``http`` can exceed
+    the wall clock time of the run.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self.outcomes: Counter = Counter()
+        self.stage_seconds: Dict[str, float] = defaultdict(float)
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.completed = 0
+
+    def record(self, kind: str, outcome: str, count: int = 1):
+        """Count ``count`` sensors, cows or measurements with ``outcome``."""
+        if count:
+            self.outcomes[kind, outcome] += count
+
+    def complete(self) -> int:
+        """Count a finished item and return its sequence number for logging."""
+        self.completed += 1
+        return self.completed
+
+    def observe_request(self, seconds: float):
+        self.requests += 1
+        self.latency.observe(seconds)
+
+    @contextmanager
+    def timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage] += time.perf_counter() - start
+
+    def timed_iter(self, stage: str, items: Iterable) -> Iterator:
+        """Yield from ``items``, counting the time spent producing them."""
+        iterator = iter(items)
+        while True:
+            with self.timed(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def merge(self, other: "IngestionRun"):
+        self.outcomes.update(other.outcomes)
+        for stage, seconds in other.stage_seconds.items():
+            self.stage_seconds[stage] += seconds
+        self.latency.merge(other.latency)
+        self.requests += other.requests
+        self.retries += other.retries
+        self.throttled += other.throttled
+        self.completed += other.completed
+
+    def finish(self):
+        self.finished = time.time()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    def total(self, kind: str) -> int:
+        return sum(n for (k, _), n in self.outcomes.items() if k == kind)
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.total("measurement") / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> Dict:
+        outcomes = defaultdict(dict)
+        for (kind, outcome), count in sorted(self.outcomes.items()):
+            outcomes[kind][outcome] = count
+        return {
+            "elapsed_seconds": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+            "outcomes": dict(outcomes),
+            "stage_seconds": {
+                stage: round(self.stage_seconds.get(stage, 0.0), 3) for stage in STAGES
+            },
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "latency_seconds": {
+                "p50": self.latency.quantile(0.5),
+                "p95": self.latency.quantile(0.95),
+                "p99": self.latency.quantile(0.99),
+            },
+        }
+
+    def progress_line(self) -> str:
+        stored = self.outcomes["measurement", "stored"]
+        duplicate = self.outcomes["measurement", "duplicate"]
+        failed = self.total("measurement") - stored - duplicate
+        return (
+            f"{self.total('measurement')} measurements "
+            f"({stored} stored, {duplicate} already stored, {failed} not stored), "
+            f"{self.rows_per_second:.0f} rows/s, {self.requests} requests, "
+            f"p95 latency {self.latency.quantile(0.95)} s"
+        )
+
+    def prometheus_text(self) -> str:
+        name = METRIC_PREFIX
+        lines = [
+            f"# TYPE {name}_items_total counter",
+            *(
+                f'{name}_items_total{{kind="{kind}",outcome="{outcome}"}} {count}'
+                for (kind, outcome), count in sorted(self.outcomes.items())
+            ),
+            f"# TYPE {name}_stage_seconds_total counter",
+            *(
+                f'{name}_stage_seconds_total{{stage="{stage}"}} {self.stage_seconds.get(stage, 0.0):.6f}'
+                for stage in STAGES
+            ),
+            f"# TYPE {name}_requests_total counter",
+            f"{name}_requests_total {self.requests}",
+            f"# TYPE {name}_retries_total counter",
+            f"{name}_retries_total {self.retries}",
+            f"# TYPE {name}_throttled_total counter",
+            f"{name}_throttled_total {self.throttled}",
+            f"# TYPE {name}_rows_per_second gauge",
+            f"{name}_rows_per_second {self.rows_per_second:.3f}",
+            f"# TYPE {name}_request_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(
+            self.latency.buckets + (float("inf"),), self.latency.counts
+        ):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_request_seconds_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{name}_request_seconds_sum {self.latency.sum:.6f}")
+        lines.append(f"{name}_request_seconds_count {self.latency.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Write the metrics for the node exporter's textfile collector."""
+        # Written then renamed, so the collector never reads a partial file.
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
@@ -0,0 +1,181 @@
+"""Per-request SQL counts and timings.
+
+``instrument_engine`` registers ``QueryCounter`` on an engine's
+``before_cursor_execute`` and ``after_cursor_execute`` events. ``RequestTimingMiddleware``
+gives each request a ``RequestStats`` through a context variable, which the
+hooks add to; context variables follow the request into SQLAlchemy's
+greenlets. Each response gets a ``Server-Timing`` header with the statement
+count, the database time and the handler time, and the totals per route
+are kept in ``request_metrics`` for ``GET /metrics``.
+
+Settings come from the environment:
+
+``COWSHED_SLOW_QUERY_MS``
+    Log statements that take at least this many milliseconds, with their
+    parameters, to the ``app.slow_queries`` logger. Unset by default,
+    which turns the slow query log off.
+"""
+
+import logging
+import os
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from sqlalchemy import event
+from .ingestion_stats import LatencyHistogram
+
+slow_query_logger = logging.getLogger("app.slow_queries")
+
+METRIC_PREFIX = "cowshed_http"
+
+# Longest parameter list written to the slow query log, in characters.
+SLOW_QUERY_PARAMETERS_LIMIT = 1000
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+
+
+def _slow_query_seconds() -> Optional[float]:
+    value = os.environ.get("COWSHED_SLOW_QUERY_MS")
+    return float(value) / 1000 if value else None
+
+
+class QueryCounter:
+    """SQLAlchemy cursor event hooks timing every statement."""
+
+    def __init__(self, slow_query_seconds: Optional[float] = None):
+        self.slow_query_seconds = slow_query_seconds
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+        if self.slow_query_seconds is not None and elapsed >= self.slow_query_seconds:
+            shown = repr(parameters)
+            if len(shown) > SLOW_QUERY_PARAMETERS_LIMIT:
+                shown = shown[:SLOW_QUERY_PARAMETERS_LIMIT] + "..."
+            slow_query_logger.warning(
+                "Slow query, %.1f ms: %s parameters: %s", elapsed * 1000, statement, shown
+            )
+
+
+query_counter = QueryCounter(_slow_query_seconds())
+
+
+def instrument_engine(engine, counter: QueryCounter = query_counter):
+    """Count and time the statements of ``engine``, or of an async engine's sync engine."""
+    event.listen(engine, "before_cursor_execute", counter.before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", counter.after_cursor_execute)
+
+
+class RouteMetrics:
+    """Request totals per route, in the Prometheus text format."""
+
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        self.queries: Dict[str, int] = defaultdict(int)
+        self.db_seconds: Dict[str, float] = defaultdict(float)
+        self.latency: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+
+    def record(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        self.requests[method, route, status] += 1
+        self.queries[route] += stats.queries
+        self.db_seconds[route] += stats.db_seconds
+        self.latency[route].observe(seconds)
+
+    def prometheus_text(self) -> str:
+        name = METRIC_PREFIX
+        lines = [f"# TYPE {name}_requests_total counter"]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(
+                f'{name}_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}'
+            )
+        lines.append(f"# TYPE {name}_db_queries_total counter")
+        for route, count in sorted(self.queries.items()):
+            lines.append(f'{name}_db_queries_total{{route="{route}"}} {count}')
+        lines.append(f"# TYPE {name}_db_seconds_total counter")
+        for route, seconds in sorted(self.db_seconds.items()):
+            lines.append(f'{name}_db_seconds_total{{route="{route}"}} {seconds:.6f}')
+        lines.append(f"# TYPE {name}_request_seconds histogram")
+        for route, histogram in sorted(self.latency.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f'{name}_request_seconds_bucket{{route="{route}",le="{le}"}} {cumulative}'
+                )
+            lines.append(f'{name}_request_seconds_sum{{route="{route}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_request_seconds_count{{route="{route}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RouteMetrics()
+
+
+def server_timing(stats: RequestStats, handler_seconds: float) -> str:
+    return (
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries", '
+        f"handler;dur={handler_seconds * 1000:.1f}"
+    )
+
+
+class RequestTimingMiddleware:
+    """ASGI middleware adding ``Server-Timing`` and recording route metrics.
+
+    The header reports what happened until the response started; a
+    streamed body's statements are counted in the metrics only.
+    """
+
+    def __init__(self, app, metrics: RouteMetrics = request_metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (
+                        b"server-timing",
+                        server_timing(stats, time.perf_counter() - start).encode(),
+                    )
+                )
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request.reset(token)
+            # Unmatched paths share one label, so scanners cannot grow the metrics.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.metrics.record(
+                scope["method"], route, status, time.perf_counter() - start, stats
+            )
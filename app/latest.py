@@ -0,0 +1,143 @@
+"""Maintenance of the latest milk and weight readings stored on each cow.
+
+``Cow.latest_milk``/``latest_milk_at`` and ``latest_weight``/``latest_weight_at``
+are updated in the same transaction as every reading insert, see
+``app.readings.insert_readings``, so cow lookups are a primary key read.
+A reading only replaces the stored one if its timestamp is not older, so
+readings arriving out of order leave the newest in place. Of readings with
+equal timestamps the last inserted wins.
+
+Usage::
+
+    python -m app.latest check --database-url sqlite:///./cowshed35.db
+    python -m app.latest rebuild --database-url sqlite:///./cowshed35.db
+"""
+
+import argparse
+import logging
+import sys
+from sqlalchemy import bindparam, func, or_, select, update
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Dict, List
+from . import db_config, models
+from .dates import as_datetime
+from .logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+Cow = models.Cow
+
+# Reading kind -> (reading model, value column, timestamp column) on ``cows``.
+LATEST_COLUMNS = {
+    "milk": (models.MilkProduction, "latest_milk", "latest_milk_at"),
+    "weight": (models.Weight, "latest_weight", "latest_weight_at"),
+}
+
+
+def apply_readings(db: Session, kind: str, rows: List[Dict]):
+    """Move each cow's latest reading forward to the newest of ``rows``.
+
+    Runs inside the caller's transaction.
+    """
+    if not rows:
+        return
+    newest = {}
+    for row in rows:
+        timestamp = as_datetime(row["timestamp"])
+        current = newest.get(row["cow_id"])
+        if current is None or timestamp >= current[0]:
+            newest[row["cow_id"]] = (timestamp, row["value"])
+
+    _, value_column, at_column = LATEST_COLUMNS[kind]
+    cows = Cow.__table__
+    statement = (
+        update(cows)
+        .where(
+            cows.c.id == bindparam("cow"),
+            or_(cows.c[at_column].is_(None), cows.c[at_column] <= bindparam("at")),
+        )
+        .values({value_column: bindparam("new_value"), at_column: bindparam("at")})
+    )
+    db.connection().execute(
+        statement,
+        [
+            {"cow": cow_id, "at": timestamp, "new_value": value}
+            for cow_id, (timestamp, value) in newest.items()
+        ],
+    )
+
+
+def _recomputed(kind: str):
+    """Correlated subqueries for a cow's newest reading of ``kind``."""
+    model, _, _ = LATEST_COLUMNS[kind]
+    value = (
+        select(model.value)
+        .where(model.cow_id == Cow.id)
+        .order_by(model.timestamp.desc(), model.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    at = select(func.max(model.timestamp)).where(model.cow_id == Cow.id).scalar_subquery()
+    return value, at
+
+
+def rebuild(db: Session):
+    """Recompute the latest readings of every cow from the readings tables.
+
+    The caller commits.
+    """
+    values = {}
+    for kind, (_, value_column, at_column) in LATEST_COLUMNS.items():
+        values[value_column], values[at_column] = _recomputed(kind)
+    db.execute(update(Cow).values(values), execution_options={"synchronize_session": False})
+
+
+def check(db: Session) -> List[Dict]:
+    """Return one entry per stored latest-reading field that differs from the readings."""
+    columns = [Cow.id]
+    fields = []
+    for kind, (_, value_column, at_column) in LATEST_COLUMNS.items():
+        value, at = _recomputed(kind)
+        columns += [getattr(Cow, value_column), value, getattr(Cow, at_column), at]
+        fields += [value_column, at_column]
+
+    drift = []
+    for row in db.execute(select(*columns)):
+        cow_id, values = row[0], row[1:]
+        for field, stored, actual in zip(fields, values[::2], values[1::2]):
+            if stored != actual:
+                drift.append(
+                    {"cow_id": cow_id, "field": field, "stored": stored, "actual": actual}
+                )
+    return drift
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["check", "rebuild"])
+    parser.add_argument("--database-url", default="sqlite:///./cowshed35.db")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    engine = db_config.make_engine(args.database_url)
+    with sessionmaker(bind=engine)() as db:
+        if args.command == "rebuild":
+            rebuild(db)
+            db.commit()
+            logger.info("Rebuilt the latest readings of every cow")
+            return 0
+        drift = check(db)
+    for entry in drift:
+        logger.warning(
+            "Cow %s %s: stored %s, readings say %s",
+            entry["cow_id"],
+            entry["field"],
+            entry["stored"],
+            entry["actual"],
+        )
+    logger.info("%d drifted fields", len(drift))
+    return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Load the parquet exports straight into the database, bypassing the HTTP API.
+
+Usage::
+
+    python -m app.loader --data-dir cow_data
+"""
+
+import argparse
+import logging
+import os
+import time
+import pandas as pd
+from sqlalchemy import insert
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Dict
+from . import db_config, migrations, models, readings
+from .logging_config import configure_logging
+from .parquet_io import MEASUREMENT_COLUMNS, iter_row_groups, to_datetime_column
+
+logger = logging.getLogger(__name__)
+
+
+def load_sensors(db: Session, path: str) -> Dict[str, str]:
+    """Insert unknown sensors and return the unit of every sensor in the file."""
+    units = {}
+    inserted = 0
+    for group in iter_row_groups(path, columns=["id", "unit"]):
+        group = group.astype({"id": str})
+        known = readings.known_ids(db, models.Sensor, group["id"])
+        new = group[~group["id"].isin(known)]
+        if len(new):
+            db.execute(insert(models.Sensor), new.to_dict("records"))
+            inserted += len(new)
+        units.update(zip(group["id"], group["unit"]))
+    db.commit()
+    logger.info("Loaded %d new sensors from %s", inserted, path)
+    return units
+
+
+def load_cows(db: Session, path: str) -> int:
+    inserted = 0
+    for group in iter_row_groups(path, columns=["id", "name", "birthdate"]):
+        group = group.astype({"id": str})
+        known = readings.known_cow_ids(db, group["id"])
+        new = group[~group["id"].isin(known)]
+        if len(new):
+            birthdates = to_datetime_column(new["birthdate"], unit="ns")
+            db.execute(
+                insert(models.Cow),
+                [
+                    {"id": cow_id, "name": name, "birthdate": birthdate}
+                    for cow_id, name, birthdate in zip(
+                        new["id"], new["name"], birthdates.dt.to_pydatetime()
+                    )
+                ],
+            )
+            inserted += len(new)
+        db.commit()
+    logger.info("Loaded %d new cows from %s", inserted, path)
+    return inserted
+
+
+def prepare_measurements(group: pd.DataFrame, units: Dict[str, str]) -> pd.DataFrame:
+    """Add ``timestamp``, ``unit`` and ``kind`` columns and drop unusable rows."""
+    group = group.astype({"cow_id": str, "sensor_id": str})
+    group["timestamp"] = to_datetime_column(group["timestamp"], unit="s")
+    group["unit"] = group["sensor_id"].map(units)
+    group["kind"] = group["unit"].map(readings.UNIT_KINDS)
+    valid = group["value"].notna() & (group["value"] > 0) & group["kind"].notna()
+    return group[valid]
+
+
+def load_measurements(db: Session, path: str, units: Dict[str, str]) -> Dict[str, int]:
+    """Load measurements, skipping rows that are already stored.
+
+    Reloading a file, or resuming after an interrupted load, only adds the
+    rows that are missing.
+    """
+    counts = {"loaded": 0, "duplicates": 0, "rejected": 0}
+    for group in iter_row_groups(path, columns=MEASUREMENT_COLUMNS):
+        prepared = prepare_measurements(group, units)
+        known = readings.known_cow_ids(db, prepared["cow_id"])
+        prepared = prepared[prepared["cow_id"].isin(known)]
+
+        columns = {
+            "cow_id": prepared["cow_id"].tolist(),
+            "sensor_id": prepared["sensor_id"].tolist(),
+            "timestamp": prepared["timestamp"].dt.to_pydatetime().tolist(),
+            "value": prepared["value"].astype(float).tolist(),
+        }
+        records = [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+        kinds = prepared["kind"].tolist()
+        loaded = 0
+        for kind in readings.READING_MODELS:
+            loaded += readings.insert_measured_readings(
+                db,
+                kind,
+                [
+                    record
+                    for record, record_kind in zip(records, kinds)
+                    if record_kind == kind
+                ],
+            )
+        db.commit()
+
+        counts["loaded"] += loaded
+        counts["duplicates"] += len(records) - loaded
+        counts["rejected"] += len(group) - len(records)
+        logger.info(
+            "Loaded row group from %s: %d rows, %d duplicates, %d rejected",
+            path,
+            loaded,
+            len(records) - loaded,
+            len(group) - len(records),
+        )
+    return counts
+
+
+def load_data(db: Session, data_dir: str = "cow_data") -> Dict[str, int]:
+    units = load_sensors(db, os.path.join(data_dir, "sensors.parquet"))
+    load_cows(db, os.path.join(data_dir, "cows.parquet"))
+    return load_measurements(
+        db, os.path.join(data_dir, "measurements.parquet"), units
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", default="cow_data")
+    parser.add_argument(
+        "--database-url",
+        default=None,
+        help="defaults to the API database",
+    )
+    args = parser.parse_args(argv)
+
+    configure_logging("loader.log")
+
+    if args.database_url:
+        engine = db_config.make_engine(args.database_url)
+        migrations.upgrade(engine)
+        session_factory = sessionmaker(bind=engine)
+    else:
+        from .database import SessionLocal as session_factory
+
+    start_time = time.time()
+    with session_factory() as db:
+        counts = load_data(db, args.data_dir)
+    logger.info(
+        "Loaded %d measurements, skipped %d duplicates, rejected %d in %.1f seconds",
+        counts["loaded"],
+        counts["duplicates"],
+        counts["rejected"],
+        time.time() - start_time,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Logging setup shared by the API and the command line tools.
+
+A logging call only puts the record on a queue. A background thread
+formats it and writes it to standard error and the log file, so a slow
+disk or terminal never stalls the event loop or a request. Messages take
+``%`` style arguments, which are only formatted for records that pass the
+level check, and then on the writer thread. Arguments should therefore
+not be mutated after the call.
+
+Settings come from the environment:
+
+``COWSHED_LOG_LEVEL``
+    Level of the root logger. Defaults to ``INFO``.
+``COWSHED_LOG_LEVELS``
+    Levels of single loggers, e.g. ``app.ingestion=DEBUG,aiosqlite=WARNING``.
+"""
+
+import atexit
+import logging
+import os
+import queue
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+_listener: Optional[QueueListener] = None
+_listener_pid: Optional[int] = None
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Enqueues records unformatted; the listener's handlers format them."""
+
+    def prepare(self, record):
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """Parse ``name=LEVEL,name=LEVEL`` into a mapping of logger names to levels."""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, sep, level = item.partition("=")
+        if not sep:
+            raise ValueError(f"Expected name=LEVEL in COWSHED_LOG_LEVELS, got {item!r}")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(
+    log_file: Optional[str] = None,
+    level: Optional[str] = None,
+    levels: Optional[Dict[str, str]] = None,
+):
+    """Send all records through a queue to standard error and ``log_file``.
+
+    ``level`` and ``levels`` override the environment. Calling it again in
+    the same process does nothing; a forked worker process calls it to get
+    its own writer thread in place of the one it inherited.
+    """
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel((level or os.environ.get("COWSHED_LOG_LEVEL", "INFO")).upper())
+    module_levels = parse_levels(os.environ.get("COWSHED_LOG_LEVELS", ""))
+    module_levels.update(levels or {})
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out the queued records and stop the writer thread.
+
+    Registered to run at exit. Worker processes, which exit without running
+    exit handlers, call it when their work is done.
+    """
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+class LogSampler:
+    """Logs the first and then every ``every``-th occurrence of a message.
+
+    Occurrences are counted per message template, and each logged line
+    carries the count so far. A flood of identical per-row messages costs
+    a counter increment, while the first of each kind is still logged.
+    """
+
+    def __init__(self, logger: logging.Logger, every: int = 1000):
+        self.logger = logger
+        self.every = every
+        self.counts: Counter = Counter()
+
+    def log(self, level: int, msg: str, *args):
+        self.counts[msg] += 1
+        count = self.counts[msg]
+        if (count == 1 or count % self.every == 0) and self.logger.isEnabledFor(level):
+            self.logger.log(level, msg + " (%d so far)", *args, count)
+
+    def warning(self, msg: str, *args):
+        self.log(logging.WARNING, msg, *args)
+
+    def log_totals(self, level: int = logging.INFO):
+        """Log how often each sampled message occurred."""
+        for msg, count in self.counts.items():
+            self.logger.log(level, "%d times: %s", count, msg)
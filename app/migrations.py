@@ -0,0 +1,199 @@
+"""Bring existing databases up to the current schema.
+
+``Base.metadata.create_all`` only creates missing tables, so columns and
+indexes added to tables that already exist are applied here. Every
+migration checks the live schema first and can run any number of times.
+
+Usage::
+
+    python -m app.migrations --database-url sqlite:///./cowshed35.db
+"""
+
+import argparse
+import logging
+import uuid
+from sqlalchemy import String, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from . import db_config, latest, models, rollup
+from .logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+def _column_names(conn: Connection, table_name: str):
+    return {column["name"] for column in inspect(conn).get_columns(table_name)}
+
+
+def add_reading_days(conn: Connection):
+    """Add and backfill the stored ``day`` column of the milk and weights tables."""
+    if conn.dialect.name == "sqlite":
+        day_expression = "date(timestamp)"
+    else:
+        day_expression = "CAST(timestamp AS DATE)"
+    for model in (models.MilkProduction, models.Weight):
+        table_name = model.__tablename__
+        if "day" not in _column_names(conn, table_name):
+            logger.info("Adding day column to %s", table_name)
+            conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN day DATE"))
+            conn.execute(text(f"UPDATE {table_name} SET day = {day_expression}"))
+
+
+def dedupe_measurements(conn: Connection):
+    """Drop repeated measurements so their natural key index can be created.
+
+    The first stored copy of every (cow, sensor, timestamp) is kept.
+    """
+    index_names = {index["name"] for index in inspect(conn).get_indexes("measurements")}
+    if "uq_measurements_cow_sensor_timestamp" in index_names:
+        return
+    deleted = conn.execute(
+        text(
+            "DELETE FROM measurements WHERE rowid NOT IN "
+            "(SELECT min(rowid) FROM measurements GROUP BY cow_id, sensor_id, timestamp)"
+            if conn.dialect.name == "sqlite"
+            else "DELETE FROM measurements WHERE id NOT IN "
+            "(SELECT min(id) FROM measurements GROUP BY cow_id, sensor_id, timestamp)"
+        )
+    ).rowcount
+    if deleted:
+        logger.info("Removed %d duplicate measurements", deleted)
+
+
+# Tables of the original layout and their columns that held UUID strings.
+LEGACY_UUID_COLUMNS = {
+    "sensors": ["id"],
+    "cows": ["id"],
+    "measurements": ["cow_id", "sensor_id"],
+    "milk": ["cow_id"],
+    "weights": ["cow_id"],
+}
+
+
+def _uuid_bytes(value):
+    return None if value is None else uuid.UUID(value).bytes
+
+
+def convert_uuid_keys(conn: Connection):
+    """Rewrite tables keyed by UUID strings into the compact layout.
+
+    Cow and sensor ids become 16 byte blobs and reading rows get integer
+    row ids. Only SQLite databases predate this layout.
+    """
+    if conn.dialect.name != "sqlite":
+        return
+    inspector = inspect(conn)
+    id_column = next(c for c in inspector.get_columns("cows") if c["name"] == "id")
+    if not isinstance(id_column["type"], String):
+        return
+
+    logger.info("Converting UUID string keys to binary keys")
+    conn.connection.driver_connection.create_function(
+        "uuid_bytes", 1, _uuid_bytes, deterministic=True
+    )
+    # Without this, SQLite points the foreign keys of other tables, such as
+    # daily_cow_stats, at the renamed legacy table that is dropped below.
+    conn.execute(text("PRAGMA legacy_alter_table=ON"))
+    for table_name, uuid_columns in LEGACY_UUID_COLUMNS.items():
+        table = models.Base.metadata.tables[table_name]
+        legacy_name = f"_legacy_{table_name}"
+        old_columns = {c["name"] for c in inspector.get_columns(table_name)}
+        for index in inspector.get_indexes(table_name):
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+        conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {legacy_name}"))
+        table.create(conn)
+
+        columns = [
+            c.name
+            for c in table.columns
+            if c.name in old_columns and not (c.primary_key and c.name not in uuid_columns)
+        ]
+        selected = [
+            f"uuid_bytes({name})" if name in uuid_columns else name for name in columns
+        ]
+        conn.execute(
+            text(
+                f"INSERT INTO {table_name} ({', '.join(columns)}) "
+                f"SELECT {', '.join(selected)} FROM {legacy_name} ORDER BY rowid"
+            )
+        )
+        conn.execute(text(f"DROP TABLE {legacy_name}"))
+    conn.execute(text("PRAGMA legacy_alter_table=OFF"))
+
+
+def create_missing_indexes(conn: Connection):
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def build_daily_rollup(conn: Connection):
+    """Fill ``daily_cow_stats`` for databases that have readings but no rollup yet."""
+    has_stats = conn.execute(text("SELECT 1 FROM daily_cow_stats LIMIT 1")).first()
+    has_readings = conn.execute(
+        text("SELECT 1 FROM milk UNION ALL SELECT 1 FROM weights LIMIT 1")
+    ).first()
+    if has_readings and not has_stats:
+        logger.info("Building daily_cow_stats from existing readings")
+        rollup.rebuild(Session(bind=conn))
+
+
+def add_latest_readings(conn: Connection):
+    """Add and fill the latest reading columns of ``cows``."""
+    existing = _column_names(conn, "cows")
+    for _, value_column, at_column in latest.LATEST_COLUMNS.values():
+        if value_column not in existing:
+            logger.info("Adding %s and %s to cows", value_column, at_column)
+            conn.execute(text(f"ALTER TABLE cows ADD COLUMN {value_column} FLOAT"))
+            conn.execute(text(f"ALTER TABLE cows ADD COLUMN {at_column} DATETIME"))
+    missing = conn.execute(
+        text(
+            "SELECT 1 FROM cows WHERE "
+            "(latest_milk_at IS NULL AND EXISTS (SELECT 1 FROM milk WHERE milk.cow_id = cows.id)) "
+            "OR (latest_weight_at IS NULL AND EXISTS (SELECT 1 FROM weights WHERE weights.cow_id = cows.id)) "
+            "LIMIT 1"
+        )
+    ).first()
+    if missing:
+        logger.info("Filling the latest readings of cows from existing readings")
+        latest.rebuild(Session(bind=conn))
+
+
+MIGRATIONS = [
+    dedupe_measurements,
+    add_reading_days,
+    convert_uuid_keys,
+    create_missing_indexes,
+    build_daily_rollup,
+    add_latest_readings,
+]
+
+
+def upgrade(engine: Engine):
+    with engine.begin() as conn:
+        models.Base.metadata.create_all(bind=conn)
+        for migration in MIGRATIONS:
+            migration(conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite:///./cowshed35.db")
+    parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="rebuild the file afterwards to return freed pages to the OS",
+    )
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    engine = db_config.make_engine(args.database_url)
+    upgrade(engine)
+    if args.vacuum:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+    logger.info("%s is up to date", args.database_url)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,54 @@
 from sqlalchemy import (
     Column,
+    Integer,
     String,
     Float,
+    Date,
     DateTime,
     ForeignKey,
+    Index,
+    LargeBinary,
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import TypeDecorator
+from datetime import datetime
 import uuid
 
 Base = declarative_base()
 
 
+class UUIDBinary(TypeDecorator):
+    """A UUID stored as its 16 raw bytes and exposed as the canonical string.
+
+    Queries keep comparing against ``str(uuid)`` values while rows and index
+    entries carry 16 bytes instead of a 36 character string.
+    """
+
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        return value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return str(uuid.UUID(bytes=bytes(value)))
+
+
+def new_uuid():
+    return str(uuid.uuid4())
+
+
 class Sensor(Base):
     __tablename__ = "sensors"
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(UUIDBinary, primary_key=True, default=new_uuid)
     unit = Column(String, nullable=False)
 
     measurements = relationship("Measurement", back_populates="sensor")
@@ -24,19 +57,35 @@ class Sensor(Base):
 class Cow(Base):
     __tablename__ = "cows"
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(UUIDBinary, primary_key=True, default=new_uuid)
     name = Column(String, nullable=False)
     birthdate = Column(DateTime, nullable=False)
+    # Newest readings, maintained on insert by ``app.latest``.
+    latest_milk = Column(Float)
+    latest_milk_at = Column(DateTime)
+    latest_weight = Column(Float)
+    latest_weight_at = Column(DateTime)
 
     measurements = relationship("Measurement", back_populates="cow")
 
 
 class Measurement(Base):
     __tablename__ = "measurements"
+    __table_args__ = (
+        # Natural key of a reading. Replayed uploads hit this index and are
+        # skipped instead of being stored twice.
+        Index(
+            "uq_measurements_cow_sensor_timestamp",
+            "cow_id",
+            "sensor_id",
+            "timestamp",
+            unique=True,
+        ),
+    )
 
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    cow_id = Column(String, ForeignKey("cows.id"), nullable=False)
-    sensor_id = Column(String, ForeignKey("sensors.id"), nullable=False)
+    id = Column(Integer, primary_key=True)
+    cow_id = Column(UUIDBinary, ForeignKey("cows.id"), nullable=False)
+    sensor_id = Column(UUIDBinary, ForeignKey("sensors.id"), nullable=False)
     timestamp = Column(DateTime, nullable=False)
     value = Column(Float, nullable=False)
 
@@ -56,23 +105,71 @@ class Measurement(Base):
             raise ValueError(f"Unsupported unit: {self.sensor.unit}")
 
 
+def timestamp_day(context):
+    """Column default deriving the stored ``day`` from the row's timestamp."""
+    timestamp = context.get_current_parameters()["timestamp"]
+    return timestamp.date() if isinstance(timestamp, datetime) else timestamp
+
+
 class MilkProduction(Base):
     __tablename__ = "milk"
-
-    id = Column(
-        String, primary_key=True, default=lambda: str(uuid.uuid4())
+    __table_args__ = (
+        Index("ix_milk_cow_id_timestamp", "cow_id", "timestamp"),
+        Index("ix_milk_day_cow_id", "day", "cow_id"),
     )
-    cow_id = Column(String, ForeignKey("cows.id"), nullable=False)
+
+    id = Column(Integer, primary_key=True)
+    cow_id = Column(UUIDBinary, ForeignKey("cows.id"), nullable=False)
     timestamp = Column(DateTime, nullable=False)
+    # Stored calendar day of ``timestamp`` so daily filters are index range
+    # scans instead of evaluating date(timestamp) on every row.
+    day = Column(Date, nullable=False, default=timestamp_day)
     value = Column(Float, nullable=False)
 
 
 class Weight(Base):
     __tablename__ = "weights"
-
-    id = Column(
-        String, primary_key=True, default=lambda: str(uuid.uuid4())
+    __table_args__ = (
+        Index("ix_weights_cow_id_timestamp", "cow_id", "timestamp"),
+        Index("ix_weights_day_cow_id", "day", "cow_id"),
     )
-    cow_id = Column(String, ForeignKey("cows.id"), nullable=False)
+
+    id = Column(Integer, primary_key=True)
+    cow_id = Column(UUIDBinary, ForeignKey("cows.id"), nullable=False)
     timestamp = Column(DateTime, nullable=False)
+    day = Column(Date, nullable=False, default=timestamp_day)
     value = Column(Float, nullable=False)
+
+
+class DailyCowStats(Base):
+    """Per cow, per day rollup of milk and weight readings.
+
+    Maintained in the same transaction as every reading insert, see
+    ``app.rollup``, so reports never have to read raw readings.
+    """
+
+    __tablename__ = "daily_cow_stats"
+    __table_args__ = (Index("ix_daily_cow_stats_day", "day"),)
+
+    cow_id = Column(UUIDBinary, ForeignKey("cows.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    milk_total = Column(Float, nullable=False, default=0.0)
+    milk_count = Column(Integer, nullable=False, default=0)
+    weight_sum = Column(Float, nullable=False, default=0.0)
+    weight_count = Column(Integer, nullable=False, default=0)
+    last_weight = Column(Float)
+    last_weight_at = Column(DateTime)
+
+
+class ReportWatermark(Base):
+    """Version of the readings of one day, bumped by every insert on that day.
+
+    A report depends on the days of its window, so the versions of those
+    days tell whether a cached report is still current, see
+    ``app.watermarks``.
+    """
+
+    __tablename__ = "report_watermarks"
+
+    day = Column(Date, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from fastparquet import ParquetFile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Columns of measurements.parquet read by the ingester and the loader.
+MEASUREMENT_COLUMNS = ["cow_id", "sensor_id", "timestamp", "value"]
+
+
+def iter_row_groups(
+    path: str, columns: Optional[List[str]] = None
+) -> Iterator[pd.DataFrame]:
+    """Yield a parquet file one row group at a time.
+
+    Only one row group is held in memory at once, and only the requested
+    ``columns`` are decoded.
+    """
+    parquet_file = ParquetFile(path)
+    yield from parquet_file.iter_row_groups(columns=columns)
+
+
+def iter_positioned_batches(
+    path: str,
+    columns: List[str],
+    batch_size: int,
+    row_group: int = 0,
+    row_offset: int = 0,
+    shard_by: Optional[str] = None,
+    shard: int = 0,
+    shards: int = 1,
+) -> Iterator[Tuple[Tuple[int, int], Dict[str, list]]]:
+    """Yield ``((row_group, row_offset), batch)`` pairs starting at a position.
+
+    Batches hold at most ``batch_size`` rows as plain column lists. Each
+    row group is decoded, converted to Python lists and released before the
+    next one is read, so memory is bounded by the largest row group rather
+    than by the file. The lists are copies, so a batch waiting in a queue
+    does not keep its row group alive.
+
+    The position paired with a batch is where the *next* batch starts, so
+    it can be stored as a checkpoint once the batch is handled and passed
+    back in to resume. Row groups before ``row_group`` are not decoded.
+
+    With ``shard_by``, only the rows of shard ``shard`` out of ``shards``
+    are yielded, see ``shard_mask``; positions then count rows within the
+    shard.
+    """
+    parquet_file = ParquetFile(path)
+    for index in range(row_group, len(parquet_file.row_groups)):
+        group = parquet_file[index].to_pandas(columns=columns)
+        if shard_by is not None:
+            group = group[shard_mask(group[shard_by], shard, shards)]
+        column_lists = {column: group[column].tolist() for column in columns}
+        del group
+        rows = len(column_lists[columns[0]])
+        start = row_offset if index == row_group else 0
+        for start in range(start, rows, batch_size):
+            end = min(start + batch_size, rows)
+            position = (index + 1, 0) if end == rows else (index, end)
+            yield position, {
+                column: values[start:end] for column, values in column_lists.items()
+            }
+
+
+def shard_mask(keys: pd.Series, shard: int, shards: int) -> np.ndarray:
+    """Select the rows whose key hashes to ``shard``.
+
+    The hash is stable across processes and runs, so every row of a key
+    lands in the same shard. The mask keeps the rows' file order, but the
+    shard's chunks may be sent concurrently.
+    """
+    hashes = pd.util.hash_pandas_object(keys.astype(str), index=False).to_numpy()
+    return hashes % shards == shard
+
+
+def to_datetime_column(series: pd.Series, unit: str) -> pd.Series:
+    """Convert an epoch column to naive datetimes, leaving datetime columns as is."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series, unit=unit)
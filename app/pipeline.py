@@ -0,0 +1,118 @@
+"""Bounded, adaptive concurrency for the HTTP ingestion client."""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = {429, 503}
+DEFAULT_RETRY_AFTER = 1.0
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class AdaptiveLimiter:
+    """Caps the number of requests in flight and adapts the cap to the server.
+
+    The limit grows additively while responses come back faster than
+    ``target_latency`` and shrinks multiplicatively when they are slower.
+    A 429 or 503 halves it and holds back new requests for the server's
+    ``Retry-After``.
+    """
+
+    def __init__(
+        self,
+        limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        target_latency: float = 1.0,
+    ):
+        self.limit = float(min(max(limit, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.throttled = 0
+        self._condition = asyncio.Condition()
+        self._resume_at = 0.0
+        self._last_decrease = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        try:
+            delay = self._resume_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def _decrease(self, factor: float):
+        # Responses of one overloaded burst arrive together; shrink once per burst.
+        now = time.monotonic()
+        if now - self._last_decrease >= self.target_latency:
+            self.limit = max(float(self.min_limit), self.limit * factor)
+            self._last_decrease = now
+            logger.info("Concurrency limit lowered to %d", self.limit)
+
+    def record(self, status: int, latency: float, retry_after: Optional[str] = None):
+        if status in THROTTLE_STATUSES:
+            self.throttled += 1
+            self._resume_at = max(
+                self._resume_at, time.monotonic() + parse_retry_after(retry_after)
+            )
+            self._decrease(0.5)
+        elif latency > self.target_latency:
+            self._decrease(0.9)
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+
+_DONE = object()
+
+
+async def run_pipeline(
+    items: Iterable, handle: Callable[..., Awaitable], workers: int
+):
+    """Feed ``items`` through ``workers`` tasks so that many stay in flight.
+
+    The queue is bounded, so items are only pulled from ``items`` as fast
+    as the workers consume them.
+    """
+    queue = asyncio.Queue(maxsize=workers * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try:
+                if item is _DONE:
+                    return
+                await handle(item)
+            except Exception as e:
+                logger.exception("Unexpected error in ingestion worker: %s", e)
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        for item in items:
+            await queue.put(item)
+        for _ in tasks:
+            await queue.put(_DONE)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,116 @@
+import uuid
+from datetime import datetime, time
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Set
+from . import illness, latest, models, rollup, watermarks
+
+READING_MODELS = {"milk": models.MilkProduction, "weight": models.Weight}
+
+# Sensor units as stored in sensors.parquet, see Measurement.infer_measurement_type.
+UNIT_KINDS = {"L": "milk", "kg": "weight"}
+
+# SQLite caps the number of bound parameters per statement, so large IN
+# lists are split into chunks of this size.
+IN_CLAUSE_CHUNK_SIZE = 900
+
+
+def known_ids(db: Session, model, ids: Iterable[str]) -> Set[str]:
+    """Return the subset of ``ids`` that already exist in ``model``'s table."""
+    ids = list(set(ids))
+    known = set()
+    for i in range(0, len(ids), IN_CLAUSE_CHUNK_SIZE):
+        chunk = ids[i : i + IN_CLAUSE_CHUNK_SIZE]
+        known.update(row[0] for row in db.query(model.id).filter(model.id.in_(chunk)))
+    return known
+
+
+def known_cow_ids(db: Session, cow_ids: Iterable[str]) -> Set[str]:
+    return known_ids(db, models.Cow, cow_ids)
+
+
+def insert_missing(db: Session, model, rows: List[Dict]) -> int:
+    """Insert the rows whose ``id`` is not in ``model``'s table and return how many.
+
+    Existing rows are left as they are. A row inserted concurrently by
+    another request is skipped by the conflict clause. The caller commits.
+    """
+    rows = list({row["id"]: row for row in rows}.values())
+    known = known_ids(db, model, (row["id"] for row in rows))
+    missing = [row for row in rows if row["id"] not in known]
+    if missing:
+        db.execute(rollup.dialect_insert(db, model).on_conflict_do_nothing(), missing)
+    return len(missing)
+
+
+def insert_readings(db: Session, kind: str, rows: List[Dict]) -> int:
+    """Insert milk or weight rows with a single executemany statement.
+
+    ``rows`` are dicts with ``cow_id``, ``timestamp`` and ``value`` keys.
+    The daily rollup, the cows' latest readings and the report watermarks
+    are updated in the same transaction, and the illness detector once it
+    commits. The caller owns the transaction and is responsible for
+    committing.
+    """
+    if not rows:
+        return 0
+    db.execute(insert(READING_MODELS[kind]), rows)
+    rollup.apply_readings(db, kind, rows)
+    latest.apply_readings(db, kind, rows)
+    watermarks.apply_readings(db, rows)
+    illness.stage_readings(db, kind, rows)
+    return len(rows)
+
+
+def _natural_key(cow_id, sensor_id, timestamp):
+    # Keys of input rows are compared with keys read back from the database,
+    # so both are normalised the way the column types store them.
+    if not isinstance(timestamp, datetime):
+        timestamp = datetime.combine(timestamp, time.min)
+    return (
+        str(uuid.UUID(str(cow_id))),
+        str(uuid.UUID(str(sensor_id))),
+        timestamp.replace(tzinfo=None),
+    )
+
+
+def record_measurements(db: Session, rows: List[Dict]) -> List[Dict]:
+    """Store raw sensor measurements and return the ones that were new.
+
+    ``rows`` are dicts with ``cow_id``, ``sensor_id``, ``timestamp`` and
+    ``value`` keys. Rows whose (cow, sensor, timestamp) is already stored,
+    or repeated within ``rows``, are skipped by the unique index, so
+    replaying an upload is a no-op.
+    """
+    unique = {}
+    for row in rows:
+        unique.setdefault(
+            _natural_key(row["cow_id"], row["sensor_id"], row["timestamp"]), row
+        )
+    if not unique:
+        return []
+    table = models.Measurement
+    statement = (
+        rollup.dialect_insert(db, table)
+        .on_conflict_do_nothing(index_elements=["cow_id", "sensor_id", "timestamp"])
+        .returning(table.cow_id, table.sensor_id, table.timestamp)
+    )
+    inserted = {
+        _natural_key(*row) for row in db.execute(statement, list(unique.values()))
+    }
+    return [row for key, row in unique.items() if key in inserted]
+
+
+def insert_measured_readings(db: Session, kind: str, rows: List[Dict]) -> int:
+    """Record sensor readings of one kind, inserting only new ones as readings.
+
+    Like ``insert_readings`` but ``rows`` also carry ``sensor_id`` and are
+    deduplicated through ``record_measurements`` first. Returns the number
+    of new rows.
+    """
+    new = record_measurements(db, rows)
+    return insert_readings(
+        db,
+        kind,
+        [{key: row[key] for key in ("cow_id", "timestamp", "value")} for row in new],
+    )
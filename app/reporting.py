@@ -1,69 +1,455 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from datetime import datetime, timedelta
-from app.models import Cow, MilkProduction, Weight
+"""The farm report: milk, weight and illness flags of every cow on a day.
 
+Reports are streamed: rows come off the database cursor in batches and are
+written out section by section as text, CSV or parquet, so memory does not
+grow with the herd.
 
-def generate_report(db_session: Session, report_date: datetime):
-    report_data = {}
+Usage::
 
-    milk_data = (
-        db_session.query(
-            MilkProduction.cow_id, func.sum(MilkProduction.value).label("total_milk")
+    python -m app.reporting --date 2024-10-14 --format csv --output report.csv
+    python -m app.reporting --from 2024-10-01 --to 2024-10-31 --format parquet --output october.parquet
+"""
+
+import argparse
+import csv
+import io
+import sys
+import numpy as np
+import pandas as pd
+from fastparquet import write as write_parquet
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import LargeBinary, String, func, select, type_coerce
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Union
+from app import db_config
+from app.dates import as_date
+from app.models import Cow, DailyCowStats
+
+REPORT_WINDOW_DAYS = 30
+ILLNESS_WEIGHT_RATIO = 0.9
+LOW_MILK_LITERS = 5
+
+# Rows fetched from the cursor, and written out, at a time.
+REPORT_BATCH_SIZE = 1000
+
+REPORT_COLUMNS = [
+    "cow_id",
+    "total_milk",
+    "latest_weight",
+    "avg_weight_last_30_days",
+    "potentially_ill",
+]
+
+RANGE_REPORT_COLUMNS = ["day"] + REPORT_COLUMNS
+
+REPORT_FORMATS = ("text", "csv", "parquet")
+
+# Longest range a single range report may cover.
+MAX_RANGE_DAYS = 366
+
+
+def farm_report_query(
+    report_date: date, after: Optional[str] = None, limit: Optional[int] = None
+):
+    """Build the single statement behind every farm report.
+
+    Each row carries a cow's milk total for ``report_date`` and its latest
+    and average weight over the trailing window ending on that day. Only
+    the ``daily_cow_stats`` rollup is read: each column is a correlated
+    subquery that seeks the cow's rows of the window through the
+    (cow_id, day) primary key, so the cost is proportional to the number of
+    cows reported.
+
+    ``after`` and ``limit`` select a page of cows by id (keyset
+    pagination).
+    """
+    window_start = report_date - timedelta(days=REPORT_WINDOW_DAYS)
+
+    cows = select(Cow.id)
+    if after is not None:
+        cows = cows.where(Cow.id > after)
+    if limit is not None:
+        cows = cows.order_by(Cow.id).limit(limit)
+    cows = cows.subquery()
+
+    total_milk = (
+        select(DailyCowStats.milk_total)
+        .where(DailyCowStats.cow_id == cows.c.id)
+        .where(DailyCowStats.day == report_date)
+        .where(DailyCowStats.milk_count > 0)
+        .scalar_subquery()
+    )
+    weight_days = (
+        DailyCowStats.cow_id == cows.c.id,
+        DailyCowStats.day >= window_start,
+        DailyCowStats.day <= report_date,
+        DailyCowStats.weight_count > 0,
+    )
+    latest_weight = (
+        select(DailyCowStats.last_weight)
+        .where(*weight_days)
+        .order_by(DailyCowStats.day.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    avg_weight = (
+        select(
+            func.sum(DailyCowStats.weight_sum) / func.sum(DailyCowStats.weight_count)
         )
-        .filter(func.date(MilkProduction.timestamp) == report_date.date())
-        .group_by(MilkProduction.cow_id)
-        .all()
+        .where(*weight_days)
+        .scalar_subquery()
     )
 
-    for cow_id, total_milk in milk_data:
-        report_data[cow_id] = {
-            "total_milk": total_milk,
-        }
-
-    for cow_id, cow_name in db_session.query(Cow.id, Cow.name).all():
-        latest_weight = (
-            db_session.query(Weight.value)
-            .filter(Weight.cow_id == cow_id)
-            .order_by(Weight.timestamp.desc())
-            .first()
-        )
+    return select(
+        cows.c.id.label("cow_id"),
+        total_milk.label("total_milk"),
+        latest_weight.label("latest_weight"),
+        avg_weight.label("avg_weight_last_30_days"),
+    ).order_by(cows.c.id)
 
-        thirty_days_ago = report_date - timedelta(days=30)
-        avg_weight = (
-            db_session.query(func.avg(Weight.value))
-            .filter(and_(Weight.cow_id == cow_id, Weight.timestamp >= thirty_days_ago))
-            .scalar()
-        )
 
-        report_data[cow_id].update(
-            {
-                "latest_weight": latest_weight[0] if latest_weight else None,
-                "avg_weight_last_30_days": avg_weight,
-            }
-        )
+def is_potentially_ill(total_milk, latest_weight, avg_weight) -> bool:
+    if latest_weight and avg_weight and latest_weight < ILLNESS_WEIGHT_RATIO * avg_weight:
+        return True
+    return bool(total_milk) and total_milk < LOW_MILK_LITERS
 
-    potential_illness = []
-    for cow_id, data in report_data.items():
-        if data.get("latest_weight") and data.get("avg_weight_last_30_days"):
-            if data["latest_weight"] < (0.9 * data["avg_weight_last_30_days"]):
-                potential_illness.append(cow_id)
-        if data.get("total_milk") and data["total_milk"] < 5:
-            potential_illness.append(cow_id)
-
-    report = f"Report for {report_date.date()}\n"
-    report += "=========================================\n"
-    for cow_id, data in report_data.items():
-        report += f"Cow ID: {cow_id}\n"
-        report += f"Total Milk Production: {data.get('total_milk', 'N/A')} liters\n"
-        report += f"Latest Weight: {data.get('latest_weight', 'N/A')} kg\n"
-        report += (
-            f"30-day Avg Weight: {data.get('avg_weight_last_30_days', 'N/A')} kg\n"
-        )
-        report += "-----------------------------------------\n"
 
-    if potential_illness:
-        report += "\nPotentially Ill Cows:\n"
-        report += "\n".join(potential_illness)
+def report_row(row) -> Dict:
+    return {
+        "cow_id": row.cow_id,
+        "total_milk": row.total_milk,
+        "latest_weight": row.latest_weight,
+        "avg_weight_last_30_days": row.avg_weight_last_30_days,
+        "potentially_ill": is_potentially_ill(
+            row.total_milk, row.latest_weight, row.avg_weight_last_30_days
+        ),
+    }
+
+
+def farm_report(db_session: Session, report_date: Union[date, datetime]) -> List[Dict]:
+    """Return one report row per cow, ordered by cow id."""
+    query = farm_report_query(as_date(report_date))
+    return [report_row(row) for row in db_session.execute(query)]
+
+
+def iter_report_rows(
+    db_session: Session,
+    report_date: Union[date, datetime],
+    batch_size: int = REPORT_BATCH_SIZE,
+) -> Iterator[Dict]:
+    """Yield the report rows one by one, fetching ``batch_size`` at a time."""
+    query = farm_report_query(as_date(report_date))
+    result = db_session.execute(query, execution_options={"yield_per": batch_size})
+    for row in result:
+        yield report_row(row)
+
+
+def _or_na(value):
+    return "N/A" if value is None else value
+
+
+def text_header(report_date: date) -> str:
+    return f"Report for {report_date}\n=========================================\n"
+
+
+def text_section(data: Dict) -> str:
+    return (
+        f"Cow ID: {data['cow_id']}\n"
+        f"Total Milk Production: {_or_na(data['total_milk'])} liters\n"
+        f"Latest Weight: {_or_na(data['latest_weight'])} kg\n"
+        f"30-day Avg Weight: {_or_na(data['avg_weight_last_30_days'])} kg\n"
+        "-----------------------------------------\n"
+    )
+
+
+def text_footer(ill_cow_ids: List[str]) -> str:
+    if not ill_cow_ids:
+        return ""
+    return "\nPotentially Ill Cows:\n" + "\n".join(ill_cow_ids)
+
+
+class TextReport:
+    """The text report of one day, assembled from rows fed in any batches.
+
+    Only the ids of potentially ill cows are kept until the end, for the
+    closing list.
+    """
+
+    def __init__(self, report_date: Union[date, datetime]):
+        self.report_date = as_date(report_date)
+        self.ill_cow_ids: List[str] = []
+
+    def header(self) -> str:
+        return text_header(self.report_date)
+
+    def sections(self, rows: Iterable[Dict]) -> str:
+        parts = []
+        for data in rows:
+            parts.append(text_section(data))
+            if data["potentially_ill"]:
+                self.ill_cow_ids.append(str(data["cow_id"]))
+        return "".join(parts)
+
+    def footer(self) -> str:
+        return text_footer(self.ill_cow_ids)
+
+
+def iter_text_report(rows: Iterable[Dict], report_date: Union[date, datetime]) -> Iterator[str]:
+    """Yield the text report section by section, see ``TextReport``."""
+    report = TextReport(report_date)
+    yield report.header()
+    for data in rows:
+        yield report.sections([data])
+    yield report.footer()
+
+
+def iter_csv_report(
+    rows: Iterable[Dict], header: bool = True, batch_size: int = REPORT_BATCH_SIZE
+) -> Iterator[str]:
+    """Yield the report as CSV text, ``batch_size`` rows per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(REPORT_COLUMNS)
+    pending = 0
+    for data in rows:
+        writer.writerow([data[column] for column in REPORT_COLUMNS])
+        pending += 1
+        if pending == batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+REPORT_DTYPES = {
+    "cow_id": str,
+    "total_milk": "float64",
+    "latest_weight": "float64",
+    "avg_weight_last_30_days": "float64",
+    "potentially_ill": bool,
+}
+
+
+def report_frame(rows: List[Dict]) -> pd.DataFrame:
+    return pd.DataFrame.from_records(rows, columns=REPORT_COLUMNS).astype(REPORT_DTYPES)
+
+
+def write_parquet_report(
+    rows: Iterable[Dict], path: str, batch_size: int = REPORT_BATCH_SIZE
+) -> int:
+    """Write the report to a parquet file, one row group per ``batch_size`` rows.
+
+    Returns the number of rows written.
+    """
+    written = 0
+    batch = []
+
+    def flush():
+        write_parquet(path, report_frame(batch), append=written > 0, write_index=False)
+
+    for data in rows:
+        batch.append(data)
+        if len(batch) == batch_size:
+            flush()
+            written += len(batch)
+            batch = []
+    if batch or not written:
+        flush()
+        written += len(batch)
+    return written
+
+
+def write_report(
+    db_session: Session,
+    report_date: Union[date, datetime],
+    out: Union[TextIO, str],
+    format: str = "text",
+    batch_size: int = REPORT_BATCH_SIZE,
+):
+    """Stream the report for ``report_date`` to ``out``.
+
+    ``out`` is a text stream for the ``text`` and ``csv`` formats and a file
+    path for ``parquet``.
+    """
+    rows = iter_report_rows(db_session, report_date, batch_size)
+    if format == "parquet":
+        write_parquet_report(rows, out, batch_size)
+        return
+    if format == "csv":
+        chunks = iter_csv_report(rows, batch_size=batch_size)
+    elif format == "text":
+        chunks = iter_text_report(rows, report_date)
+    else:
+        raise ValueError(f"Unknown report format {format!r}, expected one of {REPORT_FORMATS}")
+    out.writelines(chunks)
+
+
+def generate_report(db_session: Session, report_date: Union[date, datetime]) -> str:
+    """Return the whole text report as one string; prefer ``write_report``."""
+    return "".join(iter_text_report(iter_report_rows(db_session, report_date), report_date))
+
+
+def _day_grid(offsets, cows, values, shape, fill):
+    grid = np.full(shape, fill, dtype="float64")
+    grid[cows, offsets] = values
+    return grid
+
+
+def range_report_frame(db_session: Session, start: date, end: date) -> pd.DataFrame:
+    """Return the report of every cow on every day from ``start`` to ``end``.
+
+    The rows equal those of ``farm_report`` for each day, ordered by day and
+    cow id. The rollup rows of the range and its trailing window are read
+    with one query into cow by day grids; daily milk, the latest weight and
+    the windowed weight average are then computed for all cow-days at once.
+    """
+    start, end = as_date(start), as_date(end)
+    if start > end:
+        raise ValueError(f"Range starts on {start}, after its end {end}")
+    first_day = start - timedelta(days=REPORT_WINDOW_DAYS)
+    total_days = (end - first_day).days + 1
+    report_days = (end - start).days + 1
+
+    # Ids are kept as raw bytes, which sort like the canonical strings, and
+    # only converted once per cow.
+    # Rows go through a plain connection and days are parsed in one go:
+    # per-row ORM and date processing would outweigh the computation.
+    conn = db_session.connection()
+    raw_id = type_coerce(Cow.id, LargeBinary)
+    cow_keys = pd.Index(conn.execute(select(raw_id).order_by(Cow.id)).scalars().all())
+    id_type = Cow.__table__.c.id.type
+    cow_ids = np.array([id_type.process_result_value(key, None) for key in cow_keys], dtype=object)
+
+    stats = pd.DataFrame(
+        conn.execute(
+            select(
+                type_coerce(DailyCowStats.cow_id, LargeBinary),
+                type_coerce(DailyCowStats.day, String),
+                DailyCowStats.milk_total,
+                DailyCowStats.milk_count,
+                DailyCowStats.weight_sum,
+                DailyCowStats.weight_count,
+                DailyCowStats.last_weight,
+            ).where(DailyCowStats.day >= first_day, DailyCowStats.day <= end)
+        ).all(),
+        columns=["cow", "day", "milk_total", "milk_count", "weight_sum", "weight_count", "last_weight"],
+    )
+    cows = cow_keys.get_indexer(stats["cow"])
+    stats = stats[cows >= 0]
+    cows = cows[cows >= 0]
+    offsets = (
+        pd.to_datetime(stats["day"]).to_numpy() - np.datetime64(first_day)
+    ).astype("timedelta64[D]").astype(int)
+    shape = (len(cow_keys), total_days)
+
+    milked = (stats["milk_count"] > 0).to_numpy()
+    milk = _day_grid(offsets[milked], cows[milked], stats["milk_total"][milked], shape, np.nan)
+    weighed = (stats["weight_count"] > 0).to_numpy()
+    weight_sum = _day_grid(offsets, cows, stats["weight_sum"], shape, 0.0)
+    weight_count = _day_grid(offsets, cows, stats["weight_count"], shape, 0.0)
+    last_weight = _day_grid(offsets[weighed], cows[weighed], stats["last_weight"][weighed], shape, np.nan)
+
+    # Window sums over the REPORT_WINDOW_DAYS + 1 days ending on each report day.
+    window = REPORT_WINDOW_DAYS + 1
+    sums = sliding_window_view(weight_sum, window, axis=1).sum(axis=-1)
+    counts = sliding_window_view(weight_count, window, axis=1).sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_weight = np.where(counts > 0, sums / counts, np.nan)
+    latest_weight = (
+        pd.DataFrame(last_weight).ffill(axis=1, limit=REPORT_WINDOW_DAYS).to_numpy()[:, REPORT_WINDOW_DAYS:]
+    )
+    total_milk = milk[:, REPORT_WINDOW_DAYS:]
+
+    ill = (
+        (latest_weight > 0) & (avg_weight > 0) & (latest_weight < ILLNESS_WEIGHT_RATIO * avg_weight)
+    ) | ((total_milk != 0) & (total_milk < LOW_MILK_LITERS))
+
+    days = pd.date_range(start, end).date
+    return pd.DataFrame(
+        {
+            "day": np.repeat(days, len(cow_ids)),
+            "cow_id": np.tile(cow_ids, report_days),
+            # Transposed so that the rows of one day are contiguous.
+            "total_milk": total_milk.T.ravel(),
+            "latest_weight": latest_weight.T.ravel(),
+            "avg_weight_last_30_days": avg_weight.T.ravel(),
+            "potentially_ill": ill.T.ravel(),
+        },
+        columns=RANGE_REPORT_COLUMNS,
+    )
+
+
+def columnar(frame: pd.DataFrame) -> Dict[str, list]:
+    """Return ``frame`` as one list per column, missing values as None."""
+    return {
+        column: frame[column].astype(object).where(frame[column].notna(), None).tolist()
+        for column in frame.columns
+    }
+
+
+def write_range_report(
+    db_session: Session,
+    start: date,
+    end: date,
+    out: Union[TextIO, str],
+    format: str = "text",
+):
+    """Write the report of every day from ``start`` to ``end`` to ``out``.
+
+    The text format is the single day report of each day in turn.
+    """
+    frame = range_report_frame(db_session, start, end)
+    if format == "parquet":
+        frame = frame.astype(REPORT_DTYPES).assign(day=pd.to_datetime(frame["day"]))
+        write_parquet(out, frame, write_index=False)
+    elif format == "csv":
+        frame.to_csv(out, index=False, lineterminator="\n")
+    elif format == "text":
+        for day, rows in frame.groupby("day", sort=True):
+            records = rows[REPORT_COLUMNS].astype(object).where(rows[REPORT_COLUMNS].notna(), None)
+            out.writelines(iter_text_report(records.to_dict("records"), day))
+            out.write("\n\n")
+    else:
+        raise ValueError(f"Unknown report format {format!r}, expected one of {REPORT_FORMATS}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today())
+    parser.add_argument(
+        "--from", dest="from_date", type=date.fromisoformat,
+        help="report every day from this date up to --to instead of --date",
+    )
+    parser.add_argument("--to", dest="to_date", type=date.fromisoformat)
+    parser.add_argument("--format", choices=REPORT_FORMATS, default="text")
+    parser.add_argument("--output", help="file to write, standard output if omitted")
+    parser.add_argument("--database-url", default="sqlite:///./cowshed35.db")
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet" and not args.output:
+        parser.error("--format parquet needs --output")
+    if (args.from_date is None) != (args.to_date is None):
+        parser.error("--from and --to go together")
+
+    def write(db, out):
+        if args.from_date is None:
+            write_report(db, args.date, out, args.format)
+        else:
+            write_range_report(db, args.from_date, args.to_date, out, args.format)
+
+    engine = db_config.make_engine(args.database_url)
+    with sessionmaker(bind=engine)() as db:
+        if args.output is None or args.format == "parquet":
+            write(db, args.output or sys.stdout)
+        else:
+            with open(args.output, "w", newline="") as out:
+                write(db, out)
+    return 0
+
 
-    return report
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""Maintenance of the ``daily_cow_stats`` rollup.
+
+Usage::
+
+    python -m app.rollup rebuild --database-url sqlite:///./cowshed35.db
+"""
+
+import argparse
+import logging
+from collections import defaultdict
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Dict, List
+from . import db_config, models
+from .dates import as_date, as_datetime
+from .logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+Stats = models.DailyCowStats
+
+REBUILD_CHUNK_SIZE = 10_000
+
+
+def dialect_insert(db: Session, model):
+    """Return an INSERT for ``model`` that supports ON CONFLICT clauses.
+
+    Only SQLite and PostgreSQL have them; other dialects raise ValueError.
+    """
+    name = db.get_bind().dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"Unsupported database dialect {name!r}, expected sqlite or postgresql")
+    return insert(model)
+
+
+def _upsert_milk(db: Session, stats: List[Dict]):
+    stmt = dialect_insert(db, Stats)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Stats.cow_id, Stats.day],
+        set_={
+            "milk_total": Stats.milk_total + stmt.excluded.milk_total,
+            "milk_count": Stats.milk_count + stmt.excluded.milk_count,
+        },
+    )
+    db.execute(stmt, stats)
+
+
+def _upsert_weights(db: Session, stats: List[Dict]):
+    stmt = dialect_insert(db, Stats)
+    is_newer = (Stats.last_weight_at.is_(None)) | (
+        stmt.excluded.last_weight_at >= Stats.last_weight_at
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Stats.cow_id, Stats.day],
+        set_={
+            "weight_sum": Stats.weight_sum + stmt.excluded.weight_sum,
+            "weight_count": Stats.weight_count + stmt.excluded.weight_count,
+            "last_weight": case(
+                (is_newer, stmt.excluded.last_weight), else_=Stats.last_weight
+            ),
+            "last_weight_at": case(
+                (is_newer, stmt.excluded.last_weight_at), else_=Stats.last_weight_at
+            ),
+        },
+    )
+    db.execute(stmt, stats)
+
+
+def apply_readings(db: Session, kind: str, rows: List[Dict]):
+    """Fold freshly inserted milk or weight rows into the rollup.
+
+    Runs inside the caller's transaction so the rollup commits or rolls
+    back together with the readings themselves.
+    """
+    if not rows:
+        return
+    if kind == "milk":
+        totals = defaultdict(lambda: [0.0, 0])
+        for row in rows:
+            total = totals[(row["cow_id"], as_date(row["timestamp"]))]
+            total[0] += row["value"]
+            total[1] += 1
+        _upsert_milk(
+            db,
+            [
+                {"cow_id": cow_id, "day": day, "milk_total": total, "milk_count": count}
+                for (cow_id, day), (total, count) in totals.items()
+            ],
+        )
+    else:
+        totals = {}
+        for row in rows:
+            key = (row["cow_id"], as_date(row["timestamp"]))
+            timestamp = as_datetime(row["timestamp"])
+            total = totals.setdefault(key, [0.0, 0, None, None])
+            total[0] += row["value"]
+            total[1] += 1
+            if total[3] is None or timestamp >= total[3]:
+                total[2], total[3] = row["value"], timestamp
+        _upsert_weights(
+            db,
+            [
+                {
+                    "cow_id": cow_id,
+                    "day": day,
+                    "weight_sum": total,
+                    "weight_count": count,
+                    "last_weight": last_weight,
+                    "last_weight_at": last_weight_at,
+                }
+                for (cow_id, day), (total, count, last_weight, last_weight_at) in totals.items()
+            ],
+        )
+
+
+def rebuild(db: Session):
+    """Recompute the whole rollup from the milk and weights tables.
+
+    The caller commits.
+    """
+    db.execute(delete(Stats))
+
+    milk = select(
+        models.MilkProduction.cow_id,
+        models.MilkProduction.day,
+        func.sum(models.MilkProduction.value).label("milk_total"),
+        func.count().label("milk_count"),
+    ).group_by(models.MilkProduction.cow_id, models.MilkProduction.day)
+    for chunk in db.execute(milk).mappings().partitions(REBUILD_CHUNK_SIZE):
+        _upsert_milk(db, [dict(row) for row in chunk])
+
+    ranked = select(
+        models.Weight.cow_id,
+        models.Weight.day,
+        models.Weight.timestamp,
+        models.Weight.value,
+        func.sum(models.Weight.value)
+        .over(partition_by=(models.Weight.cow_id, models.Weight.day))
+        .label("weight_sum"),
+        func.count()
+        .over(partition_by=(models.Weight.cow_id, models.Weight.day))
+        .label("weight_count"),
+        func.row_number()
+        .over(
+            partition_by=(models.Weight.cow_id, models.Weight.day),
+            order_by=(models.Weight.timestamp.desc(), models.Weight.id.desc()),
+        )
+        .label("position"),
+    ).subquery()
+    weights = select(
+        ranked.c.cow_id,
+        ranked.c.day,
+        ranked.c.weight_sum,
+        ranked.c.weight_count,
+        ranked.c.value.label("last_weight"),
+        ranked.c.timestamp.label("last_weight_at"),
+    ).where(ranked.c.position == 1)
+    for chunk in db.execute(weights).mappings().partitions(REBUILD_CHUNK_SIZE):
+        _upsert_weights(db, [dict(row) for row in chunk])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--database-url", default="sqlite:///./cowshed35.db")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    engine = db_config.make_engine(args.database_url)
+    models.Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        rebuild(db)
+        db.commit()
+        rows = db.query(Stats).count()
+    logger.info("Rebuilt daily_cow_stats: %d rows", rows)
+
+
+if __name__ == "__main__":
+    main()
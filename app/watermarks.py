@@ -0,0 +1,54 @@
+"""Per-day data versions that tell whether a cached report is current.
+
+Every reading insert bumps the version of the days it touches, in the
+same transaction, see ``app.readings.insert_readings``. The report for a
+day depends on the readings of its trailing window and on the set of
+cows, so its watermark is the sum of the versions of the window's days
+together with the number of cows. Versions only grow, so any insert in
+the window changes the watermark.
+
+Writes that bypass ``insert_readings`` are not seen; clear the report
+cache after them.
+"""
+
+from datetime import date, timedelta
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Tuple
+from . import models, rollup
+from .dates import as_date
+from .reporting import REPORT_WINDOW_DAYS
+
+Watermark = models.ReportWatermark
+
+
+def bump(db: Session, days: Iterable[date]):
+    """Bump the version of each of ``days``. Runs in the caller's transaction."""
+    days = sorted(set(days))
+    if not days:
+        return
+    stmt = rollup.dialect_insert(db, Watermark)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Watermark.day], set_={"version": Watermark.version + 1}
+    )
+    db.execute(stmt, [{"day": day, "version": 1} for day in days])
+
+
+def apply_readings(db: Session, rows: List[Dict]):
+    bump(db, (as_date(row["timestamp"]) for row in rows))
+
+
+def watermark_query(report_date: date):
+    """Select the watermark of the report for ``report_date``."""
+    window_start = report_date - timedelta(days=REPORT_WINDOW_DAYS)
+    versions = (
+        select(func.coalesce(func.sum(Watermark.version), 0))
+        .where(Watermark.day >= window_start, Watermark.day <= report_date)
+        .scalar_subquery()
+    )
+    cows = select(func.count()).select_from(models.Cow).scalar_subquery()
+    return select(versions, cows)
+
+
+def watermark(db: Session, report_date: date) -> Tuple[int, int]:
+    return tuple(db.execute(watermark_query(report_date)).one())
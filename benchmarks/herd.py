@@ -0,0 +1,142 @@
+"""Write a synthetic herd in the layout of ``cow_data``.
+
+The same arguments always produce the same files: every id, timestamp and
+value comes from one seeded generator. ``sensors.parquet`` holds milk
+(``L``) and weight (``kg``) sensors, ``cows.parquet`` the cows with their
+birthdates in nanoseconds and ``measurements.parquet`` the readings in
+time order, epoch seconds, one row group per day. Of each cow's daily
+readings the last is a weight and the others are milkings.
+
+Usage::
+
+    python -m benchmarks.herd --output cow_data --cows 1000 --days 30 --readings-per-day 3
+"""
+
+import argparse
+import os
+import uuid
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from fastparquet import write
+
+# Readings start on this day, at midnight UTC.
+START = datetime(2024, 9, 15, tzinfo=timezone.utc)
+
+SECONDS_PER_DAY = 86_400
+
+
+def _uuids(rng, count):
+    return [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(count)]
+
+
+def generate_herd(
+    directory: str,
+    cows: int = 1000,
+    days: int = 30,
+    readings_per_day: int = 3,
+    sensors: int = 10,
+    invalid_fraction: float = 0.0,
+    seed: int = 0,
+) -> dict:
+    """Write the three parquet files into ``directory`` and describe them.
+
+    ``invalid_fraction`` of the readings get a missing or negative value,
+    which the ingester and the loader reject.
+    """
+    if readings_per_day < 2:
+        raise ValueError("readings_per_day must leave room for a milking and a weighing")
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    sensor_ids = _uuids(rng, max(2, sensors))
+    units = ["L" if i % 2 == 0 else "kg" for i in range(len(sensor_ids))]
+    write(
+        os.path.join(directory, "sensors.parquet"),
+        pd.DataFrame({"id": sensor_ids, "unit": units}),
+        write_index=False,
+    )
+    milk_sensors = np.array([s for s, unit in zip(sensor_ids, units) if unit == "L"], dtype=object)
+    weight_sensors = np.array([s for s, unit in zip(sensor_ids, units) if unit == "kg"], dtype=object)
+
+    cow_ids = np.array(_uuids(rng, cows), dtype=object)
+    birthdates = pd.Timestamp("2018-01-01").value + rng.integers(
+        0, 5 * 365 * SECONDS_PER_DAY, cows
+    ) * 1_000_000_000
+    write(
+        os.path.join(directory, "cows.parquet"),
+        pd.DataFrame({"id": cow_ids, "name": [f"cow-{i}" for i in range(cows)], "birthdate": birthdates}),
+        write_index=False,
+    )
+
+    # Each cow keeps its sensors and drifts around its own weight.
+    cow_milk_sensor = milk_sensors[np.arange(cows) % len(milk_sensors)]
+    cow_weight_sensor = weight_sensors[np.arange(cows) % len(weight_sensors)]
+    base_weight = rng.uniform(450, 650, cows)
+
+    path = os.path.join(directory, "measurements.parquet")
+    slot = np.tile(np.arange(readings_per_day), cows)
+    cow_index = np.repeat(np.arange(cows), readings_per_day)
+    is_weight = slot == readings_per_day - 1
+    rows = 0
+    for day in range(days):
+        day_start = int(START.timestamp()) + day * SECONDS_PER_DAY
+        slot_start = day_start + slot * (SECONDS_PER_DAY // readings_per_day)
+        timestamp = slot_start + rng.integers(0, SECONDS_PER_DAY // readings_per_day, len(slot))
+        value = np.where(
+            is_weight,
+            base_weight[cow_index] + rng.normal(0, 5, len(slot)),
+            rng.uniform(5, 20, len(slot)),
+        )
+        invalid = rng.random(len(slot)) < invalid_fraction
+        value[invalid] = np.where(rng.random(invalid.sum()) < 0.5, np.nan, -1.0)
+        frame = pd.DataFrame(
+            {
+                "cow_id": cow_ids[cow_index],
+                "sensor_id": np.where(is_weight, cow_weight_sensor[cow_index], cow_milk_sensor[cow_index]),
+                "timestamp": timestamp,
+                "value": value,
+            }
+        )
+        frame = frame.sort_values("timestamp", kind="stable", ignore_index=True)
+        write(path, frame, write_index=False, append=day > 0)
+        rows += len(frame)
+
+    return {
+        "cows": cows,
+        "sensors": len(sensor_ids),
+        "measurements": rows,
+        "first_day": START.date().isoformat(),
+        "last_day": (START + pd.Timedelta(days=days - 1)).date().isoformat(),
+        "cow_ids": cow_ids.tolist(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="cow_data")
+    parser.add_argument("--cows", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--readings-per-day", type=int, default=3)
+    parser.add_argument("--sensors", type=int, default=10)
+    parser.add_argument("--invalid-fraction", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    herd = generate_herd(
+        args.output,
+        args.cows,
+        args.days,
+        args.readings_per_day,
+        args.sensors,
+        args.invalid_fraction,
+        args.seed,
+    )
+    print(
+        f"{herd['cows']} cows, {herd['sensors']} sensors and {herd['measurements']} measurements "
+        f"from {herd['first_day']} to {herd['last_day']} in {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Requests per second of the sync and async API paths under concurrent load.
+
+Both servers run under uvicorn against the same seeded SQLite file. The
+sync server uses the original blocking handlers from
+``benchmarks.sync_app``; the async server is ``app.api``.
+
+Usage::
+
+    python -m benchmarks.load_test --concurrency 32 --duration 10
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+import aiohttp
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+from app import migrations, models, readings
+
+SERVERS = {
+    "sync": "benchmarks.sync_app:app",
+    "async": "app.api:app",
+}
+
+
+def seed(url, cows, days):
+    engine = create_engine(url)
+    migrations.upgrade(engine)
+    cow_ids = [str(uuid.uuid4()) for _ in range(cows)]
+    start = datetime(2024, 10, 14) - timedelta(days=days)
+    with Session(engine) as db:
+        db.execute(
+            insert(models.Cow),
+            [{"id": cow_id, "name": "cow", "birthdate": datetime(2020, 1, 1)} for cow_id in cow_ids],
+        )
+        for day in range(days):
+            timestamp = start + timedelta(days=day)
+            readings.insert_readings(
+                db, "milk", [{"cow_id": c, "timestamp": timestamp, "value": 12.0} for c in cow_ids]
+            )
+            readings.insert_readings(
+                db, "weight", [{"cow_id": c, "timestamp": timestamp, "value": 500.0} for c in cow_ids]
+            )
+        db.commit()
+    engine.dispose()
+    return cow_ids
+
+
+async def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{base_url}/docs") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not start")
+
+
+async def run_load(base_url, cow_ids, concurrency, duration, write_ratio):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async def worker(session, rng):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            cow_id = rng.choice(cow_ids)
+            start = time.perf_counter()
+            if rng.random() < write_ratio:
+                request = session.post(
+                    f"{base_url}/cows/{cow_id}/milk",
+                    json={"date": date.today().isoformat(), "value": 10.0},
+                )
+            else:
+                request = session.get(f"{base_url}/cows/{cow_id}")
+            async with request as response:
+                await response.read()
+                if response.status >= 400:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(
+            *(worker(session, random.Random(i)) for i in range(concurrency))
+        )
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / duration,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def benchmark(name, url, cow_ids, args):
+    env = dict(os.environ, COWSHED_DATABASE_URL=url)
+    port = args.port
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", SERVERS[name], "--port", str(port), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_until_up(base_url))
+        return asyncio.run(
+            run_load(base_url, cow_ids, args.concurrency, args.duration, args.write_ratio)
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cows", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'load.db')}"
+        cow_ids = seed(url, args.cows, args.days)
+        print(f"{args.cows} cows, {args.concurrency} concurrent clients, {args.duration:.0f} s per server")
+        print(f"{'path':8}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for name in SERVERS:
+            result = benchmark(name, url, cow_ids, args)
+            print(
+                f"{name:8}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10.1f}"
+                f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""The API under ``/api``, where the ingester sends its requests.
+
+Served by uvicorn in ``benchmarks.suite``; imported only by the server
+process, since importing ``app.api`` opens ``COWSHED_DATABASE_URL``.
+"""
+
+from fastapi import FastAPI
+from app import api
+
+app = FastAPI()
+app.mount("/api", api.app)
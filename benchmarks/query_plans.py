@@ -0,0 +1,144 @@
+"""Show query plans and timings for the hot read queries before and after
+the reading indexes and stored ``day`` columns.
+
+A database with the original schema is filled with synthetic readings,
+measured, upgraded in place with ``app.migrations`` and measured again.
+
+Usage::
+
+    python -m benchmarks.query_plans --cows 2000 --days 60
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine, func, select
+from app import migrations, models, reporting
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE cows (id VARCHAR NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, birthdate DATETIME NOT NULL)",
+    "CREATE TABLE sensors (id VARCHAR NOT NULL PRIMARY KEY, unit VARCHAR NOT NULL)",
+    "CREATE TABLE measurements (id VARCHAR NOT NULL PRIMARY KEY, cow_id VARCHAR NOT NULL, sensor_id VARCHAR NOT NULL, timestamp DATETIME NOT NULL, value FLOAT NOT NULL)",
+    "CREATE TABLE milk (id VARCHAR NOT NULL PRIMARY KEY, cow_id VARCHAR NOT NULL, timestamp DATETIME NOT NULL, value FLOAT NOT NULL)",
+    "CREATE TABLE weights (id VARCHAR NOT NULL PRIMARY KEY, cow_id VARCHAR NOT NULL, timestamp DATETIME NOT NULL, value FLOAT NOT NULL)",
+]
+
+LEGACY_LATEST_WEIGHT = "SELECT value FROM weights WHERE cow_id = ? ORDER BY timestamp DESC LIMIT 1"
+LEGACY_DAILY_MILK = "SELECT cow_id, sum(value) FROM milk WHERE date(timestamp) = ? GROUP BY cow_id"
+LEGACY_AVG_WEIGHT = "SELECT avg(value) FROM weights WHERE cow_id = ? AND timestamp >= ?"
+LEGACY_COW_MILK = "SELECT sum(value) FROM milk WHERE cow_id = ? AND date(timestamp) = ?"
+
+
+def build_legacy_database(path, cows, days, end_date, seed=0):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    for statement in LEGACY_SCHEMA:
+        conn.execute(statement)
+    cow_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(cows)]
+    conn.executemany(
+        "INSERT INTO cows VALUES (?, ?, '2020-01-01 00:00:00.000000')",
+        [(cow_id, f"cow-{i}") for i, cow_id in enumerate(cow_ids)],
+    )
+    start = datetime.combine(end_date, datetime.min.time()) - timedelta(days=days - 1)
+    for day in range(days):
+        day_start = start + timedelta(days=day)
+        milk, weights = [], []
+        for cow_id in cow_ids:
+            for hour in (6, 18):
+                milk.append((str(uuid.uuid4()), cow_id, str(day_start + timedelta(hours=hour)), rng.uniform(8, 20)))
+            weights.append((str(uuid.uuid4()), cow_id, str(day_start + timedelta(hours=7)), rng.uniform(400, 600)))
+        conn.executemany("INSERT INTO milk VALUES (?, ?, ?, ?)", milk)
+        conn.executemany("INSERT INTO weights VALUES (?, ?, ?, ?)", weights)
+    conn.commit()
+    conn.close()
+    return cow_ids
+
+
+def timed(function, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def print_plan(title, rows, elapsed_ms):
+    print(f"\n{title} ({elapsed_ms:.2f} ms)")
+    for row in rows:
+        print(f"    {row[-1]}")
+
+
+def explain_statement(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    return conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", tuple(params)).all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cows", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=60)
+    args = parser.parse_args(argv)
+
+    report_date = date(2024, 10, 14)
+    thirty_days_ago = str(datetime.combine(report_date - timedelta(days=30), datetime.min.time()))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cowshed35.db")
+        cow_ids = build_legacy_database(path, args.cows, args.days, report_date)
+        print(f"{args.cows} cows, {args.days} days, {args.cows * args.days * 3} readings")
+
+        print("\n=== before: original schema ===")
+        conn = sqlite3.connect(path)
+        cow_id = cow_ids[len(cow_ids) // 2]
+        for title, sql, params in [
+            ("latest weight of one cow", LEGACY_LATEST_WEIGHT, (cow_id,)),
+            ("daily milk per cow", LEGACY_DAILY_MILK, (str(report_date),)),
+        ]:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            print_plan(title, plan, timed(lambda: conn.execute(sql, params).fetchall()))
+
+        def legacy_report():
+            for cow in cow_ids:
+                conn.execute(LEGACY_COW_MILK, (cow, str(report_date))).fetchall()
+                conn.execute(LEGACY_LATEST_WEIGHT, (cow,)).fetchall()
+                conn.execute(LEGACY_AVG_WEIGHT, (cow, thirty_days_ago)).fetchall()
+
+        print(f"\nfarm report, three queries per cow ({timed(legacy_report, repeat=1):.2f} ms)")
+        conn.close()
+
+        engine = create_engine(f"sqlite:///{path}")
+        start = time.perf_counter()
+        migrations.upgrade(engine)
+        print(f"\nmigrated in {time.perf_counter() - start:.2f} s")
+
+        print("\n=== after: indexes and stored day columns ===")
+        latest_weight = (
+            select(models.Weight.value)
+            .where(models.Weight.cow_id == cow_id)
+            .order_by(models.Weight.timestamp.desc())
+            .limit(1)
+        )
+        daily_milk = (
+            select(models.MilkProduction.cow_id, func.sum(models.MilkProduction.value))
+            .where(models.MilkProduction.day == report_date)
+            .group_by(models.MilkProduction.cow_id)
+        )
+        report = reporting.farm_report_query(report_date)
+        with engine.connect() as conn:
+            for title, statement in [
+                ("latest weight of one cow", latest_weight),
+                ("daily milk per cow", daily_milk),
+                ("farm report, single statement", report),
+            ]:
+                plan = explain_statement(conn, statement)
+                print_plan(title, plan, timed(lambda: conn.execute(statement).all()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Compare building the text report as one string with streaming it.
+
+A database of ``--cows`` cows with ``--days`` days of rollup rows is
+written, then the report is produced the old way (every row loaded and
+the text built with ``+=``) and streamed by ``reporting.write_report`` as
+text, CSV and parquet. Each is timed and run once more under tracemalloc
+for its peak Python memory.
+
+Usage::
+
+    python -m benchmarks.report_output --cows 100000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import models, reporting
+
+REPORT_DATE = date(2024, 10, 14)
+
+
+def build_database(path, cows, days, seed=0):
+    """Write ``cows`` cows and a milk and weight rollup row per cow and day."""
+    models.Base.metadata.create_all(create_engine(f"sqlite:///{path}"))
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    cow_ids = [uuid.UUID(int=rng.getrandbits(128), version=4).bytes for _ in range(cows)]
+    conn.executemany(
+        "INSERT INTO cows (id, name, birthdate) VALUES (?, ?, '2020-01-01 00:00:00.000000')",
+        [(cow_id, f"cow-{i}") for i, cow_id in enumerate(cow_ids)],
+    )
+    for offset in range(days):
+        day = REPORT_DATE - timedelta(days=offset)
+        weighed_at = str(datetime.combine(day, datetime.min.time()) + timedelta(hours=7))
+        rows = []
+        for cow_id in cow_ids:
+            weight = rng.uniform(400, 600)
+            rows.append((cow_id, str(day), rng.uniform(3, 40), 2, weight, 1, weight, weighed_at))
+        conn.executemany(
+            "INSERT INTO daily_cow_stats (cow_id, day, milk_total, milk_count, weight_sum,"
+            " weight_count, last_weight, last_weight_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    conn.commit()
+    conn.close()
+
+
+def concatenated_report(db, report_date):
+    """The text report as built before it was streamed."""
+    report_data = reporting.farm_report(db, report_date)
+    report = f"Report for {report_date}\n"
+    report += "=========================================\n"
+    for data in report_data:
+        report += f"Cow ID: {data['cow_id']}\n"
+        report += f"Total Milk Production: {reporting._or_na(data['total_milk'])} liters\n"
+        report += f"Latest Weight: {reporting._or_na(data['latest_weight'])} kg\n"
+        report += f"30-day Avg Weight: {reporting._or_na(data['avg_weight_last_30_days'])} kg\n"
+        report += "-----------------------------------------\n"
+    potential_illness = [data["cow_id"] for data in report_data if data["potentially_ill"]]
+    if potential_illness:
+        report += "\nPotentially Ill Cows:\n"
+        report += "\n".join(potential_illness)
+    return report
+
+
+def measure(function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cows", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=31)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cowshed35.db")
+        start = time.perf_counter()
+        build_database(path, args.cows, args.days)
+        print(f"{args.cows} cows, {args.days} days of rollup rows, built in {time.perf_counter() - start:.1f} s\n")
+
+        db = sessionmaker(bind=create_engine(f"sqlite:///{path}"))()
+        text_path = os.path.join(tmp, "report.txt")
+        csv_path = os.path.join(tmp, "report.csv")
+        parquet_path = os.path.join(tmp, "report.parquet")
+
+        def concatenated():
+            with open(text_path, "w") as out:
+                out.write(concatenated_report(db, REPORT_DATE))
+
+        def streamed(format, output):
+            def run():
+                if format == "parquet":
+                    reporting.write_report(db, REPORT_DATE, output, format)
+                    return
+                with open(output, "w", newline="") as out:
+                    reporting.write_report(db, REPORT_DATE, out, format)
+            return run
+
+        cases = [
+            ("text, concatenated", concatenated, text_path),
+            ("text, streamed", streamed("text", text_path), text_path),
+            ("csv, streamed", streamed("csv", csv_path), csv_path),
+            ("parquet, streamed", streamed("parquet", parquet_path), parquet_path),
+        ]
+        print(f"{'output':24}{'time':>10}{'peak memory':>16}{'file size':>14}")
+        for label, function, output in cases:
+            elapsed, peak = measure(function)
+            size = os.path.getsize(output)
+            print(f"{label:24}{elapsed:>8.2f} s{peak / 2**20:>12.1f} MiB{size / 2**20:>10.1f} MiB")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Ingestion and report latency under each SQLite connection profile.
+
+For every profile in ``app.db_config.SQLITE_PROFILES`` a fresh database is
+seeded and then measured for:
+
+* single-reading commits, the shape of POST /cows/{id}/milk
+* bulk commits of ``--bulk-size`` readings, the shape of the bulk endpoint
+* farm report generation
+* single-reading commits while another thread generates reports
+
+Usage::
+
+    python -m benchmarks.sqlite_profiles --cows 2000 --days 30
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app import db_config, migrations, models, readings, reporting
+
+REPORT_DATE = date(2024, 10, 14)
+
+
+def seed(engine, cows, days):
+    cow_ids = [str(uuid.uuid4()) for _ in range(cows)]
+    start = datetime.combine(REPORT_DATE, datetime.min.time()) - timedelta(days=days - 1)
+    with Session(engine) as db:
+        db.execute(
+            insert(models.Cow),
+            [{"id": cow_id, "name": "cow", "birthdate": datetime(2020, 1, 1)} for cow_id in cow_ids],
+        )
+        for day in range(days):
+            timestamp = start + timedelta(days=day)
+            readings.insert_readings(
+                db, "milk", [{"cow_id": c, "timestamp": timestamp, "value": 12.0} for c in cow_ids]
+            )
+            readings.insert_readings(
+                db, "weight", [{"cow_id": c, "timestamp": timestamp, "value": 500.0} for c in cow_ids]
+            )
+        db.commit()
+    return cow_ids
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+
+
+def single_commits(engine, cow_ids, count, rng):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        with Session(engine) as db:
+            readings.insert_readings(
+                db,
+                "milk",
+                [{"cow_id": rng.choice(cow_ids), "timestamp": REPORT_DATE, "value": 10.0}],
+            )
+            db.commit()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bulk_commits(engine, cow_ids, count, size, rng):
+    latencies = []
+    for _ in range(count):
+        rows = [
+            {"cow_id": rng.choice(cow_ids), "timestamp": REPORT_DATE, "value": 10.0}
+            for _ in range(size)
+        ]
+        start = time.perf_counter()
+        with Session(engine) as db:
+            readings.insert_readings(db, "milk", rows)
+            db.commit()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def reports(engine, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        with Session(engine) as db:
+            reporting.farm_report(db, REPORT_DATE)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def commits_during_reports(engine, cow_ids, count, rng):
+    stop = threading.Event()
+
+    def report_loop():
+        while not stop.is_set():
+            with Session(engine) as db:
+                reporting.farm_report(db, REPORT_DATE)
+
+    reader = threading.Thread(target=report_loop)
+    reader.start()
+    try:
+        return single_commits(engine, cow_ids, count, rng)
+    finally:
+        stop.set()
+        reader.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cows", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--commits", type=int, default=300)
+    parser.add_argument("--bulk-size", type=int, default=5000)
+    parser.add_argument("--profiles", nargs="*", default=list(db_config.SQLITE_PROFILES))
+    args = parser.parse_args(argv)
+
+    print(f"{args.cows} cows, {args.days} days, {args.commits} single commits per profile")
+    header = ["single p50", "single p99", "bulk p50", "report p50", "contended p50", "contended p99"]
+    print(f"{'profile':10}" + "".join(f"{h:>15}" for h in header) + "   (ms)")
+    for profile in args.profiles:
+        with tempfile.TemporaryDirectory() as tmp:
+            url = f"sqlite:///{os.path.join(tmp, 'profile.db')}"
+            engine = db_config.make_engine(url, profile=profile)
+            migrations.upgrade(engine)
+            cow_ids = seed(engine, args.cows, args.days)
+            rng = random.Random(0)
+
+            single = single_commits(engine, cow_ids, args.commits, rng)
+            bulk = bulk_commits(engine, cow_ids, 10, args.bulk_size, rng)
+            report = reports(engine, 5)
+            contended = commits_during_reports(engine, cow_ids, args.commits, rng)
+            engine.dispose()
+
+        values = [
+            percentile(single, 0.5),
+            percentile(single, 0.99),
+            percentile(bulk, 0.5),
+            percentile(report, 0.5),
+            percentile(contended, 0.5),
+            percentile(contended, 0.99),
+        ]
+        print(f"{profile:10}" + "".join(f"{v:>15.2f}" for v in values))
+
+
+if __name__ == "__main__":
+    main()
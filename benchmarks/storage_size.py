@@ -0,0 +1,169 @@
+"""Compare on-disk size of the UUID-string layout and the compact layout.
+
+Both databases receive the same synthetic readings: every reading is one
+``measurements`` row plus one ``milk`` or ``weights`` row, as written by
+``app.loader``.
+
+Usage::
+
+    python -m benchmarks.storage_size --rows 10000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from app import models
+
+# The layout before integer row ids and binary UUIDs.
+STRING_KEY_SCHEMA = [
+    "CREATE TABLE cows (id VARCHAR NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, birthdate DATETIME NOT NULL)",
+    "CREATE TABLE sensors (id VARCHAR NOT NULL PRIMARY KEY, unit VARCHAR NOT NULL)",
+    "CREATE TABLE measurements (id VARCHAR NOT NULL PRIMARY KEY, cow_id VARCHAR NOT NULL, sensor_id VARCHAR NOT NULL, timestamp DATETIME NOT NULL, value FLOAT NOT NULL)",
+    "CREATE TABLE milk (id VARCHAR NOT NULL PRIMARY KEY, cow_id VARCHAR NOT NULL, timestamp DATETIME NOT NULL, day DATE NOT NULL, value FLOAT NOT NULL)",
+    "CREATE TABLE weights (id VARCHAR NOT NULL PRIMARY KEY, cow_id VARCHAR NOT NULL, timestamp DATETIME NOT NULL, day DATE NOT NULL, value FLOAT NOT NULL)",
+    "CREATE INDEX ix_milk_cow_id_timestamp ON milk (cow_id, timestamp)",
+    "CREATE INDEX ix_milk_day_cow_id ON milk (day, cow_id)",
+    "CREATE INDEX ix_weights_cow_id_timestamp ON weights (cow_id, timestamp)",
+    "CREATE INDEX ix_weights_day_cow_id ON weights (day, cow_id)",
+]
+
+CHUNK_SIZE = 100_000
+
+
+def synthetic_readings(rows, cows, seed=0):
+    """Yield (cow, sensor, kind, timestamp, value) tuples, UUIDs as uuid.UUID."""
+    rng = random.Random(seed)
+    cow_ids = [uuid.UUID(int=rng.getrandbits(128), version=4) for _ in range(cows)]
+    sensors = {
+        "milk": uuid.UUID(int=rng.getrandbits(128), version=4),
+        "weight": uuid.UUID(int=rng.getrandbits(128), version=4),
+    }
+    start = datetime(2024, 1, 1)
+    for i in range(rows):
+        cow = cow_ids[i % cows]
+        kind = "weight" if i // cows % 3 == 0 else "milk"
+        timestamp = start + timedelta(minutes=(i // cows) * 480 + rng.randrange(60))
+        value = rng.uniform(400, 600) if kind == "weight" else rng.uniform(5, 20)
+        yield cow, sensors[kind], kind, timestamp, value
+
+
+def fill(conn, rows, cows, encode, row_id):
+    """Insert cows, sensors and readings; ``encode`` turns a UUID into its stored form."""
+    seen_cows, seen_sensors = set(), set()
+    batch = {"measurements": [], "milk": [], "weight": []}
+
+    def flush():
+        conn.executemany(
+            "INSERT INTO measurements (id, cow_id, sensor_id, timestamp, value) VALUES (?, ?, ?, ?, ?)",
+            batch["measurements"],
+        )
+        for kind, table in (("milk", "milk"), ("weight", "weights")):
+            conn.executemany(
+                f"INSERT INTO {table} (id, cow_id, timestamp, day, value) VALUES (?, ?, ?, ?, ?)",
+                batch[kind],
+            )
+        for rows_of_kind in batch.values():
+            rows_of_kind.clear()
+
+    for cow, sensor, kind, timestamp, value in synthetic_readings(rows, cows):
+        if cow not in seen_cows:
+            seen_cows.add(cow)
+            conn.execute(
+                "INSERT INTO cows (id, name, birthdate) VALUES (?, ?, '2020-01-01 00:00:00.000000')",
+                (encode(cow), f"cow-{len(seen_cows)}"),
+            )
+        if sensor not in seen_sensors:
+            seen_sensors.add(sensor)
+            conn.execute(
+                "INSERT INTO sensors (id, unit) VALUES (?, ?)",
+                (encode(sensor), "L" if kind == "milk" else "kg"),
+            )
+        ts = timestamp.isoformat(" ", "microseconds")
+        batch["measurements"].append((row_id(), encode(cow), encode(sensor), ts, value))
+        batch[kind].append((row_id(), encode(cow), ts, ts[:10], value))
+        if len(batch["measurements"]) >= CHUNK_SIZE:
+            flush()
+    flush()
+    conn.commit()
+
+
+def object_sizes(conn):
+    try:
+        return dict(conn.execute("SELECT name, sum(pgsize) FROM dbstat GROUP BY name ORDER BY name"))
+    except sqlite3.OperationalError:
+        return {}
+
+
+def build(path, schema, rows, cows, encode, row_id):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    schema(conn)
+    start = time.perf_counter()
+    fill(conn, rows, cows, encode, row_id)
+    elapsed = time.perf_counter() - start
+    sizes = object_sizes(conn)
+    conn.close()
+    return os.path.getsize(path), sizes, elapsed
+
+
+def string_key_schema(conn):
+    for statement in STRING_KEY_SCHEMA:
+        conn.execute(statement)
+
+
+def mib(size):
+    return f"{size / 2**20:10.1f} MiB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--cows", type=int, default=10_000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        string_path = os.path.join(tmp, "string_keys.db")
+        compact_path = os.path.join(tmp, "compact.db")
+
+        def compact_schema(conn):
+            models.Base.metadata.create_all(create_engine(f"sqlite:///{compact_path}"))
+
+        results = {
+            "uuid strings": build(
+                string_path,
+                string_key_schema,
+                args.rows,
+                args.cows,
+                str,
+                lambda: str(uuid.uuid4()),
+            ),
+            "compact": build(
+                compact_path,
+                compact_schema,
+                args.rows,
+                args.cows,
+                lambda value: value.bytes,
+                lambda: None,
+            ),
+        }
+
+    print(f"{args.rows} readings for {args.cows} cows\n")
+    names = sorted(set().union(*(sizes for _, sizes, _ in results.values())))
+    print(f"{'object':40}" + "".join(f"{label:>18}" for label in results))
+    for name in names:
+        print(f"{name:40}" + "".join(f"{mib(sizes.get(name, 0)):>18}" for _, sizes, _ in results.values()))
+    print(f"{'file':40}" + "".join(f"{mib(size):>18}" for size, _, _ in results.values()))
+    print(f"{'load time':40}" + "".join(f"{elapsed:>14.1f} s   " for _, _, elapsed in results.values()))
+    string_size, compact_size = (size for size, _, _ in results.values())
+    print(f"\ncompact layout is {compact_size / string_size:.0%} of the UUID string layout")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Run the benchmark scenarios on a synthetic herd and save the results as JSON.
+
+A herd from ``benchmarks.herd`` is ingested over HTTP into a fresh SQLite
+database served by uvicorn, then the served API and the reporting module
+are measured on the result:
+
+``generate_herd``
+    Time to write the parquet files.
+``ingestion``
+    ``app.ingestion.ingest_data`` throughput and request latency.
+``cow_details``
+    ``GET /cows/{id}`` latency percentiles under concurrent clients.
+``report_api``
+    ``GET /cows/report`` latency, first and repeated JSON requests and
+    streamed NDJSON.
+``generate_report``
+    ``reporting.generate_report`` runtime, in process.
+
+The herd and the client's random choices are seeded, so two runs of the
+same commit measure the same work. ``compare`` lines up the metrics of two
+result files.
+
+Usage::
+
+    python -m benchmarks.suite run --cows 1000 --days 30 --output results.json
+    python -m benchmarks.suite compare before.json after.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timezone
+import aiohttp
+from sqlalchemy.orm import Session
+from app import db_config, migrations, reporting
+from app.ingestion import ingest_data
+from benchmarks.herd import generate_herd
+from benchmarks.load_test import wait_until_up
+from benchmarks.sqlite_profiles import percentile
+
+RESULTS_VERSION = 1
+
+SERVER_APP = "benchmarks.mounted_api:app"
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(url, port):
+    env = dict(os.environ, COWSHED_DATABASE_URL=url)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", SERVER_APP, "--port", str(port), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def ingestion(data_dir, base_url, concurrency, max_concurrency):
+    # The ingester reads cow_data/ relative to the working directory.
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(data_dir))
+    try:
+        run = asyncio.run(ingest_data(base_url, concurrency, max_concurrency))
+    finally:
+        os.chdir(cwd)
+    summary = run.summary()
+    return {
+        "seconds": summary["elapsed_seconds"],
+        "rows_per_second": summary["rows_per_second"],
+        "requests": summary["requests"],
+        "stored": summary["outcomes"].get("measurement", {}).get("stored", 0),
+        "p50_ms": _ms(summary["latency_seconds"]["p50"]),
+        "p95_ms": _ms(summary["latency_seconds"]["p95"]),
+        "p99_ms": _ms(summary["latency_seconds"]["p99"]),
+    }
+
+
+def _ms(seconds):
+    # Histogram bucket bounds; the overflow bucket has no finite bound.
+    if seconds is None or seconds == float("inf"):
+        return None
+    return seconds * 1000
+
+
+async def timed_requests(base_url, paths, concurrency):
+    """Request ``paths`` from ``concurrency`` clients; return latencies and errors."""
+    latencies, errors = [], 0
+    queue = list(reversed(paths))
+
+    async def client(session):
+        nonlocal errors
+        while queue:
+            path = queue.pop()
+            start = time.perf_counter()
+            async with session.get(f"{base_url}{path}") as response:
+                await response.read()
+                if response.status >= 400:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def cow_details(base_url, cow_ids, requests, concurrency, seed):
+    rng = random.Random(seed)
+    paths = [f"/cows/{rng.choice(cow_ids)}" for _ in range(requests)]
+    latencies, errors, elapsed = asyncio.run(timed_requests(base_url, paths, concurrency))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+
+
+def report_api(base_url, report_date, requests):
+    path = f"/cows/report?report_date={report_date}"
+    cold, _, _ = asyncio.run(timed_requests(base_url, [path], 1))
+    warm, errors, _ = asyncio.run(timed_requests(base_url, [path] * requests, 1))
+    ndjson, ndjson_errors, _ = asyncio.run(
+        timed_requests(base_url, [f"{path}&format=ndjson"] * requests, 1)
+    )
+    return {
+        "errors": errors + ndjson_errors,
+        "cold_ms": cold[0] * 1000,
+        "warm_p50_ms": percentile(warm, 0.50),
+        "ndjson_p50_ms": percentile(ndjson, 0.50),
+    }
+
+
+def generate_report_runtime(url, report_date, repeat):
+    engine = db_config.make_engine(url)
+    runs = []
+    with Session(engine) as db:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            report = reporting.generate_report(db, report_date)
+            runs.append(time.perf_counter() - start)
+    engine.dispose()
+    runs.sort()
+    return {
+        "best_seconds": runs[0],
+        "median_seconds": runs[len(runs) // 2],
+        "characters": len(report),
+    }
+
+
+def run(args):
+    results = {
+        "version": RESULTS_VERSION,
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "cows": args.cows,
+            "days": args.days,
+            "readings_per_day": args.readings_per_day,
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "max_concurrency": args.max_concurrency,
+            "requests": args.requests,
+            "report_requests": args.report_requests,
+            "sqlite_profile": os.environ.get("COWSHED_SQLITE_PROFILE", "wal"),
+        },
+        "scenarios": {},
+    }
+    scenarios = results["scenarios"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, "cow_data")
+        start = time.perf_counter()
+        herd = generate_herd(data_dir, args.cows, args.days, args.readings_per_day, seed=args.seed)
+        scenarios["generate_herd"] = {
+            "seconds": time.perf_counter() - start,
+            "measurements": herd["measurements"],
+        }
+        print(f"{herd['measurements']} measurements for {args.cows} cows over {args.days} days")
+
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = db_config.make_engine(url)
+        migrations.upgrade(engine)
+        engine.dispose()
+        server = start_server(url, args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            asyncio.run(wait_until_up(f"{base_url}/api"))
+            scenarios["ingestion"] = ingestion(
+                data_dir, base_url, args.concurrency, args.max_concurrency
+            )
+            print(f"ingestion: {scenarios['ingestion']}")
+            scenarios["cow_details"] = cow_details(
+                f"{base_url}/api", herd["cow_ids"], args.requests, args.concurrency, args.seed
+            )
+            print(f"cow_details: {scenarios['cow_details']}")
+            scenarios["report_api"] = report_api(
+                f"{base_url}/api", herd["last_day"], args.report_requests
+            )
+            print(f"report_api: {scenarios['report_api']}")
+        finally:
+            server.terminate()
+            server.wait()
+
+        scenarios["generate_report"] = generate_report_runtime(
+            url, date.fromisoformat(herd["last_day"]), args.report_requests
+        )
+        print(f"generate_report: {scenarios['generate_report']}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+
+def metrics(results):
+    """Flatten the numeric results into ``scenario.metric`` names."""
+    return {
+        f"{scenario}.{name}": value
+        for scenario, values in results["scenarios"].items()
+        for name, value in values.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before["params"] != after["params"]:
+        print("warning: the runs used different parameters")
+    old, new = metrics(before), metrics(after)
+    print(f"{'metric':36}{'before':>14}{'after':>14}{'change':>10}")
+    for name in sorted(old.keys() | new.keys()):
+        a, b = old.get(name), new.get(name)
+        change = f"{(b - a) / a:+.1%}" if a and b is not None else ""
+        print(f"{name:36}{_fmt(a):>14}{_fmt(b):>14}{change:>10}")
+
+
+def _fmt(value):
+    return "" if value is None else f"{value:.4g}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run every scenario")
+    run_parser.add_argument("--cows", type=int, default=1000)
+    run_parser.add_argument("--days", type=int, default=30)
+    run_parser.add_argument("--readings-per-day", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--max-concurrency", type=int, default=64)
+    run_parser.add_argument("--requests", type=int, default=2000, help="GET /cows/{id} requests")
+    run_parser.add_argument("--report-requests", type=int, default=5)
+    run_parser.add_argument("--port", type=int, default=8766)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""The original blocking handlers, kept as the baseline for benchmarks.load_test."""
+
+from fastapi import Depends, FastAPI, HTTPException
+from sqlalchemy.orm import Session
+from uuid import UUID
+from app import database, models, readings
+from app.api import CowDetails, SensorData, logger
+
+app = FastAPI()
+
+
+@app.post("/cows/{id}/milk", status_code=201)
+def add_milk_production(
+    id: UUID, data: SensorData, db: Session = Depends(database.get_db)
+):
+    logger.info(
+        f"Adding milk production for cow ID: {id}, Date: {data.date}, Amount: {data.value}"
+    )
+    db_cow = db.query(models.Cow).filter(models.Cow.id == str(id)).first()
+    if not db_cow:
+        raise HTTPException(status_code=404, detail="Cow not found")
+    readings.insert_readings(
+        db, "milk", [{"cow_id": str(id), "timestamp": data.date, "value": data.value}]
+    )
+    db.commit()
+    return {"message": "Milk production data added successfully"}
+
+
+@app.get("/cows/{id}", response_model=CowDetails)
+def get_cow_details(id: UUID, db: Session = Depends(database.get_db)):
+    logger.info(f"Fetching details for cow ID: {id}")
+    db_cow = db.query(models.Cow).filter(models.Cow.id == str(id)).first()
+    if not db_cow:
+        raise HTTPException(status_code=404, detail="Cow not found")
+    latest_milk = (
+        db.query(models.MilkProduction)
+        .filter(models.MilkProduction.cow_id == str(id))
+        .order_by(models.MilkProduction.timestamp.desc())
+        .first()
+    )
+    latest_weight = (
+        db.query(models.Weight)
+        .filter(models.Weight.cow_id == str(id))
+        .order_by(models.Weight.timestamp.desc())
+        .first()
+    )
+    return CowDetails(
+        id=id,
+        latest_milk_production=latest_milk.value if latest_milk else None,
+        latest_weight=latest_weight.value if latest_weight else None,
+    )
@@ -1,9 +1,19 @@
+import asyncio
+import csv
+import httpx
+import io
+import json
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from uuid import uuid4
-from . import models, database, api
+from datetime import date, datetime
+from app import cache, illness, models, database, api, reporting
+from app.instrumentation import instrument_engine
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
@@ -11,10 +21,31 @@ engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 models.Base.metadata.create_all(bind=engine)
 
+# TestClient may run each request on a fresh event loop, so async
+# connections are not pooled across requests.
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 @pytest.fixture(scope="module")
 def test_client():
+    api.app.dependency_overrides[database.get_db] = override_get_db
+    api.app.dependency_overrides[database.get_async_db] = override_get_async_db
     client = TestClient(api.app)
     yield client
+    api.app.dependency_overrides.clear()
 
 @pytest.fixture(scope="module")
 def db_session():
@@ -27,6 +58,28 @@ def clean_database(db_session):
     models.Base.metadata.drop_all(bind=engine)
     models.Base.metadata.create_all(bind=engine)
 
+@pytest.fixture(scope="function", autouse=True)
+def cow_cache():
+    # A fresh local cache per test, so entries never outlive the database.
+    local_cache = cache.LRUCache(max_size=100, ttl=60)
+    api.app.dependency_overrides[cache.get_cow_cache] = lambda: local_cache
+    yield local_cache
+    api.app.dependency_overrides.pop(cache.get_cow_cache, None)
+
+@pytest.fixture(scope="function", autouse=True)
+def report_cache():
+    local_cache = cache.VersionedCache(cache.LRUCache(max_size=100, ttl=60))
+    api.app.dependency_overrides[cache.get_report_cache] = lambda: local_cache
+    yield local_cache
+    api.app.dependency_overrides.pop(cache.get_report_cache, None)
+
+@pytest.fixture(scope="function", autouse=True)
+def illness_detector(clean_database, db_session, monkeypatch):
+    detector = illness.IllnessDetector()
+    monkeypatch.setattr(illness, "detector", detector)
+    detector.rebuild(db_session)
+    return detector
+
 # Test Cases
 
 def test_create_cow(test_client, db_session):
@@ -80,6 +133,43 @@ def test_generate_report(test_client, db_session):
     assert report[0]["total_milk"] == 25.5
     assert report[0]["latest_weight"] == 450.0
 
+def test_register_cows_in_bulk(test_client, db_session):
+    existing, new = str(uuid4()), str(uuid4())
+    test_client.post(f"/cows/{existing}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    cows = [
+        {"id": cow_id, "name": "Molly", "birthdate": "2021-01-01T00:00:00"}
+        for cow_id in (existing, new, new)
+    ]
+
+    response = test_client.post("/cows", json={"cows": cows})
+
+    assert response.status_code == 200
+    assert response.json() == {"created": 1, "existing": 2}
+    assert db_session.get(models.Cow, existing).name == "Bessie"
+    assert db_session.get(models.Cow, new).name == "Molly"
+
+def test_register_sensors_in_bulk_and_look_them_up(test_client, db_session):
+    sensors = [{"id": str(uuid4()), "unit": unit} for unit in ("L", "kg")]
+    unknown = str(uuid4())
+
+    response = test_client.post("/sensors", json={"sensors": sensors})
+    assert response.json() == {"created": 2, "existing": 0}
+    response = test_client.post("/sensors", json={"sensors": sensors})
+    assert response.json() == {"created": 0, "existing": 2}
+
+    response = test_client.post("/sensors/lookup", json={"ids": [sensors[0]["id"], unknown]})
+    assert response.status_code == 200
+    assert response.json() == {"known": [sensors[0]["id"]]}
+
+def test_lookup_cows(test_client, db_session):
+    cow_id = str(uuid4())
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+
+    response = test_client.post("/cows/lookup", json={"ids": [str(uuid4()), cow_id]})
+
+    assert response.status_code == 200
+    assert response.json() == {"known": [cow_id]}
+
 def test_create_sensor(test_client, db_session):
     sensor_id = str(uuid4())
     response = test_client.post(f"/sensors/{sensor_id}", json={"unit": "liters"})
@@ -87,8 +177,305 @@ def test_create_sensor(test_client, db_session):
     assert response.json() == {"message": "Sensor created successfully"}
 
 def test_add_sensor_measurement(test_client, db_session):
-    sensor_id = str(uuid4())
+    sensor_id, cow_id = str(uuid4()), str(uuid4())
     test_client.post(f"/sensors/{sensor_id}", json={"unit": "liters"})
-    response = test_client.post(f"/sensors/{sensor_id}/measurements", json={"date": "2024-10-14", "value": 100.0})
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    response = test_client.post(f"/sensors/{sensor_id}/measurements", json={"cow_id": cow_id, "date": "2024-10-14", "value": 100.0})
     assert response.status_code == 201
     assert response.json() == {"message": "Measurement data added successfully"}
+    measurement = db_session.query(models.Measurement).filter_by(sensor_id=sensor_id).one()
+    assert (measurement.cow_id, measurement.value) == (cow_id, 100.0)
+
+def test_add_readings_bulk(test_client, db_session):
+    cow_ids = [str(uuid4()), str(uuid4())]
+    for cow_id in cow_ids:
+        test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    readings = [
+        {"cow_id": cow_ids[0], "type": "milk", "date": "2024-10-14", "value": 25.5},
+        {"cow_id": cow_ids[0], "type": "weight", "date": "2024-10-14", "value": 450.0},
+        {"cow_id": cow_ids[1], "type": "milk", "date": "2024-10-14", "value": 12.0},
+        {"cow_id": cow_ids[1], "type": "weight", "date": "2024-10-14", "value": 380.0},
+    ]
+    response = test_client.post("/measurements/bulk", json={"readings": readings})
+    assert response.status_code == 200
+    assert response.json() == {"accepted": 4, "duplicates": 0, "rejected": 0, "rejections": []}
+
+    cow_details = test_client.get(f"/cows/{cow_ids[1]}").json()
+    assert cow_details["latest_milk_production"] == 12.0
+    assert cow_details["latest_weight"] == 380.0
+
+def test_add_readings_bulk_keeps_timestamps_without_sensor(test_client, db_session):
+    cow_id = str(uuid4())
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    readings = [
+        {"cow_id": cow_id, "type": "weight", "date": "2024-10-14", "timestamp": "2024-10-14T18:00:00", "value": 400.0},
+        {"cow_id": cow_id, "type": "weight", "date": "2024-10-14", "timestamp": "2024-10-14T06:30:00", "value": 450.0},
+    ]
+    assert test_client.post("/measurements/bulk", json={"readings": readings}).json()["accepted"] == 2
+
+    stored = db_session.query(models.Weight.timestamp).order_by(models.Weight.timestamp).all()
+    assert [timestamp for timestamp, in stored] == [datetime(2024, 10, 14, 6, 30), datetime(2024, 10, 14, 18, 0)]
+    assert test_client.get(f"/cows/{cow_id}").json()["latest_weight"] == 400.0
+
+def test_add_readings_bulk_rejects_rows(test_client, db_session):
+    cow_id = str(uuid4())
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    readings = [
+        {"cow_id": cow_id, "type": "milk", "date": "2024-10-14", "value": 25.5},
+        {"cow_id": str(uuid4()), "type": "milk", "date": "2024-10-14", "value": 25.5},
+        {"cow_id": cow_id, "type": "milk", "date": "2024-10-14", "value": -1.0},
+        {"cow_id": cow_id, "type": "temperature", "date": "2024-10-14", "value": 38.5},
+    ]
+    response = test_client.post("/measurements/bulk", json={"readings": readings})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["accepted"] == 1
+    assert result["rejected"] == 3
+    assert [r["index"] for r in result["rejections"]] == [1, 2, 3]
+    assert result["rejections"][0]["detail"] == "Cow not found"
+
+def test_add_readings_bulk_replay_is_idempotent(test_client, db_session):
+    cow_id, sensor_id = str(uuid4()), str(uuid4())
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    test_client.post(f"/sensors/{sensor_id}", json={"unit": "L"})
+    readings = [
+        {"cow_id": cow_id, "sensor_id": sensor_id, "type": "milk", "date": "2024-10-14", "timestamp": "2024-10-14T06:00:00", "value": 12.0},
+        {"cow_id": cow_id, "sensor_id": sensor_id, "type": "milk", "date": "2024-10-14", "timestamp": "2024-10-14T18:00:00", "value": 13.0},
+        {"cow_id": cow_id, "sensor_id": str(uuid4()), "type": "milk", "date": "2024-10-14", "value": 1.0},
+    ]
+
+    first = test_client.post("/measurements/bulk", json={"readings": readings}).json()
+    replay = test_client.post("/measurements/bulk", json={"readings": readings}).json()
+
+    assert (first["accepted"], first["duplicates"], first["rejected"]) == (2, 0, 1)
+    assert first["rejections"][0]["detail"] == "Sensor not found"
+    assert (replay["accepted"], replay["duplicates"]) == (0, 2)
+    assert db_session.query(models.Measurement).count() == 2
+    assert db_session.query(models.DailyCowStats).one().milk_total == 25.0
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_do_not_fail(test_client, db_session):
+    cow_ids = [str(uuid4()) for _ in range(10)]
+    for cow_id in cow_ids:
+        test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+
+    async with httpx.AsyncClient(app=api.app, base_url="http://test") as client:
+        responses = await asyncio.gather(*(
+            client.post(f"/cows/{cow_ids[i % 10]}/milk", json={"date": "2024-10-14", "value": 1.0})
+            for i in range(200)
+        ))
+
+    assert [r.status_code for r in responses] == [201] * 200
+    assert db_session.query(models.MilkProduction).count() == 200
+
+def test_locked_database_answers_503(test_client, monkeypatch):
+    cow_id = str(uuid4())
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+
+    def locked(*args, **kwargs):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(api.readings, "insert_readings", locked)
+    response = test_client.post(f"/cows/{cow_id}/milk", json={"date": "2024-10-14", "value": 1.0})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+def test_cow_details_are_cached_until_a_write(test_client, db_session, cow_cache):
+    cow_id = str(uuid4())
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    test_client.post(f"/cows/{cow_id}/milk", json={"date": "2024-10-14", "value": 25.5})
+
+    assert test_client.get(f"/cows/{cow_id}").json()["latest_milk_production"] == 25.5
+    assert test_client.get(f"/cows/{cow_id}").json()["latest_milk_production"] == 25.5
+    test_client.post(f"/cows/{cow_id}/milk", json={"date": "2024-10-15", "value": 30.0})
+    assert test_client.get(f"/cows/{cow_id}").json()["latest_milk_production"] == 30.0
+
+    stats = test_client.get("/cache/stats").json()["cow_details"]
+    assert (stats["hits"], stats["misses"], stats["invalidations"]) == (1, 2, 1)
+
+def test_cow_details_read_before_a_write_are_not_cached(test_client, db_session, cow_cache, monkeypatch):
+    cow_id = str(uuid4())
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    fill = cow_cache.set
+
+    async def write_before_fill(key, value, generation=None):
+        # A write invalidating the cow after it was read, before the fill.
+        await cow_cache.delete_many([key])
+        await fill(key, value, generation)
+
+    monkeypatch.setattr(cow_cache, "set", write_before_fill)
+    test_client.get(f"/cows/{cow_id}")
+
+    assert cow_cache.stats()["size"] == 0
+    assert cow_cache.stats()["stale_fills"] == 1
+
+def test_generate_report_is_cached_until_its_window_changes(test_client, db_session, report_cache):
+    cow_id = str(uuid4())
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    test_client.post(f"/cows/{cow_id}/milk", json={"date": "2024-10-14", "value": 20.0})
+    params = {"report_date": "2024-10-14"}
+
+    first = test_client.get("/cows/report", params=params).json()
+    assert test_client.get("/cows/report", params=params).json() == first
+    # readings outside the window of the report leave the entry current
+    test_client.post(f"/cows/{cow_id}/milk", json={"date": "2024-10-15", "value": 1.0})
+    test_client.post(f"/cows/{cow_id}/weight", json={"date": "2024-09-13", "value": 500.0})
+    assert test_client.get("/cows/report", params=params).json() == first
+
+    test_client.post(f"/cows/{cow_id}/weight", json={"date": "2024-09-14", "value": 450.0})
+    assert test_client.get("/cows/report", params=params).json()[0]["latest_weight"] == 450.0
+    test_client.post(f"/cows/{uuid4()}", json={"name": "Molly", "birthdate": "2020-01-01T00:00:00"})
+    assert len(test_client.get("/cows/report", params=params).json()) == 2
+
+    stats = test_client.get("/cache/stats").json()["report"]
+    assert (stats["hits"], stats["misses"], stats["stale"]) == (2, 1, 2)
+
+def test_generate_report_pages_by_cow_id(test_client, db_session):
+    cow_ids = sorted(str(uuid4()) for _ in range(5))
+    for cow_id in cow_ids:
+        test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+        test_client.post(f"/cows/{cow_id}/milk", json={"date": "2024-10-14", "value": 20.0})
+
+    pages, after = [], None
+    while True:
+        params = {"report_date": "2024-10-14", "limit": 2}
+        if after:
+            params["after"] = after
+        response = test_client.get("/cows/report", params=params)
+        pages.append([row["cow_id"] for row in response.json()])
+        after = response.headers.get("X-Next-After")
+        if not after:
+            break
+
+    assert pages == [cow_ids[0:2], cow_ids[2:4], cow_ids[4:]]
+    assert 'rel="next"' not in response.headers.get("Link", "")
+
+def test_generate_report_streams_ndjson(test_client, db_session):
+    cow_ids = sorted(str(uuid4()) for _ in range(3))
+    for cow_id in cow_ids:
+        test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    test_client.post(f"/cows/{cow_ids[1]}/milk", json={"date": "2024-10-14", "value": 3.0})
+
+    response = test_client.get("/cows/report", params={"report_date": "2024-10-14", "format": "ndjson"})
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == test_client.get("/cows/report", params={"report_date": "2024-10-14"}).json()
+    assert [row["cow_id"] for row in rows] == cow_ids
+    assert rows[1]["potentially_ill"] is True
+
+def test_generate_report_streams_text_and_csv(test_client, db_session):
+    cow_ids = sorted(str(uuid4()) for _ in range(3))
+    for cow_id in cow_ids:
+        test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    test_client.post(f"/cows/{cow_ids[1]}/milk", json={"date": "2024-10-14", "value": 3.0})
+
+    text = test_client.get("/cows/report", params={"report_date": "2024-10-14", "format": "text"})
+    assert text.headers["content-type"].startswith("text/plain")
+    assert text.text == reporting.generate_report(db_session, date(2024, 10, 14))
+
+    response = test_client.get("/cows/report", params={"report_date": "2024-10-14", "format": "csv"})
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["cow_id"] for row in rows] == cow_ids
+    assert rows[1]["total_milk"] == "3.0"
+    assert rows[1]["potentially_ill"] == "True"
+
+def test_generate_report_for_a_range(test_client, db_session):
+    cow_ids = sorted(str(uuid4()) for _ in range(2))
+    for cow_id in cow_ids:
+        test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    test_client.post(f"/cows/{cow_ids[0]}/milk", json={"date": "2024-10-14", "value": 3.0})
+    test_client.post(f"/cows/{cow_ids[1]}/weight", json={"date": "2024-10-13", "value": 450.0})
+
+    response = test_client.get("/cows/report", params={"from": "2024-10-13", "to": "2024-10-14"})
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["day"] == ["2024-10-13", "2024-10-13", "2024-10-14", "2024-10-14"]
+    assert report["cow_id"] == cow_ids * 2
+    assert report["total_milk"] == [None, None, 3.0, None]
+    assert report["latest_weight"] == [None, 450.0, None, 450.0]
+    assert report["potentially_ill"] == [False, False, True, False]
+    single = test_client.get("/cows/report", params={"report_date": "2024-10-14"}).json()
+    assert [row["latest_weight"] for row in single] == report["latest_weight"][2:]
+
+    response = test_client.get("/cows/report", params={"from": "2024-10-13", "to": "2024-10-14", "format": "csv"})
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(row["day"], row["cow_id"]) for row in rows] == [(day, cow_id) for day in report["day"][::2] for cow_id in cow_ids]
+    text = test_client.get("/cows/report", params={"from": "2024-10-13", "to": "2024-10-14", "format": "text"})
+    assert text.headers["content-type"].startswith("text/plain")
+    assert text.text.count("Report for ") == 2
+
+def test_generate_report_rejects_a_bad_range(test_client):
+    assert test_client.get("/cows/report", params={"from": "2024-10-13"}).status_code == 422
+    assert test_client.get("/cows/report", params={"from": "2024-10-14", "to": "2024-10-13"}).status_code == 422
+    assert test_client.get("/cows/report", params={"from": "2023-01-01", "to": "2024-10-13"}).status_code == 422
+    assert test_client.get("/cows/report", params={"from": "2024-10-13", "to": "2024-10-14", "format": "ndjson"}).status_code == 422
+
+def test_generate_report_matches_reporting_module(test_client, db_session):
+    cow_ids = [str(uuid4()) for _ in range(3)]
+    for cow_id in cow_ids:
+        test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+    readings = [
+        {"cow_id": cow_ids[0], "type": "milk", "date": "2024-10-14", "value": 25.5},
+        {"cow_id": cow_ids[0], "type": "weight", "date": "2024-10-01", "value": 450.0},
+        {"cow_id": cow_ids[0], "type": "weight", "date": "2024-10-14", "value": 360.0},
+        {"cow_id": cow_ids[1], "type": "milk", "date": "2024-10-14", "value": 4.0},
+        {"cow_id": cow_ids[1], "type": "weight", "date": "2024-10-13", "value": 500.0},
+    ]
+    test_client.post("/measurements/bulk", json={"readings": readings})
+
+    response = test_client.get("/cows/report?report_date=2024-10-14")
+    assert response.status_code == 200
+    report = response.json()
+
+    rows = reporting.farm_report(db_session, date(2024, 10, 14))
+    assert report == [api.CowReport(**row).model_dump(mode="json") for row in rows]
+    assert [r["cow_id"] for r in report] == sorted(cow_ids)
+
+    text_report = reporting.generate_report(db_session, date(2024, 10, 14))
+    ill = sorted(cow_ids[:2])
+    assert text_report.split("Potentially Ill Cows:\n")[1] == "\n".join(ill)
+    assert [r["cow_id"] for r in report if r["potentially_ill"]] == ill
+
+def test_requests_report_server_timing_and_metrics(test_client, db_session):
+    cow_id = str(uuid4())
+    test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+
+    response = test_client.get(f"/cows/{cow_id}")
+    assert response.status_code == 200
+    timing = response.headers["server-timing"]
+    assert timing.startswith("db;dur=")
+    queries = int(timing.split('desc="')[1].split(" ")[0])
+    assert queries > 0
+    assert "handler;dur=" in timing
+
+    metrics = test_client.get("/metrics").text
+    assert 'cowshed_http_requests_total{method="GET",route="/cows/{id}",status="200"}' in metrics
+    assert 'cowshed_http_db_queries_total{route="/cows/{id}"}' in metrics
+    assert 'cowshed_http_request_seconds_count{route="/cows/{id}"}' in metrics
+
+def test_alerts_follow_incoming_readings(test_client, db_session):
+    healthy, ill = str(uuid4()), str(uuid4())
+    for cow_id in (healthy, ill):
+        test_client.post(f"/cows/{cow_id}", json={"name": "Bessie", "birthdate": "2020-01-01T00:00:00"})
+        test_client.post(f"/cows/{cow_id}/weight", json={"date": "2024-10-13", "value": 500.0})
+    test_client.post(f"/cows/{healthy}/milk", json={"date": "2024-10-14", "value": 20.0})
+    test_client.post("/measurements/bulk", json={"readings": [
+        {"cow_id": ill, "type": "milk", "date": "2024-10-14", "value": 3.0},
+    ]})
+
+    response = test_client.get("/cows/alerts")
+
+    assert response.status_code == 200
+    assert response.json() == [{
+        "cow_id": ill,
+        "day": "2024-10-14",
+        "total_milk": 3.0,
+        "latest_weight": 500.0,
+        "avg_weight_last_30_days": 500.0,
+    }]
+
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import pytest
+from app.cache import CacheBackend, DiskCache, LRUCache, VersionedCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_cache_backend_requires_the_whole_interface():
+    class GetOnly(CacheBackend):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+@pytest.mark.asyncio
+async def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2, ttl=60)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    assert await cache.get("a") == 1
+    await cache.set("c", 3)
+
+    assert await cache.get("b") is None
+    assert await cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+@pytest.mark.asyncio
+async def test_lru_cache_expires_entries():
+    clock = FakeClock()
+    cache = LRUCache(max_size=10, ttl=5, clock=clock)
+    await cache.set("a", 1)
+
+    clock.now = 4.9
+    assert await cache.get("a") == 1
+    clock.now = 5.0
+    assert await cache.get("a") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"], stats["size"]) == (1, 1, 1, 0)
+
+@pytest.mark.asyncio
+async def test_lru_cache_with_zero_size_stores_nothing():
+    cache = LRUCache(max_size=0)
+    await cache.set("a", 1)
+    await cache.delete_many(["a", "b"])
+
+    assert await cache.get("a") is None
+    assert cache.stats()["invalidations"] == 0
+
+@pytest.mark.asyncio
+async def test_lru_cache_skips_fills_older_than_an_invalidation():
+    cache = LRUCache(max_size=1, ttl=60)
+    a, b = cache.generation("a"), cache.generation("b")
+    await cache.delete_many(["a"])
+    await cache.set("a", "stale", a)
+    assert await cache.get("a") is None
+
+    # "a" is forgotten once "b" is invalidated, and stays newer than before.
+    await cache.delete_many(["b"])
+    await cache.set("b", "stale", b)
+    await cache.set("a", "stale", a)
+    await cache.set("a", "fresh", cache.generation("a"))
+    assert await cache.get("a") == "fresh"
+    assert cache.stats()["stale_fills"] == 3
+
+@pytest.mark.asyncio
+async def test_lru_cache_bounds_total_bytes():
+    cache = LRUCache(max_size=10, ttl=60, max_bytes=10)
+    await cache.set("a", (1, (b"1234", None)))
+    await cache.set("b", (1, (b"5678", None)))
+    await cache.set("c", (1, (b"90", None)))
+    await cache.set("too large", (1, (b"x" * 11, None)))
+    assert cache.stats()["bytes"] == 10
+
+    await cache.set("d", (1, (b"ab", None)))
+    assert await cache.get("a") is None
+    assert await cache.get("too large") is None
+    assert (await cache.get("d"))[1][0] == b"ab"
+    stats = cache.stats()
+    assert (stats["size"], stats["bytes"], stats["evictions"]) == (3, 8, 1)
+
+@pytest.mark.asyncio
+async def test_disk_cache_survives_restarts_and_evicts_oldest(tmp_path):
+    cache = DiskCache(str(tmp_path), max_size=2)
+    await cache.set(("report", 1), [{"cow_id": "a"}])
+    await cache.set(("report", 2), [{"cow_id": "b"}])
+    os.utime(cache._path(("report", 1)), (1, 1))
+    await cache.set(("report", 3), [{"cow_id": "c"}])
+
+    reopened = DiskCache(str(tmp_path), max_size=2)
+    assert await reopened.get(("report", 1)) is None
+    assert await reopened.get(("report", 2)) == [{"cow_id": "b"}]
+    assert cache.stats()["evictions"] == 1
+    assert reopened.stats()["size"] == 2
+
+@pytest.mark.asyncio
+async def test_versioned_cache_serves_only_the_stored_version():
+    cache = VersionedCache(LRUCache(max_size=10, ttl=60))
+    assert await cache.get("a", 1) is None
+    await cache.set("a", 1, "report")
+
+    assert await cache.get("a", 1) == "report"
+    assert await cache.get("a", 2) is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stale"]) == (1, 1, 1)
+
+@pytest.mark.asyncio
+async def test_disk_cache_concurrent_writes_of_one_key(tmp_path):
+    cache = DiskCache(str(tmp_path), max_size=2)
+    await asyncio.gather(*(cache.set("report", [i] * 1000) for i in range(20)))
+
+    value = await cache.get("report")
+    assert value in [[i] * 1000 for i in range(20)]
+    assert os.listdir(tmp_path) == [os.path.basename(cache._path("report"))]
+
+@pytest.mark.asyncio
+async def test_disk_cache_entry_removed_while_read_is_a_miss(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path))
+    await cache.set("report", "body")
+
+    def utime(path):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "utime", utime)
+    assert await cache.get("report") is None
+    assert cache.stats()["misses"] == 1
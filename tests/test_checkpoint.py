@@ -0,0 +1,25 @@
+import json
+from app.checkpoint import Checkpoint, CheckpointTracker, load_checkpoint, save_checkpoint
+
+def test_load_checkpoint_resumes_same_file_only(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    save_checkpoint(path, Checkpoint(file="measurements.parquet", row_group=2, row_offset=500))
+
+    assert load_checkpoint(path, "measurements.parquet") == Checkpoint("measurements.parquet", 2, 500)
+    assert load_checkpoint(path, "other.parquet") == Checkpoint("other.parquet")
+    assert load_checkpoint(str(tmp_path / "missing.json"), "measurements.parquet") == Checkpoint("measurements.parquet")
+
+def test_tracker_only_advances_past_contiguous_batches(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    tracker = CheckpointTracker(str(path), Checkpoint(file="measurements.parquet"))
+    batches = [((0, 4), "a"), ((1, 0), "b"), ((1, 4), "c")]
+    sequences = [sequence for sequence, _ in tracker.track(batches)]
+
+    tracker.done(sequences[1])
+    assert not path.exists()
+
+    tracker.done(sequences[0])
+    assert json.loads(path.read_text())["row_group"] == 1
+
+    tracker.done(sequences[2])
+    assert json.loads(path.read_text()) == {"file": "measurements.parquet", "row_group": 1, "row_offset": 4}
@@ -0,0 +1,17 @@
+import pytest
+from sqlalchemy import create_mock_engine
+from sqlalchemy.orm import Session
+from app import models, rollup
+from app.database import async_database_url
+
+def test_async_database_url_uses_the_backends_asyncio_driver():
+    assert async_database_url("sqlite:///./cowshed35.db") == "sqlite+aiosqlite:///./cowshed35.db"
+    assert async_database_url("postgresql://cows:secret@db/cowshed") == "postgresql+asyncpg://cows:secret@db/cowshed"
+    with pytest.raises(ValueError):
+        async_database_url("mysql://cows@db/cowshed")
+
+def test_dialect_insert_rejects_dialects_without_on_conflict():
+    engine = create_mock_engine("mysql://", lambda *args, **kwargs: None)
+
+    with pytest.raises(ValueError):
+        rollup.dialect_insert(Session(bind=engine), models.DailyCowStats)
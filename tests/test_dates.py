@@ -0,0 +1,15 @@
+from datetime import date, datetime
+from app.dates import as_date, as_datetime
+
+def test_as_date_takes_dates_datetimes_and_sqlite_strings():
+    day = date(2024, 10, 14)
+    assert as_date(day) == day
+    assert as_date(datetime(2024, 10, 14, 6, 30)) == day
+    assert as_date("2024-10-14") == day
+    assert as_date("2024-10-14 06:30:00.000000") == day
+
+def test_as_datetime_puts_bare_dates_at_midnight():
+    at = datetime(2024, 10, 14, 6, 30)
+    assert as_datetime(at) == at
+    assert as_datetime(date(2024, 10, 14)) == datetime(2024, 10, 14)
+    assert as_datetime("2024-10-14 06:30:00.000000") == at
@@ -0,0 +1,24 @@
+import filecmp
+from app import models
+from app.loader import load_data
+from benchmarks.herd import generate_herd
+
+def test_generate_herd_is_deterministic(tmp_path):
+    first = generate_herd(str(tmp_path / "a"), cows=20, days=2, seed=7)
+    second = generate_herd(str(tmp_path / "b"), cows=20, days=2, seed=7)
+
+    assert first == second
+    for name in ("sensors.parquet", "cows.parquet", "measurements.parquet"):
+        assert filecmp.cmp(tmp_path / "a" / name, tmp_path / "b" / name, shallow=False)
+    assert generate_herd(str(tmp_path / "c"), cows=20, days=2, seed=8)["cow_ids"] != first["cow_ids"]
+
+def test_generated_herd_loads(db_session, tmp_path):
+    herd = generate_herd(str(tmp_path), cows=10, days=3, readings_per_day=4, invalid_fraction=0.1)
+
+    counts = load_data(db_session, str(tmp_path))
+
+    assert herd["measurements"] == 120
+    assert counts["loaded"] + counts["rejected"] == 120
+    assert counts["rejected"] > 0
+    assert db_session.query(models.Weight).count() + db_session.query(models.MilkProduction).count() == counts["loaded"]
+    assert db_session.query(models.Weight).count() <= 30
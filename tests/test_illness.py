@@ -0,0 +1,107 @@
+import random
+import pytest
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+from app import illness, models, readings, reporting
+from app.illness import IllnessDetector
+
+@pytest.fixture
+def detector(db_session, monkeypatch):
+    detector = IllnessDetector()
+    monkeypatch.setattr(illness, "detector", detector)
+    detector.rebuild(db_session)
+    return detector
+
+def add_cows(db_session, count):
+    cow_ids = [str(uuid4()) for _ in range(count)]
+    for cow_id in cow_ids:
+        db_session.add(models.Cow(id=cow_id, name="Bessie", birthdate=datetime(2020, 1, 1)))
+    db_session.commit()
+    return cow_ids
+
+def flagged_by_report(db_session, detector):
+    flagged = set()
+    for cow_id, window in detector.windows.items():
+        day = date.fromordinal(window.day)
+        for row in reporting.farm_report(db_session, day):
+            if row["cow_id"] == cow_id and row["potentially_ill"]:
+                flagged.add(cow_id)
+    return flagged
+
+def test_detector_agrees_with_the_farm_report(db_session, detector):
+    rng = random.Random(7)
+    cow_ids = add_cows(db_session, 12)
+    start = datetime(2024, 9, 1, 6)
+    for cow_index, cow_id in enumerate(cow_ids):
+        # Cows stop at different days, some after a gap longer than the window.
+        days = list(range(0, 20)) + list(range(20 + 10 * (cow_index % 6), 45 + 5 * (cow_index % 6)))
+        rows = {"milk": [], "weight": []}
+        for day in days:
+            at = start + timedelta(days=day, hours=rng.randrange(12))
+            rows["milk"].append({"cow_id": cow_id, "timestamp": at, "value": rng.choice([3.0] + [12.0, 20.0] * 3)})
+            rows["weight"].append({"cow_id": cow_id, "timestamp": at, "value": rng.choice([380.0] + [500.0, 520.0] * 3)})
+        for kind in rows:
+            rng.shuffle(rows[kind])
+            for i in range(0, len(rows[kind]), 7):
+                readings.insert_readings(db_session, kind, rows[kind][i : i + 7])
+                db_session.commit()
+
+    flagged = set(detector.flagged)
+    assert 0 < len(flagged) < len(cow_ids)
+    assert flagged == flagged_by_report(db_session, detector)
+
+    rebuilt = IllnessDetector()
+    rebuilt.rebuild(db_session)
+    assert rebuilt.alerts() == pytest.approx(detector.alerts())
+
+def test_latest_weight_drop_raises_and_clears_an_alert(db_session, detector):
+    [cow_id] = add_cows(db_session, 1)
+    readings.insert_readings(db_session, "weight", [
+        {"cow_id": cow_id, "timestamp": datetime(2024, 10, day, 6), "value": 500.0}
+        for day in range(1, 11)
+    ])
+    readings.insert_readings(db_session, "weight", [
+        {"cow_id": cow_id, "timestamp": datetime(2024, 10, 11, 6), "value": 400.0},
+    ])
+    db_session.commit()
+
+    assert detector.alerts() == [{
+        "cow_id": cow_id,
+        "day": date(2024, 10, 11),
+        "total_milk": None,
+        "latest_weight": 400.0,
+        "avg_weight_last_30_days": pytest.approx(490.909, abs=1e-3),
+    }]
+
+    # A later weighing on the same day replaces the low one.
+    readings.insert_readings(db_session, "weight", [
+        {"cow_id": cow_id, "timestamp": datetime(2024, 10, 11, 18), "value": 495.0},
+    ])
+    db_session.commit()
+    assert detector.alerts() == []
+
+def test_rolled_back_readings_are_not_applied(db_session, detector):
+    [cow_id] = add_cows(db_session, 1)
+    readings.insert_readings(db_session, "milk", [
+        {"cow_id": cow_id, "timestamp": date(2024, 10, 14), "value": 2.0},
+    ])
+    db_session.rollback()
+    assert detector.windows == {}
+
+    readings.insert_readings(db_session, "milk", [
+        {"cow_id": cow_id, "timestamp": date(2024, 10, 14), "value": 2.0},
+    ])
+    db_session.commit()
+    assert [alert["cow_id"] for alert in detector.alerts()] == [cow_id]
+
+def test_unloaded_detector_keeps_no_state(db_session, monkeypatch):
+    detector = IllnessDetector()
+    monkeypatch.setattr(illness, "detector", detector)
+    [cow_id] = add_cows(db_session, 1)
+
+    readings.insert_readings(db_session, "milk", [
+        {"cow_id": cow_id, "timestamp": date(2024, 10, 14), "value": 2.0},
+    ])
+    db_session.commit()
+
+    assert detector.windows == {}
@@ -1,24 +1,34 @@
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
 import pandas as pd
+import aiohttp
 import asyncio
 import uuid
-from app.ingestion import ingest_data, process_sensor, process_cow, process_measurement
+import json as json_module
+from app.ingestion_stats import IngestionRun
+from app.ingestion import RejectLog, ingest_data, ingest_measurement_shard, prepare_readings, process_sensor, process_cow, process_measurement_chunk
+
+def mock_response(status=201, json=None):
+    response = MagicMock(status=status, headers={})
+    response.text = AsyncMock(return_value="" if json is None else json_module.dumps(json))
+    context = MagicMock()
+    context.__aenter__.return_value = response
+    return context
 
 @pytest.fixture
 def mock_aiohttp_client():
-    with patch('aiohttp.ClientSession', new_callable=AsyncMock) as mock_session:
+    with patch('aiohttp.ClientSession') as mock_session:
         yield mock_session
 
 @pytest.fixture
 def mock_pandas_read_parquet():
     with patch('pandas.read_parquet') as mock_read_parquet:
         sensors_df = pd.DataFrame({
-            'id': [uuid.uuid4(), uuid.uuid4()],
-            'unit': ['weight', 'milk']
+            'id': [str(uuid.uuid4()), str(uuid.uuid4())],
+            'unit': ['kg', 'L']
         })
         cows_df = pd.DataFrame({
-            'id': [uuid.uuid4(), uuid.uuid4()],
+            'id': [str(uuid.uuid4()), str(uuid.uuid4())],
             'name': ['Bessie', 'Molly'],
             'birthdate': [int(pd.Timestamp('2019-01-01').timestamp() * 1_000_000_000),
                           int(pd.Timestamp('2020-01-01').timestamp() * 1_000_000_000)]
@@ -28,35 +38,128 @@ def mock_pandas_read_parquet():
             'sensor_id': [str(sensors_df.iloc[0]['id']), str(sensors_df.iloc[1]['id'])],
             'timestamp': [int(pd.Timestamp('2023-10-01').timestamp()), int(pd.Timestamp('2023-10-01').timestamp())],
             'value': [150.0, 50.0]
+        })
 
-        mock_read_parquet.side_effect = [sensors_df, cows_df, measurements_df]
-        yield mock_read_parquet
+        mock_read_parquet.side_effect = [sensors_df, cows_df]
+        batches = [((1, 0), {column: measurements_df[column].tolist() for column in measurements_df})]
+        with patch('app.ingestion.iter_positioned_batches', return_value=iter(batches)):
+            yield mock_read_parquet
 
 @pytest.mark.asyncio
 async def test_ingest_data(mock_aiohttp_client, mock_pandas_read_parquet):
     mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
-    mock_session.post = AsyncMock(side_effect=[
-        AsyncMock(status=201),
-        AsyncMock(status=201)
+    mock_session.post = MagicMock(side_effect=[
+        mock_response(200, {"known": []}),
+        mock_response(200, {"created": 2, "existing": 0}),
+        mock_response(200, {"known": []}),
+        mock_response(200, {"created": 2, "existing": 0}),
+        mock_response(200, {"accepted": 2, "rejected": 0, "rejections": []}),
     ])
 
-    mock_session.post.side_effect += [
-        AsyncMock(status=201),
-        AsyncMock(status=201)
-    ]
+    run = await ingest_data("http://localhost:8000")
 
-    mock_session.post.side_effect += [
-        AsyncMock(status=201),
-        AsyncMock(status=201)
+    # a lookup and a bulk registration each for sensors and cows, then a
+    # single bulk call for all measurements
+    assert [call[0][0] for call in mock_session.post.call_args_list] == [
+        "http://localhost:8000/api/sensors/lookup",
+        "http://localhost:8000/api/sensors",
+        "http://localhost:8000/api/cows/lookup",
+        "http://localhost:8000/api/cows",
+        "http://localhost:8000/api/measurements/bulk",
     ]
+    assert run.summary()["outcomes"] == {
+        "cow": {"created": 2},
+        "measurement": {"stored": 2},
+        "sensor": {"created": 2},
+    }
+    assert run.latency.count == 5
+
+@pytest.mark.asyncio
+async def test_ingest_data_registers_only_missing_entities(mock_aiohttp_client, mock_pandas_read_parquet):
+    sensors_df, cows_df = mock_pandas_read_parquet.side_effect
+    mock_pandas_read_parquet.side_effect = [sensors_df, cows_df]
+    mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
+    mock_session.post = MagicMock(side_effect=[
+        mock_response(200, {"known": sensors_df["id"].tolist()}),
+        mock_response(200, {"known": [cows_df["id"][0]]}),
+        mock_response(500),
+        mock_response(200, {"accepted": 1, "rejected": 0, "rejections": []}),
+    ])
+
+    run = await ingest_data("http://localhost:8000")
+
+    register_cows = mock_session.post.call_args_list[2]
+    assert register_cows[0][0] == "http://localhost:8000/api/cows"
+    assert [cow["id"] for cow in register_cows[1]["json"]["cows"]] == [cows_df["id"][1]]
+    # The cow that failed to register is rejected without a round trip.
+    bulk = mock_session.post.call_args_list[3][1]["json"]["readings"]
+    assert [reading["cow_id"] for reading in bulk] == [cows_df["id"][0]]
+    assert run.summary()["outcomes"] == {
+        "cow": {"existing": 1, "failed": 1},
+        "measurement": {"invalid": 1, "stored": 1},
+        "sensor": {"existing": 2},
+    }
+
+@pytest.mark.asyncio
+async def test_ingest_data_sends_rows_of_cows_in_doubt(mock_aiohttp_client, mock_pandas_read_parquet):
+    sensors_df, cows_df = mock_pandas_read_parquet.side_effect
+    mock_pandas_read_parquet.side_effect = [sensors_df, cows_df]
+    mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
+    mock_session.post = MagicMock(side_effect=[
+        mock_response(200, {"known": sensors_df["id"].tolist()}),
+        mock_response(500),
+        aiohttp.ClientConnectionError("connection reset"),
+        mock_response(200, {"accepted": 2, "rejected": 0, "rejections": []}),
+    ])
+
+    run = await ingest_data("http://localhost:8000")
+
+    # Neither the lookup nor the registration of the cows was answered, so
+    # the server decides about their rows.
+    bulk = mock_session.post.call_args_list[3][1]["json"]["readings"]
+    assert sorted(reading["cow_id"] for reading in bulk) == sorted(cows_df["id"])
+    assert run.summary()["outcomes"]["measurement"] == {"stored": 2}
+
+@pytest.mark.asyncio
+async def test_ingest_data_saves_checkpoint(mock_aiohttp_client, mock_pandas_read_parquet, tmp_path):
+    mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
+    mock_session.post = MagicMock(side_effect=[
+        mock_response(200, {"known": []}),
+        mock_response(200, {"created": 2, "existing": 0}),
+        mock_response(200, {"known": []}),
+        mock_response(200, {"created": 2, "existing": 0}),
+        mock_response(200, {"accepted": 2, "duplicates": 0, "rejected": 0, "rejections": []}),
+    ])
+    checkpoint_path = tmp_path / "checkpoint.json"
 
-    await ingest_data("http://localhost:8000")
+    await ingest_data("http://localhost:8000", checkpoint_path=str(checkpoint_path))
 
-    assert mock_session.post.call_count == 6
+    assert json_module.loads(checkpoint_path.read_text()) == {
+        "file": "cow_data/measurements.parquet", "row_group": 1, "row_offset": 0,
+    }
+
+def test_ingest_measurement_shard(mock_aiohttp_client, mock_pandas_read_parquet, tmp_path):
+    mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
+    mock_session.post = MagicMock(return_value=mock_response(200, {"accepted": 1, "duplicates": 1, "rejected": 0, "rejections": []}))
+    sensor_id = str(uuid.uuid4())
+
+    with patch('app.ingestion.iter_positioned_batches', return_value=iter([((1, 0), {
+        'cow_id': [str(uuid.uuid4())] * 2,
+        'sensor_id': [sensor_id] * 2,
+        'timestamp': [1696128000, 1696131600],
+        'value': [25.5, 26.0],
+    })])) as batches:
+        run = ingest_measurement_shard("http://localhost:8000", 1, 4, 2, 16, {sensor_id: 'L'}, str(tmp_path / "checkpoint.json"))
+
+    assert run.summary()["outcomes"] == {"measurement": {"duplicate": 1, "stored": 1}}
+    assert run.requests == 1
+    assert batches.call_args.kwargs == {"shard_by": "cow_id", "shard": 1, "shards": 4}
+    assert (tmp_path / "checkpoint.shard2of4.json").exists()
 
 @pytest.mark.asyncio
 async def test_process_sensor(mock_aiohttp_client):
     mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
+    mock_session.post = MagicMock(return_value=mock_response(201))
     sensor_id = uuid.uuid4()
     unit = 'weight'
 
@@ -67,6 +170,7 @@ async def test_process_sensor(mock_aiohttp_client):
 @pytest.mark.asyncio
 async def test_process_cow(mock_aiohttp_client):
     mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
+    mock_session.post = MagicMock(return_value=mock_response(201))
     cow_id = uuid.uuid4()
     name = 'Bessie'
     birthdate = pd.Timestamp('2019-01-01')
@@ -80,24 +184,81 @@ async def test_process_cow(mock_aiohttp_client):
     })
 
 @pytest.mark.asyncio
-async def test_process_measurement(mock_aiohttp_client):
+async def test_process_measurement_chunk(mock_aiohttp_client, tmp_path):
     mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
-    row = {
-        'cow_id': uuid.uuid4(),
-        'sensor_id': uuid.uuid4(),
-        'timestamp': 1696128000,
-        'value': 150.0
+    mock_session.post = MagicMock(return_value=mock_response(200, {"accepted": 2, "rejected": 0, "rejections": []}))
+    cow_id = str(uuid.uuid4())
+    milk_sensor, weight_sensor = str(uuid.uuid4()), str(uuid.uuid4())
+    chunk = pd.DataFrame({
+        'cow_id': [cow_id, cow_id, cow_id],
+        'sensor_id': [weight_sensor, milk_sensor, milk_sensor],
+        'timestamp': [1696128000, 1696128000, 1696128000],
+        'value': [450.0, 25.5, -1.0]
+    })
+    rejects = RejectLog(str(tmp_path / "rejects.csv"))
+
+    stored = await process_measurement_chunk(
+        mock_session, "http://localhost:8000", chunk,
+        units={milk_sensor: 'L', weight_sensor: 'kg'}, rejects=rejects,
+    )
+
+    assert stored
+    mock_session.post.assert_called_once_with("http://localhost:8000/api/measurements/bulk", json={"readings": [
+        {"cow_id": cow_id, "sensor_id": milk_sensor, "type": "milk", "date": "2023-10-01", "timestamp": "2023-10-01T02:40:00.000000", "value": 25.5},
+        {"cow_id": cow_id, "sensor_id": weight_sensor, "type": "weight", "date": "2023-10-01", "timestamp": "2023-10-01T02:40:00.000000", "value": 450.0},
+    ]})
+    assert pd.read_csv(tmp_path / "rejects.csv")["reason"].tolist() == ["non-positive value"]
+
+def test_prepare_readings_classifies_by_sensor_unit():
+    cows = [str(uuid.uuid4()), str(uuid.uuid4())]
+    milk, weight, thermometer = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    chunk = {
+        'cow_id': [cows[1], cows[0], cows[1], cows[0], cows[0], cows[0]],
+        'sensor_id': [milk, weight, weight, thermometer, str(uuid.uuid4()), milk],
+        'timestamp': [1696118400 + i for i in range(6)],
+        'value': [30.0, 80.0, 450.0, 38.5, 20.0, float('nan')],
     }
 
-    await process_measurement(mock_session, "http://localhost:8000", row)
+    readings, rejected = prepare_readings(chunk, {milk: 'L', weight: 'kg', thermometer: 'C'})
+
+    assert [(r['cow_id'], r['type'], r['value']) for r in readings] == sorted([
+        (cows[0], 'weight', 80.0), (cows[1], 'milk', 30.0), (cows[1], 'weight', 450.0),
+    ])
+    assert readings[0]['date'] == '2023-10-01'
+    assert rejected['reason'].tolist() == ['unsupported unit', 'unknown sensor', 'missing value']
 
-    cow_id = row['cow_id']
-    sensor_type = 'weight' if row['value'] > 100 else 'milk'
-    expected_endpoint = f"http://localhost:8000/api/cows/{cow_id}/{sensor_type}"
-    expected_payload = {
-        "date": pd.to_datetime(row['timestamp'], unit='s').date().isoformat(),
-        "value": float(row['value'])
+def test_prepare_readings_rejects_unknown_cows():
+    known, unknown, milk = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    chunk = {
+        'cow_id': [known, unknown],
+        'sensor_id': [milk, milk],
+        'timestamp': [1696118400, 1696118401],
+        'value': [30.0, 31.0],
     }
 
-    mock_session.post.assert_called_once_with(expected_endpoint, json=expected_payload)
+    readings, rejected = prepare_readings(chunk, {milk: 'L'}, {known})
+
+    assert [r['cow_id'] for r in readings] == [known]
+    assert rejected['cow_id'].tolist() == [unknown]
+    assert rejected['reason'].tolist() == ['unknown cow']
+
+@pytest.mark.asyncio
+async def test_process_cow_counts_conflict_as_existing(mock_aiohttp_client):
+    mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
+    mock_session.post = MagicMock(return_value=mock_response(409))
+    run = IngestionRun()
+
+    await process_cow(mock_session, "http://localhost:8000", uuid.uuid4(), 'Bessie', pd.Timestamp('2019-01-01'), run=run)
+
+    assert run.summary()["outcomes"] == {"cow": {"existing": 1}}
+
+@pytest.mark.asyncio
+async def test_process_sensor_retries_throttled_request(mock_aiohttp_client):
+    mock_session = mock_aiohttp_client.return_value.__aenter__.return_value
+    throttled = mock_response(429)
+    throttled.__aenter__.return_value.headers = {"Retry-After": "0"}
+    mock_session.post = MagicMock(side_effect=[throttled, mock_response(201)])
+
+    await process_sensor(mock_session, "http://localhost:8000", uuid.uuid4(), 'kg')
 
+    assert mock_session.post.call_count == 2
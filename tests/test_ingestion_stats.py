@@ -0,0 +1,42 @@
+import pickle
+from app.ingestion_stats import IngestionRun, LatencyHistogram
+
+def test_latency_histogram_quantiles():
+    histogram = LatencyHistogram(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.05, 0.5, 5.0):
+        histogram.observe(seconds)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(1.0) == float("inf")
+
+def test_runs_merge_across_processes():
+    totals, worker = IngestionRun(), IngestionRun()
+    totals.record("measurement", "stored", 10)
+    worker.record("measurement", "stored", 5)
+    worker.record("measurement", "failed", 2)
+    worker.observe_request(0.2)
+    worker.stage_seconds["http"] += 0.2
+
+    totals.merge(pickle.loads(pickle.dumps(worker)))
+
+    summary = totals.summary()
+    assert summary["outcomes"] == {"measurement": {"failed": 2, "stored": 15}}
+    assert summary["requests"] == 1
+    assert summary["stage_seconds"]["http"] == 0.2
+    assert totals.total("measurement") == 17
+
+def test_prometheus_textfile(tmp_path):
+    run = IngestionRun()
+    run.record("sensor", "created", 2)
+    run.observe_request(0.02)
+    path = tmp_path / "ingestion.prom"
+
+    run.write_prometheus(str(path))
+
+    text = path.read_text()
+    assert 'cowshed_ingestion_items_total{kind="sensor",outcome="created"} 2' in text
+    assert 'cowshed_ingestion_request_seconds_bucket{le="0.025"} 1' in text
+    assert 'cowshed_ingestion_request_seconds_bucket{le="+Inf"} 1' in text
+    assert "cowshed_ingestion_request_seconds_count 1" in text
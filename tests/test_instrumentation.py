@@ -0,0 +1,49 @@
+import logging
+from sqlalchemy import create_engine, text
+from app.instrumentation import (
+    QueryCounter,
+    RequestStats,
+    RouteMetrics,
+    current_request,
+    instrument_engine,
+)
+
+def test_query_counter_adds_to_the_current_request():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine, QueryCounter())
+    stats = RequestStats()
+    token = current_request.set(stats)
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+    finally:
+        current_request.reset(token)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 3"))
+
+    assert stats.queries == 2
+    assert stats.db_seconds > 0
+
+def test_slow_queries_are_logged_with_parameters(caplog):
+    engine = create_engine("sqlite://")
+    instrument_engine(engine, QueryCounter(slow_query_seconds=0))
+
+    with caplog.at_level(logging.WARNING, logger="app.slow_queries"):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT :value"), {"value": 42})
+
+    [record] = caplog.records
+    assert "SELECT ?" in record.getMessage()
+    assert "(42,)" in record.getMessage()
+
+def test_route_metrics_prometheus_text():
+    metrics = RouteMetrics()
+    metrics.record("GET", "/cows/{id}", 200, 0.002, RequestStats(queries=3, db_seconds=0.001))
+    metrics.record("GET", "/cows/{id}", 404, 0.001, RequestStats(queries=1, db_seconds=0.0005))
+
+    lines = metrics.prometheus_text().splitlines()
+    assert 'cowshed_http_requests_total{method="GET",route="/cows/{id}",status="200"} 1' in lines
+    assert 'cowshed_http_db_queries_total{route="/cows/{id}"} 4' in lines
+    assert 'cowshed_http_request_seconds_bucket{route="/cows/{id}",le="+Inf"} 2' in lines
+    assert 'cowshed_http_request_seconds_count{route="/cows/{id}"} 2' in lines
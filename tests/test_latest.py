@@ -0,0 +1,44 @@
+import pytest
+from datetime import date, datetime
+from uuid import uuid4
+from app import latest, models, readings
+
+@pytest.fixture
+def cow_id(db_session):
+    cow_id = str(uuid4())
+    db_session.add(models.Cow(id=cow_id, name="Bessie", birthdate=datetime(2020, 1, 1)))
+    db_session.commit()
+    return cow_id
+
+def test_latest_readings_ignore_out_of_order_inserts(db_session, cow_id):
+    readings.insert_readings(db_session, "weight", [
+        {"cow_id": cow_id, "timestamp": datetime(2024, 10, 14, 6), "value": 450.0},
+        {"cow_id": cow_id, "timestamp": datetime(2024, 10, 13, 6), "value": 440.0},
+    ])
+    readings.insert_readings(db_session, "weight", [
+        {"cow_id": cow_id, "timestamp": datetime(2024, 10, 12, 6), "value": 430.0},
+    ])
+    readings.insert_readings(db_session, "milk", [
+        {"cow_id": cow_id, "timestamp": date(2024, 10, 14), "value": 25.0},
+    ])
+    db_session.commit()
+
+    cow = db_session.get(models.Cow, cow_id)
+    assert (cow.latest_weight, cow.latest_weight_at) == (450.0, datetime(2024, 10, 14, 6))
+    assert (cow.latest_milk, cow.latest_milk_at) == (25.0, datetime(2024, 10, 14))
+    assert latest.check(db_session) == []
+
+def test_check_reports_drift_and_rebuild_repairs_it(db_session, cow_id):
+    readings.insert_readings(db_session, "milk", [
+        {"cow_id": cow_id, "timestamp": datetime(2024, 10, 14, 6), "value": 25.0},
+    ])
+    db_session.query(models.Cow).update({"latest_milk": 99.0})
+    db_session.commit()
+
+    assert latest.check(db_session) == [
+        {"cow_id": cow_id, "field": "latest_milk", "stored": 99.0, "actual": 25.0},
+    ]
+
+    latest.rebuild(db_session)
+    db_session.commit()
+    assert latest.check(db_session) == []
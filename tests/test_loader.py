@@ -0,0 +1,64 @@
+import pytest
+import pandas as pd
+from fastparquet import write
+from uuid import uuid4
+from app import models
+from app.loader import load_data
+
+@pytest.fixture
+def data_dir(tmp_path):
+    milk_sensor, weight_sensor = str(uuid4()), str(uuid4())
+    cows = [str(uuid4()), str(uuid4())]
+    write(str(tmp_path / "sensors.parquet"), pd.DataFrame({
+        'id': [milk_sensor, weight_sensor],
+        'unit': ['L', 'kg'],
+    }))
+    write(str(tmp_path / "cows.parquet"), pd.DataFrame({
+        'id': cows,
+        'name': ['Bessie', 'Molly'],
+        'birthdate': [int(pd.Timestamp('2019-01-01').value), int(pd.Timestamp('2020-01-01').value)],
+    }))
+    ts = int(pd.Timestamp('2024-10-14 06:00').timestamp())
+    write(str(tmp_path / "measurements.parquet"), pd.DataFrame({
+        'cow_id': [cows[0], cows[0], cows[1], cows[1], str(uuid4()), cows[1]],
+        'sensor_id': [milk_sensor, weight_sensor, milk_sensor, weight_sensor, milk_sensor, milk_sensor],
+        'timestamp': [ts, ts, ts, ts, ts, ts],
+        'value': [25.5, 450.0, 12.0, 380.0, 20.0, None],
+    }), row_group_offsets=3)
+    return tmp_path, cows
+
+def test_load_data(db_session, data_dir):
+    path, cows = data_dir
+
+    counts = load_data(db_session, str(path))
+
+    assert counts == {"loaded": 4, "duplicates": 0, "rejected": 2}
+    assert db_session.query(models.Sensor).count() == 2
+    assert db_session.query(models.Cow).count() == 2
+    assert db_session.query(models.Measurement).count() == 4
+    milk = db_session.query(models.MilkProduction).filter_by(cow_id=cows[1]).one()
+    assert milk.value == 12.0
+    assert milk.timestamp == pd.Timestamp('2024-10-14 06:00').to_pydatetime()
+    weight = db_session.query(models.Weight).filter_by(cow_id=cows[0]).one()
+    assert weight.value == 450.0
+
+def test_load_data_skips_existing_entities(db_session, data_dir):
+    path, _ = data_dir
+
+    load_data(db_session, str(path))
+    load_data(db_session, str(path))
+
+    assert db_session.query(models.Sensor).count() == 2
+    assert db_session.query(models.Cow).count() == 2
+
+def test_load_data_twice_skips_stored_measurements(db_session, data_dir):
+    path, cows = data_dir
+
+    load_data(db_session, str(path))
+    counts = load_data(db_session, str(path))
+
+    assert counts == {"loaded": 0, "duplicates": 4, "rejected": 2}
+    assert db_session.query(models.Measurement).count() == 4
+    assert db_session.query(models.MilkProduction).count() == 2
+    stats = db_session.query(models.DailyCowStats).filter_by(cow_id=cows[1]).one()
+    assert stats.milk_total == 12.0
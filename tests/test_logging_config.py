@@ -0,0 +1,58 @@
+import logging
+import pytest
+from app import logging_config
+from app.logging_config import LogSampler, configure_logging, parse_levels, stop_logging
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    stop_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    logging.getLogger("app.quiet").setLevel(logging.NOTSET)
+
+def test_parse_levels():
+    assert parse_levels(" app.ingestion=debug, aiosqlite=WARNING ,") == {
+        "app.ingestion": "DEBUG",
+        "aiosqlite": "WARNING",
+    }
+    with pytest.raises(ValueError):
+        parse_levels("app.ingestion")
+
+def test_configure_logging_writes_from_a_background_thread(root_logger, tmp_path, monkeypatch):
+    monkeypatch.setenv("COWSHED_LOG_LEVELS", "app.quiet=ERROR")
+    log_file = tmp_path / "app.log"
+
+    configure_logging(str(log_file), level="info")
+    configure_logging(str(tmp_path / "other.log"))
+    logging.getLogger("app.loud").info("stored %d rows", 3)
+    logging.getLogger("app.loud").debug("not written %s", "at info")
+    logging.getLogger("app.quiet").warning("below the module level")
+    stop_logging()
+
+    lines = log_file.read_text().splitlines()
+    assert len(lines) == 1
+    assert lines[0].endswith("INFO - stored 3 rows")
+    assert not (tmp_path / "other.log").exists()
+    assert logging_config._listener is None
+
+def test_log_sampler_logs_first_and_every_nth(caplog):
+    logger = logging.getLogger("app.sampled")
+    sampler = LogSampler(logger, every=3)
+
+    with caplog.at_level(logging.INFO, logger="app.sampled"):
+        for cow in range(7):
+            sampler.warning("Rejected reading for cow %s", cow)
+        sampler.log_totals()
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "Rejected reading for cow 0 (1 so far)",
+        "Rejected reading for cow 2 (3 so far)",
+        "Rejected reading for cow 5 (6 so far)",
+        "7 times: Rejected reading for cow %s",
+    ]
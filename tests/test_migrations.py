@@ -0,0 +1,62 @@
+from datetime import date
+from uuid import UUID, uuid4
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from app import migrations, models
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE cows (id VARCHAR NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, birthdate DATETIME NOT NULL)",
+    "CREATE TABLE sensors (id VARCHAR NOT NULL PRIMARY KEY, unit VARCHAR NOT NULL)",
+    "CREATE TABLE measurements (id VARCHAR NOT NULL PRIMARY KEY, cow_id VARCHAR NOT NULL, sensor_id VARCHAR NOT NULL, timestamp DATETIME NOT NULL, value FLOAT NOT NULL)",
+    "CREATE TABLE milk (id VARCHAR NOT NULL PRIMARY KEY, cow_id VARCHAR NOT NULL, timestamp DATETIME NOT NULL, value FLOAT NOT NULL)",
+    "CREATE TABLE weights (id VARCHAR NOT NULL PRIMARY KEY, cow_id VARCHAR NOT NULL, timestamp DATETIME NOT NULL, value FLOAT NOT NULL)",
+]
+
+def test_upgrade_legacy_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    cow_id = str(uuid4())
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO cows VALUES (:id, 'Bessie', '2020-01-01 00:00:00.000000')"), {"id": cow_id})
+        conn.execute(text("INSERT INTO milk VALUES (:id, :cow_id, '2024-10-14 06:30:00.000000', 12.5)"), {"id": str(uuid4()), "cow_id": cow_id})
+        conn.execute(text("INSERT INTO weights VALUES (:id, :cow_id, '2024-10-13 00:00:00.000000', 450.0)"), {"id": str(uuid4()), "cow_id": cow_id})
+        sensor_id = str(uuid4())
+        for _ in range(2):
+            conn.execute(text("INSERT INTO measurements VALUES (:id, :cow_id, :sensor_id, '2024-10-14 06:30:00.000000', 12.5)"), {"id": str(uuid4()), "cow_id": cow_id, "sensor_id": sensor_id})
+
+    migrations.upgrade(engine)
+    migrations.upgrade(engine)
+
+    inspector = inspect(engine)
+    for table_name in ("milk", "weights"):
+        assert "day" in {c["name"] for c in inspector.get_columns(table_name)}
+        index_columns = [i["column_names"] for i in inspector.get_indexes(table_name)]
+        assert ["cow_id", "timestamp"] in index_columns
+        assert ["day", "cow_id"] in index_columns
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT day FROM milk")).scalar() == date(2024, 10, 14).isoformat()
+        assert conn.execute(text("SELECT day FROM weights")).scalar() == date(2024, 10, 13).isoformat()
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT id FROM cows")).scalar() == UUID(cow_id).bytes
+        schema = conn.execute(text("SELECT name, sql FROM sqlite_master WHERE sql IS NOT NULL")).all()
+        assert [name for name, sql in schema if "_legacy" in sql] == []
+        assert conn.execute(text("PRAGMA foreign_key_check(daily_cow_stats)")).all() == []
+        assert conn.execute(text("SELECT typeof(id), cow_id FROM milk")).one() == ("integer", UUID(cow_id).bytes)
+
+    db = sessionmaker(bind=engine)()
+    cow = db.query(models.Cow).one()
+    assert cow.id == cow_id
+    assert (cow.latest_milk, cow.latest_weight) == (12.5, 450.0)
+    assert db.query(models.Measurement).one().sensor_id == sensor_id
+    stats = db.query(models.DailyCowStats).order_by(models.DailyCowStats.day).all()
+    assert [(s.day, s.milk_total, s.last_weight) for s in stats] == [
+        (date(2024, 10, 13), 0.0, 450.0),
+        (date(2024, 10, 14), 12.5, None),
+    ]
+    assert db.query(models.Weight).one().cow_id == cow_id
+    db.add(models.MilkProduction(cow_id=cow_id, timestamp=date(2024, 10, 15), value=10.0))
+    db.commit()
+    assert db.query(models.MilkProduction).count() == 2
+    db.close()
@@ -0,0 +1,45 @@
+import pandas as pd
+from fastparquet import write
+from app.parquet_io import iter_positioned_batches
+
+def test_iter_positioned_batches(tmp_path):
+    path = str(tmp_path / "measurements.parquet")
+    write(path, pd.DataFrame({
+        'cow_id': [f"cow{i}" for i in range(10)],
+        'value': [float(i) for i in range(10)],
+        'unused': list(range(10)),
+    }), row_group_offsets=[0, 6])
+
+    batches = [batch for _, batch in iter_positioned_batches(path, ['cow_id', 'value'], batch_size=4)]
+
+    assert [len(batch['cow_id']) for batch in batches] == [4, 2, 4]
+    assert all(set(batch) == {'cow_id', 'value'} for batch in batches)
+    assert [v for batch in batches for v in batch['value']] == [float(i) for i in range(10)]
+    assert isinstance(batches[0]['value'], list)
+
+def test_iter_positioned_batches_resumes(tmp_path):
+    path = str(tmp_path / "measurements.parquet")
+    write(path, pd.DataFrame({'value': [float(i) for i in range(10)]}), row_group_offsets=[0, 6])
+
+    positions = [position for position, _ in iter_positioned_batches(path, ['value'], batch_size=4)]
+    resumed = list(iter_positioned_batches(path, ['value'], batch_size=4, row_group=0, row_offset=4))
+
+    assert positions == [(0, 4), (1, 0), (2, 0)]
+    assert [position for position, _ in resumed] == [(1, 0), (2, 0)]
+    assert [v for _, batch in resumed for v in batch['value']] == [float(i) for i in range(4, 10)]
+
+def test_iter_positioned_batches_shards_by_key(tmp_path):
+    path = str(tmp_path / "measurements.parquet")
+    cows = [f"cow{i % 7}" for i in range(50)]
+    write(path, pd.DataFrame({'cow_id': cows, 'value': [float(i) for i in range(50)]}), row_group_offsets=[0, 20])
+
+    shards = [
+        [row for _, batch in iter_positioned_batches(path, ['cow_id', 'value'], 8, shard_by='cow_id', shard=shard, shards=3)
+         for row in zip(batch['cow_id'], batch['value'])]
+        for shard in range(3)
+    ]
+
+    assert sorted(value for rows in shards for _, value in rows) == [float(i) for i in range(50)]
+    owners = {cow: {i for i, rows in enumerate(shards) if any(c == cow for c, _ in rows)} for cow in set(cows)}
+    assert all(len(owner) == 1 for owner in owners.values())
+    assert all([v for _, v in rows] == sorted(v for _, v in rows) for rows in shards)
@@ -0,0 +1,51 @@
+import pytest
+import asyncio
+from app.pipeline import AdaptiveLimiter, run_pipeline
+
+@pytest.mark.asyncio
+async def test_run_pipeline_keeps_requests_in_flight():
+    limiter = AdaptiveLimiter(limit=4, min_limit=4, max_limit=4)
+    peak = 0
+    done = []
+
+    async def handle(item):
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01 if item % 5 else 0.05)
+            done.append(item)
+
+    await run_pipeline(range(40), handle, workers=8)
+
+    assert sorted(done) == list(range(40))
+    assert peak == 4
+
+@pytest.mark.asyncio
+async def test_run_pipeline_survives_failing_items():
+    done = []
+
+    async def handle(item):
+        if item == 3:
+            raise ValueError("bad item")
+        done.append(item)
+
+    await run_pipeline(range(6), handle, workers=2)
+
+    assert sorted(done) == [0, 1, 2, 4, 5]
+
+@pytest.mark.asyncio
+async def test_limiter_adapts_to_latency_and_throttling():
+    limiter = AdaptiveLimiter(limit=8, min_limit=1, max_limit=16, target_latency=0.5)
+
+    for _ in range(20):
+        limiter.record(201, 0.01)
+    assert limiter.limit > 9
+
+    grown = limiter.limit
+    limiter.record(429, 0.01, retry_after="0")
+    assert limiter.limit == grown / 2
+    assert limiter.throttled == 1
+
+    # a burst of throttled responses only shrinks the limit once
+    limiter.record(503, 0.01)
+    assert limiter.limit == grown / 2
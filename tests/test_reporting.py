@@ -1,59 +1,157 @@
+import csv
+import io
 import pytest
-from unittest.mock import Mock
 from datetime import datetime, timedelta
-from sqlalchemy import func
-from sqlalchemy.orm import Session
-from app.reporting import generate_report
-from app.models import MilkProduction, Weight, Cow
+from uuid import uuid4
+from app import rollup
+from app.readings import insert_readings
+from fastparquet import ParquetFile
+from app.reporting import columnar, generate_report, farm_report, range_report_frame, write_report
+from app.models import MilkProduction, Weight, Cow, DailyCowStats
 
 @pytest.fixture
-def mock_db_session():
-    return Mock(spec=Session)
-
-def test_generate_report(mock_db_session):
+def herd(db_session):
     report_date = datetime(2024, 10, 14)
+    cow1, cow2 = sorted([str(uuid4()), str(uuid4())])
+    for cow_id, name in [(cow1, 'Bessie'), (cow2, 'Molly')]:
+        db_session.add(Cow(id=cow_id, name=name, birthdate=datetime(2020, 1, 1)))
+    db_session.add_all([
+        MilkProduction(cow_id=cow1, timestamp=report_date, value=10.0),
+        MilkProduction(cow_id=cow1, timestamp=report_date + timedelta(hours=12), value=5.0),
+        MilkProduction(cow_id=cow1, timestamp=report_date - timedelta(days=1), value=30.0),
+        MilkProduction(cow_id=cow2, timestamp=report_date, value=3.0),
+        Weight(cow_id=cow1, timestamp=report_date - timedelta(days=5), value=460.0),
+        Weight(cow_id=cow1, timestamp=report_date, value=450.0),
+        Weight(cow_id=cow1, timestamp=report_date - timedelta(days=40), value=900.0),
+        Weight(cow_id=cow1, timestamp=report_date + timedelta(days=1), value=100.0),
+        Weight(cow_id=cow2, timestamp=report_date - timedelta(days=5), value=430.0),
+        Weight(cow_id=cow2, timestamp=report_date, value=350.0),
+    ])
+    rollup.rebuild(db_session)
+    db_session.commit()
+    return report_date, cow1, cow2
 
-    mock_milk_data = [
-        ('cow1', 15.0),
-        ('cow2', 3.0),
-    ]
-    mock_db_session.query().filter().group_by().all.return_value = mock_milk_data
-
-    mock_cows = [
-        ('cow1', 'Bessie'),
-        ('cow2', 'Molly'),
-    ]
-    mock_db_session.query(Cow.id, Cow.name).all.return_value = mock_cows
-
-    def mock_latest_weight(cow_id):
-        if cow_id == 'cow1':
-            return (450.0,)
-        elif cow_id == 'cow2':
-            return (350.0,)
-        return None
+def test_generate_report(db_session, herd):
+    report_date, cow1, cow2 = herd
 
-    mock_db_session.query(Weight.value).filter().order_by().first.side_effect = lambda *args, **kwargs: mock_latest_weight(args[1].__eq__.right.value)
+    report = generate_report(db_session, report_date)
 
-    def mock_avg_weight(cow_id):
-        if cow_id == 'cow1':
-            return 455.0
-        elif cow_id == 'cow2':
-            return 390.0
-        return None
-
-    mock_db_session.query(func.avg(Weight.value)).filter().scalar.side_effect = lambda: mock_avg_weight(mock_db_session.query().filter.call_args[0][0].right.value)
-
-    report = generate_report(mock_db_session, report_date)
-
-    assert "cow1" in report
+    assert cow1 in report
     assert "Total Milk Production: 15.0 liters" in report
     assert "Latest Weight: 450.0 kg" in report
     assert "30-day Avg Weight: 455.0 kg" in report
 
-    assert "cow2" in report
+    assert cow2 in report
     assert "Total Milk Production: 3.0 liters" in report
     assert "Latest Weight: 350.0 kg" in report
     assert "30-day Avg Weight: 390.0 kg" in report
 
     assert "Potentially Ill Cows:" in report
-    assert "cow2" in report
+    assert report.split("Potentially Ill Cows:\n")[1] == cow2
+
+def test_farm_report(db_session, herd):
+    report_date, cow1, cow2 = herd
+
+    rows = farm_report(db_session, report_date.date())
+
+    assert rows == [
+        {"cow_id": cow1, "total_milk": 15.0, "latest_weight": 450.0, "avg_weight_last_30_days": 455.0, "potentially_ill": False},
+        {"cow_id": cow2, "total_milk": 3.0, "latest_weight": 350.0, "avg_weight_last_30_days": 390.0, "potentially_ill": True},
+    ]
+
+def test_generate_report_without_readings(db_session):
+    cow_id = str(uuid4())
+    db_session.add(Cow(id=cow_id, name='Bessie', birthdate=datetime(2020, 1, 1)))
+    db_session.commit()
+
+    report = generate_report(db_session, datetime(2024, 10, 14))
+
+    assert f"Cow ID: {cow_id}" in report
+    assert "Total Milk Production: N/A liters" in report
+    assert "Potentially Ill Cows:" not in report
+
+def test_write_report_streams_text_in_small_batches(db_session, herd):
+    report_date, cow1, cow2 = herd
+    out = io.StringIO()
+
+    write_report(db_session, report_date, out, batch_size=1)
+
+    assert out.getvalue() == generate_report(db_session, report_date)
+
+def test_write_report_csv(db_session, herd):
+    report_date, cow1, cow2 = herd
+    out = io.StringIO()
+
+    write_report(db_session, report_date, out, format="csv", batch_size=1)
+
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert [(row["cow_id"], row["total_milk"], row["potentially_ill"]) for row in rows] == [
+        (cow1, "15.0", "False"),
+        (cow2, "3.0", "True"),
+    ]
+
+def test_write_report_parquet(db_session, herd, tmp_path):
+    report_date, cow1, cow2 = herd
+    path = str(tmp_path / "report.parquet")
+
+    write_report(db_session, report_date, path, format="parquet", batch_size=1)
+
+    parquet_file = ParquetFile(path)
+    assert len(parquet_file.row_groups) == 2
+    frame = parquet_file.to_pandas()
+    assert frame.to_dict("records") == farm_report(db_session, report_date)
+
+def test_range_report_matches_single_day_reports(db_session, herd):
+    report_date, cow1, cow2 = herd
+    # a weight exactly at the edge of the window of the last report day
+    db_session.add(Weight(cow_id=cow2, timestamp=report_date - timedelta(days=28), value=800.0))
+    rollup.rebuild(db_session)
+    db_session.commit()
+    start, end = (report_date - timedelta(days=3)).date(), (report_date + timedelta(days=2)).date()
+
+    report = columnar(range_report_frame(db_session, start, end))
+
+    assert set(report) == {"day", "cow_id", "total_milk", "latest_weight", "avg_weight_last_30_days", "potentially_ill"}
+    rows = [dict(zip(report, values)) for values in zip(*report.values())]
+    day = start
+    while day <= end:
+        expected = farm_report(db_session, day)
+        actual = [{k: v for k, v in row.items() if k != "day"} for row in rows if row["day"] == day]
+        assert actual == [pytest.approx(row) for row in expected]
+        day += timedelta(days=1)
+    assert len(rows) == 12
+
+def test_range_report_without_cows(db_session):
+    frame = range_report_frame(db_session, datetime(2024, 10, 1), datetime(2024, 10, 2))
+
+    assert len(frame) == 0
+
+def stats_rows(db_session):
+    return [
+        (s.cow_id, s.day, s.milk_total, s.milk_count, s.weight_sum, s.weight_count, s.last_weight, s.last_weight_at)
+        for s in db_session.query(DailyCowStats).order_by(DailyCowStats.cow_id, DailyCowStats.day)
+    ]
+
+def test_incremental_rollup_matches_rebuild(db_session):
+    cow_id = str(uuid4())
+    db_session.add(Cow(id=cow_id, name='Bessie', birthdate=datetime(2020, 1, 1)))
+    day = datetime(2024, 10, 14)
+    insert_readings(db_session, "milk", [
+        {"cow_id": cow_id, "timestamp": day + timedelta(hours=6), "value": 10.0},
+        {"cow_id": cow_id, "timestamp": day + timedelta(hours=18), "value": 8.0},
+    ])
+    insert_readings(db_session, "milk", [{"cow_id": cow_id, "timestamp": day.date(), "value": 2.0}])
+    insert_readings(db_session, "weight", [
+        {"cow_id": cow_id, "timestamp": day + timedelta(hours=12), "value": 450.0},
+        {"cow_id": cow_id, "timestamp": day + timedelta(days=1), "value": 455.0},
+    ])
+    # an out-of-order reading does not replace the later last weight
+    insert_readings(db_session, "weight", [{"cow_id": cow_id, "timestamp": day + timedelta(hours=8), "value": 440.0}])
+    db_session.commit()
+
+    incremental = stats_rows(db_session)
+    rollup.rebuild(db_session)
+    db_session.commit()
+
+    assert incremental == stats_rows(db_session)
+    assert incremental[0][2:] == (20.0, 3, 890.0, 2, 450.0, day + timedelta(hours=12))